@@ -0,0 +1,206 @@
+"""
+Engine benchmark: the phases of a check, timed separately on a synthetic
+registry and fleet (see synthetic).
+
+    lookup      registry.get_registered_conditions + get_condition(pid)
+    filter      every handler's filter on the object
+    dispatch    picking the detector of each condition (get_detector)
+    construct   building the ContextualConditions
+    detect      ContextualCondition.detect
+    serialize   ContextualCondition.dict() to JSON
+
+Times are per operation (an object for lookup, a condition on an object
+for the others) - the best of --repeat runs.  The results are written as
+JSON and compared to a baseline - a phase slower than the baseline by more
+than the tolerance is a regression and the exit status is 1.
+
+benchmarks/baseline.json holds the reference results - the default
+parameters with --repeat 5, on the machine described in its 'meta'.
+Compare with the same parameters on comparable hardware (shared machines
+need a looser --tolerance), and record it again when a change is meant
+to move the numbers or the hardware changes.
+
+Usage:
+    python benchmarks/engine.py --objects 1000000 --output results.json
+    python benchmarks/engine.py --repeat 5 --baseline benchmarks/baseline.json --tolerance 0.1
+    python benchmarks/engine.py --repeat 5 --output benchmarks/baseline.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+logging.basicConfig(level=logging.ERROR)
+
+from proctor import Proctor, ContextualCondition
+import synthetic
+
+PHASES = ['lookup', 'filter', 'dispatch', 'construct', 'detect', 'serialize']
+
+
+class Timer(object):
+    """Accumulates the time and number of operations of a phase"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.ops = 0
+
+    def run(self, func, ops):
+        start = time.time()
+        func()
+        self.seconds += time.time() - start
+        self.ops += ops
+
+    def result(self):
+        return {
+            'ops': self.ops,
+            'seconds': round(self.seconds, 6),
+            'ns_per_op': round(self.seconds / self.ops * 1e9, 1) if self.ops else None,
+        }
+
+
+def run_chunk(registry, objects, timers):
+    """Time every phase on one chunk of the fleet"""
+    snapshot = registry.snapshot()
+    pids = [c.condition.pid for c in snapshot.values()]
+
+    found = []
+
+    def lookup():
+        del found[:]
+        for obj in objects:
+            found.append(registry.get_registered_conditions(obj.__class__))
+        for pid in pids:
+            registry.get_condition(pid)
+    timers['lookup'].run(lookup, len(objects) + len(pids))
+
+    pairs = [(obj, rc) for obj, conditions in zip(objects, found) for rc in conditions]
+    instances = {}
+    for obj, rc in pairs:
+        for handler in rc.detectors:
+            if handler not in instances:
+                instances[handler] = handler()
+
+    def filters():
+        for obj, rc in pairs:
+            for handler in rc.detectors:
+                instances[handler]._filter(obj)
+    timers['filter'].run(filters, sum(len(rc.detectors) for obj, rc in pairs))
+
+    def dispatch():
+        for obj, rc in pairs:
+            rc.get_detector(obj)
+    timers['dispatch'].run(dispatch, len(pairs))
+
+    contextual = []
+
+    def construct():
+        del contextual[:]
+        for obj, rc in pairs:
+            contextual.append(ContextualCondition(obj, rc))
+    timers['construct'].run(construct, len(pairs))
+
+    # The handlers are resolved by detect - not part of the construction
+    def detect():
+        for condition in contextual:
+            condition.detect()
+    timers['detect'].run(detect, len(contextual))
+
+    def serialize():
+        json.dumps([condition.dict().to_dict() for condition in contextual])
+    timers['serialize'].run(serialize, len(contextual))
+
+
+def run(options):
+    proctor = Proctor()
+    start = time.time()
+    built = synthetic.build_registry(
+        options.conditions, options.handlers, options.contexts, options.depth, options.seed)
+    setup = time.time() - start
+    registry = proctor._conditions
+
+    timers = dict((phase, Timer()) for phase in PHASES)
+    gc.collect()
+    for objects in synthetic.fleet(built, options.objects, options.chunk_size, options.seed):
+        run_chunk(registry, objects, timers)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'registry_seconds': round(setup, 6),
+        },
+        'params': dict((key, getattr(options, key)) for key in (
+            'conditions', 'handlers', 'contexts', 'depth', 'objects', 'chunk_size', 'seed', 'repeat')),
+        'phases': dict((phase, timer.result()) for phase, timer in timers.items()),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """The phases slower than the baseline by more than the tolerance"""
+    regressions = []
+    print("{:>10} {:>12} {:>12} {:>8}".format("phase", "baseline ns", "ns", "ratio"))
+    for phase in PHASES:
+        old = baseline['phases'].get(phase, {}).get('ns_per_op')
+        new = results['phases'][phase]['ns_per_op']
+        if not old or not new:
+            continue
+        ratio = new / old
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(phase)
+            flag = "  REGRESSION"
+        print("{:>10} {:12.1f} {:12.1f} {:7.2f}x{}".format(phase, old, new, ratio, flag))
+    if baseline.get('params') != results['params']:
+        print("Baseline ran with other parameters: {}".format(baseline.get('params')))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the phases of the proctor engine")
+    parser.add_argument('--conditions', type=int, default=50)
+    parser.add_argument('--handlers', type=int, default=4, help="detectors per condition")
+    parser.add_argument('--contexts', type=int, default=5, help="context class hierarchies")
+    parser.add_argument('--depth', type=int, default=6, help="classes per hierarchy")
+    parser.add_argument('--objects', type=int, default=100000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="runs - the best time of each phase is kept")
+    parser.add_argument('--output', help="write the results (JSON) to the file")
+    parser.add_argument('--baseline', help="compare to the results in the file")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="slowdown allowed (0.10 = 10%%)")
+    options = parser.parse_args(argv)
+    results = run(options)
+    for _ in range(options.repeat - 1):
+        other = run(options)
+        for phase in PHASES:
+            if other['phases'][phase]['seconds'] < results['phases'][phase]['seconds']:
+                results['phases'][phase] = other['phases'][phase]
+
+    for phase in PHASES:
+        result = results['phases'][phase]
+        print("{:>10}: {:10} ops {:9.3f}s {:10.1f} ns per op".format(
+            phase, result['ops'], result['seconds'], result['ns_per_op'] or 0))
+
+    if options.output:
+        with open(options.output, 'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as fin:
+            regressions = compare(results, json.load(fin), options.tolerance)
+        if regressions:
+            print("Slower than the baseline: {}".format(", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
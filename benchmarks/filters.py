@@ -0,0 +1,111 @@
+"""
+Micro benchmark: compiled ProctorObject filters vs the original closure.
+
+The closure below is the filter ProctorObjectMeta used to build for every
+class (dictionary walk, recursive get_property, debug strings formatted on
+every key).  It is kept here only as the reference to measure against.
+
+Usage:
+    python benchmarks/filters.py [iterations]
+"""
+import os
+import sys
+import timeit
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from proctor.predicates import compile_filter
+
+ilog = logging.getLogger('proctor.meta')
+
+
+def get_property(obj, key):
+    _keys = key.split(".")
+    if len(_keys) > 1:
+        return get_property(getattr(obj, _keys[0]), _keys[1])
+    else:
+        return getattr(obj, _keys[0])
+
+
+def legacy_filter(cls):
+    """The original _filter closure"""
+    def _filter(self, obj):
+        ilog.debug("Checking {}.filter()".format(cls.__name__))
+
+        for k, v in cls.applies_to.items():
+            try:
+                value = get_property(obj, k)
+            except Exception:
+                ilog.exception(u"Cannot get value for {}".format(k))
+                return False
+            ilog.debug("Value of {} {}".format(k, value))
+            if value not in v:
+                ilog.debug("{} {} not in {}".format(k, value, v))
+                return False
+
+        for k, v in cls.excludes.items():
+            try:
+                value = get_property(obj, k)
+            except Exception:
+                ilog.exception(u"Cannot get value for {}".format(k))
+                return True
+            ilog.debug("Value of {} {}".format(k, value))
+            if value in v:
+                ilog.debug("{} excluded {}".format(k, v))
+                return False
+        return True
+    return _filter
+
+
+class Owner(object):
+    def __init__(self, region):
+        self.region = region
+
+
+class Car(object):
+    def __init__(self, make, color, owner):
+        self.make = make
+        self.color = color
+        self.owner = owner
+
+
+class Spec(object):
+    """A handler spec typical of the plugins - a few keys, a dozen values"""
+    applies_to = {
+        '__class__.__name__': ['Car', 'Coupe', 'Sedan'],
+        'make': ['Toyota', 'Nissan', 'Honda', 'Mazda', 'Subaru', 'Lexus'],
+        'owner.region': ['west', 'north', 'south'],
+    }
+    excludes = {
+        'color': ['pink', 'purple', 'orange', 'teal', 'gold'],
+    }
+
+
+def main(iterations=200000):
+    logging.basicConfig(level=logging.WARNING)
+
+    legacy = legacy_filter(Spec)
+    compiled = compile_filter("Spec", Spec.applies_to, Spec.excludes)
+    cars = [
+        Car("Mazda", "red", Owner("south")),     # passes every key
+        Car("Ford", "red", Owner("south")),      # rejected on make
+        Car("Subaru", "gold", Owner("north")),   # excluded on color
+    ]
+    for car in cars:
+        assert legacy(None, car) == compiled(None, car)
+
+    results = {}
+    for label, func in [("legacy", legacy), ("compiled", compiled)]:
+        def run():
+            for car in cars:
+                func(None, car)
+        best = min(timeit.repeat(run, number=iterations // len(cars), repeat=3))
+        results[label] = best / (iterations // len(cars) * len(cars)) * 1e9
+        print("{:>10}: {:8.0f} ns per filter call".format(label, results[label]))
+
+    print("{:>10}: {:8.1f}x".format("speedup", results["legacy"] / results["compiled"]))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
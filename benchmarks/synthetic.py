@@ -0,0 +1,135 @@
+"""
+Synthetic registries and fleets for the benchmarks.
+
+    registry = build_registry(conditions=50, handlers=4, contexts=5, depth=6)
+    for chunk in fleet(registry, 1000000, chunk_size=1000):
+        ...
+
+A registry is K context class hierarchies, each a chain 'depth' classes
+deep (Asset0_0 <- Asset0_1 <- ...).  The N conditions are spread over the
+classes of the chains and get M detectors each, with applies_to/excludes
+specs on plain and dotted keys; one detector in four has a @prefilter
+instead.  The fleet is made of instances of the leaf classes - generated
+chunk by chunk, so millions of objects never live at once.
+"""
+import random
+from proctor import Proctor, Condition, ProctorObject
+from proctor.decorators import detector, prefilter
+
+MAKES = ['Toyota', 'Nissan', 'Honda', 'Mazda', 'Subaru', 'Ford', 'Fiat', 'Audi']
+COLORS = ['red', 'blue', 'black', 'white', 'silver', 'gold', 'green']
+REGIONS = ['north', 'south', 'east', 'west']
+
+
+class Owner(object):
+    __slots__ = ('region', 'tier')
+
+    def __init__(self, region, tier):
+        self.region = region
+        self.tier = tier
+
+
+class Asset(object):
+    """Root of the synthetic context classes"""
+
+    __slots__ = ('id', 'make', 'color', 'level', 'owner')
+
+    def __init__(self, id, make, color, level, owner):
+        self.id = id
+        self.make = make
+        self.color = color
+        self.level = level
+        self.owner = owner
+
+
+class Registry(object):
+    """What build_registry made - the context chains and the condition classes"""
+
+    def __init__(self, chains, conditions, handlers):
+        self.chains = chains
+        self.conditions = conditions
+        self.handlers = handlers
+
+    @property
+    def leaves(self):
+        return [chain[-1] for chain in self.chains]
+
+
+def _spec(rnd):
+    """applies_to/excludes of a handler - a few keys, a few values each"""
+    applies_to = {'make': rnd.sample(MAKES, rnd.randint(2, 6))}
+    if rnd.random() < 0.5:
+        applies_to['owner.region'] = rnd.sample(REGIONS, rnd.randint(1, 3))
+    excludes = {}
+    if rnd.random() < 0.5:
+        excludes['color'] = rnd.sample(COLORS, rnd.randint(1, 3))
+    return applies_to, excludes
+
+
+def _detector(threshold):
+    @detector
+    def check(self, obj):
+        if obj.level > threshold:
+            return True, "level {} over {}".format(obj.level, threshold), {'level': obj.level}
+    return check
+
+
+def _prefilter(tier):
+    @prefilter
+    def only_tier(self, obj):
+        return obj.owner.tier >= tier
+    return only_tier
+
+
+def build_registry(conditions=50, handlers=4, contexts=5, depth=6, seed=0):
+    """
+    Register a synthetic registry on Proctor() - whatever was registered
+    before is cleared.
+    """
+    rnd = random.Random(seed)
+    proctor = Proctor()
+    proctor.clear_registry()
+
+    with proctor.bulk_load():
+        chains = []
+        for k in range(contexts):
+            chain = []
+            base = Asset
+            for d in range(depth):
+                base = type("Asset{}_{}".format(k, d), (base,), {'__slots__': ()})
+                chain.append(base)
+            chains.append(chain)
+
+        condition_classes = []
+        handler_classes = []
+        for n in range(conditions):
+            context = rnd.choice(rnd.choice(chains))
+            condition = type("Synthetic{}".format(n), (Condition,), {
+                'name': "Synthetic condition {}".format(n),
+                'context': context,
+                'level': rnd.randint(1, 100),
+                'symptom': "Synthetic symptom {}".format(n),
+                'solution': "Synthetic solution {}".format(n),
+            })
+            condition_classes.append(condition)
+
+            for m in range(handlers):
+                attrs = {'condition': condition, 'context': context, 'check': _detector(rnd.randint(0, 99))}
+                if m % 4 == 3:
+                    attrs['only_tier'] = _prefilter(rnd.randint(0, 3))
+                else:
+                    attrs['applies_to'], attrs['excludes'] = _spec(rnd)
+                handler_classes.append(type("Synthetic{}Proctor{}".format(n, m), (ProctorObject,), attrs))
+
+    return Registry(chains, condition_classes, handler_classes)
+
+
+def fleet(registry, size, chunk_size=1000, seed=0):
+    """Objects of the leaf classes - lists of chunk_size of them"""
+    rnd = random.Random(seed)
+    leaves = registry.leaves
+    owners = [Owner(region, tier) for region in REGIONS for tier in range(4)]
+    for start in xrange(0, size, chunk_size):
+        yield [
+            rnd.choice(leaves)(i, rnd.choice(MAKES), rnd.choice(COLORS), rnd.randint(0, 99), rnd.choice(owners))
+            for i in xrange(start, min(start + chunk_size, size))]
@@ -0,0 +1,265 @@
+"""
+Load test of the proctor web endpoints - offline, on one box.
+
+Boots the webapp (web/) in process with a generated fleet of vehicles in
+place of the hand made ones, then sends concurrent requests to each
+endpoint - through the Django test client, or over HTTP to a local
+threaded WSGI server:
+
+    check       GET  /proctor/check/<pid>?model=cars.Vehicle&model_id=<id>
+    fix         GET  /proctor/fix/<pid>?model=cars.Vehicle&model_id=<id>
+    list        GET  /proctor/list?model=cars.Vehicle&model_id=<id>
+    check_all   POST /proctor/Vehicle/check_all (streamed)
+
+Reported per endpoint: p50/p95/p99 latency, requests per second, errors
+and - for the streamed check_all - the time to the first byte as well as
+the total time.  The webapp settings (PROCTOR_CHECK_ALL_*, PROCTOR_*)
+are read from the environment as usual.
+
+Usage:
+    python benchmarks/web_load.py --vehicles 10000 --concurrency 8 --requests 500
+    python benchmarks/web_load.py --server --endpoints check_all --requests 20 --output load.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import httplib
+import logging
+import argparse
+import tempfile
+import threading
+import Queue
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ENDPOINTS = ['check', 'fix', 'list', 'check_all']
+
+
+def setup_django():
+    """Import the webapp - with the library importable as proctor_lib (as the Dockerfile installs it)"""
+    try:
+        import proctor_lib
+    except ImportError:
+        libdir = tempfile.mkdtemp(prefix="proctor-load-")
+        os.symlink(os.path.join(ROOT, "proctor"), os.path.join(libdir, "proctor_lib"))
+        sys.path.insert(0, libdir)
+    sys.path.insert(0, os.path.join(ROOT, "web"))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webapp.settings')
+
+    import django
+    django.setup()
+
+
+def make_fleet(size, seed=0):
+    """Replace the vehicles of the cars app with generated ones - returns their ids"""
+    from cars import models
+
+    rnd = random.Random(seed)
+    makes = ["Toyota", "Ford", "Nissan", "Dodge", "Chevy", "Honda"]
+    colors = ["white", "red", "green", "gray", "black"]
+    classes = [models.Sedan, models.Coupe, models.Truck, models.Motorcycle]
+
+    models.vehicles.clear()
+    for i in xrange(size):
+        vehicle = rnd.choice(classes)(
+            rnd.randint(1990, 2018), rnd.choice(makes), "Model{}".format(i % 50),
+            rnd.choice(colors), rnd.choice([2, 3, 4]))
+        vehicle.gas_level = rnd.choice([0, 20, 50, 80])
+        vehicle.has_flat = rnd.random() < 0.1
+        models.vehicles[vehicle.id] = vehicle
+    return list(models.vehicles)
+
+
+def percentile(values, pct):
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(int(round(pct / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class ClientTransport(object):
+    """Requests through the Django test client - no sockets"""
+
+    def __init__(self):
+        from django.test import Client
+        from django.test.utils import setup_test_environment
+        setup_test_environment()
+        self.local = threading.local()
+        self.Client = Client
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, seconds to the first byte, seconds in all)"""
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.Client()
+        extra = dict(("HTTP_" + key.upper().replace("-", "_"), value) for key, value in (headers or {}).items())
+
+        start = time.time()
+        if method == "POST":
+            response = client.post(path, body, content_type="application/json", **extra)
+        else:
+            response = client.get(path, **extra)
+        first = None
+        if response.streaming:
+            for chunk in response.streaming_content:
+                if first is None and chunk:
+                    first = time.time() - start
+        else:
+            response.content
+        total = time.time() - start
+        return response.status_code, first if first is not None else total, total
+
+
+class ServerTransport(object):
+    """Requests over HTTP to a threaded WSGI server on localhost"""
+
+    def __init__(self):
+        from SocketServer import ThreadingMixIn
+        from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+        from django.core.wsgi import get_wsgi_application
+
+        class Server(ThreadingMixIn, WSGIServer):
+            daemon_threads = True
+
+        class Handler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        self.server = make_server("127.0.0.1", 0, get_wsgi_application(), Server, Handler)
+        self.port = self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            headers['Content-Type'] = "application/json"
+        conn = httplib.HTTPConnection("127.0.0.1", self.port, timeout=300)
+        try:
+            start = time.time()
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read(1)
+            first = time.time() - start
+            response.read()
+            return response.status, first, time.time() - start
+        finally:
+            conn.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def requests_for(endpoint, ids, pids, rnd):
+    """An endless supply of (method, path, body, headers) for the endpoint"""
+    json_accept = {'Accept': "application/json"}
+    while True:
+        _id = rnd.choice(ids)
+        if endpoint == 'check':
+            yield "GET", "/proctor/check/{}?model=cars.Vehicle&model_id={}".format(rnd.choice(pids), _id), None, json_accept
+        elif endpoint == 'fix':
+            yield "GET", "/proctor/fix/{}?model=cars.Vehicle&model_id={}".format(rnd.choice(pids), _id), None, json_accept
+        elif endpoint == 'list':
+            yield "GET", "/proctor/list?model=cars.Vehicle&model_id={}".format(_id), None, None
+        else:
+            yield "POST", "/proctor/Vehicle/check_all", json.dumps({'pids': pids}), None
+
+
+def drive(transport, requests, count, concurrency):
+    """Send count requests from concurrency threads - the timings of each"""
+    work = Queue.Queue()
+    for _ in xrange(count):
+        work.put(next(requests))
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                method, path, body, headers = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result = transport.request(method, path, body, headers)
+            except Exception as e:
+                logging.getLogger("load").error("{} {} failed: {}".format(method, path, e))
+                result = (None, None, None)
+            with lock:
+                results.append(result)
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.time() - start
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r[0] is not None and r[0] < 400]
+    totals = sorted(r[2] for r in ok)
+    firsts = sorted(r[1] for r in ok)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 1) if elapsed else None,
+        'latency_ms': dict(('p{}'.format(p), ms(percentile(totals, p))) for p in (50, 95, 99)),
+        'ttfb_ms': dict(('p{}'.format(p), ms(percentile(firsts, p))) for p in (50, 95, 99)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the proctor web endpoints")
+    parser.add_argument('--vehicles', type=int, default=1000, help="size of the generated fleet")
+    parser.add_argument('--endpoints', default=",".join(ENDPOINTS))
+    parser.add_argument('--requests', type=int, default=200, help="requests per endpoint")
+    parser.add_argument('--check-all-requests', type=int, default=10, help="requests for check_all")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--server', action='store_true', help="go through a local WSGI server")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results (JSON) to the file")
+    parser.add_argument('--verbose', action='store_true', help="keep the webapp logging")
+    options = parser.parse_args(argv)
+
+    setup_django()
+    if not options.verbose:
+        logging.disable(logging.WARNING)
+
+    from proctor_lib import Proctor
+    ids = make_fleet(options.vehicles, options.seed)
+    pids = [c.condition.pid for c in Proctor()._conditions.conditions()]
+    transport = ServerTransport() if options.server else ClientTransport()
+    rnd = random.Random(options.seed)
+
+    results = {
+        'params': dict((key, getattr(options, key)) for key in (
+            'vehicles', 'requests', 'check_all_requests', 'concurrency', 'server', 'seed')),
+        'endpoints': {},
+    }
+    print("{:>10} {:>6} {:>6} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+        "endpoint", "reqs", "errors", "rps", "p50 ms", "p95 ms", "p99 ms", "ttfb p50"))
+    for endpoint in options.endpoints.split(","):
+        count = options.check_all_requests if endpoint == 'check_all' else options.requests
+        timings, elapsed = drive(transport, requests_for(endpoint, ids, pids, rnd), count, options.concurrency)
+        summary = results['endpoints'][endpoint] = summarize(timings, elapsed)
+        print("{:>10} {:6} {:6} {:8} {:>9} {:>9} {:>9} {:>9}".format(
+            endpoint, summary['requests'], summary['errors'], summary['rps'],
+            summary['latency_ms']['p50'], summary['latency_ms']['p95'], summary['latency_ms']['p99'],
+            summary['ttfb_ms']['p50']))
+
+    if options.server:
+        transport.close()
+    if options.output:
+        with open(options.output, 'w') as fout:
+            json.dump(results, fout, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
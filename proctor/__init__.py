@@ -18,21 +18,36 @@ to the core code base.
 At some point we could slap a GUI on the Proctor to code a condition on
 the fly so that we can add custom reporting without a deployment.
 """
+import gc
+import os
 import sys
 import copy
+import time
 import hashlib
 import logging
 import warnings
-from mapping import Mapping
+from contextlib import contextmanager
+from .records import ConditionResult
 from .registry import ConditionRegistry
 from .exceptions import NotRegistered, BadProctorCondition
+from .predicates import compile_filter
+from .cache import ResultCache, CachedResult
+from .tracking import DependencyTracker, RecordingProxy, reads
+from .fixtures import FixtureScope
+from .metrics import Metrics
+import manifest
 import plugin_support as plugins
+import batch
 
 log = logging.getLogger("proctor")
 ilog = logging.getLogger('proctor.meta')
 clog = logging.getLogger('proctor.condition')
 
 
+# Marks a lazily resolved handler that was not looked up yet
+_UNRESOLVED = object()
+
+
 def warnFormatter(message, category, filename, lineno, line=None):
     return "{}: {}".format(category.__name__, message)
 warnings.formatwarning = warnFormatter
@@ -40,7 +55,7 @@ warnings.formatwarning = warnFormatter
 
 def get_property(obj, key):
     """Get the value of a related property - however deep"""
-    _keys = key.split(".")
+    _keys = key.split(".", 1)
 
     # dotted keys "x.y.z"
     if len(_keys) > 1:
@@ -59,11 +74,13 @@ class ProctorSingleton(type):
     _instances = {}
 
     def __call__(self, *args, **kwargs):
-        if self not in self._instances:
+        try:
+            return self._instances[self]
+        except KeyError:
             inst = super(ProctorSingleton, self).__call__(*args, **kwargs)
             self._instances[self] = inst
             inst.load_plugins()
-        return self._instances[self]
+            return inst
 
 
 class Proctor(object):
@@ -71,39 +88,182 @@ class Proctor(object):
 
     __metaclass__ = ProctorSingleton
 
+    # Import plugin modules only when their contexts are looked up - see manifest
+    lazy_plugins = False
+
     def __init__(self, extpaths=None):
         self._conditions = ConditionRegistry()
+        self._conditions.loader = self._load_modules
         self.plugin_dirs = extpaths if extpaths else []
+        # The directories loaded (or indexed) already - see load_plugins
+        self._loaded_dirs = set()
+        self.result_cache = None
+        self.dependency_tracker = None
+        self.metrics = None
+        self._fixtures = {}
+
+        # Time spent loading plugins (in bulk_load) - imports and registration
+        self.plugin_load_seconds = 0.0
 
     """
     Methods that deal with loading conditions, detectors, and
     rectifiers.
     """
 
+    @contextmanager
+    def bulk_load(self):
+        """
+        Register a batch of classes (loading plugins) - the handlers are
+        sorted and the registry published once, at the end of the batch.
+        """
+        outermost = not self._conditions.in_bulk
+        start = time.time()
+        with self._conditions.bulk():
+            if outermost:
+                logging.captureWarnings(True)
+            try:
+                yield
+            finally:
+                if outermost:
+                    logging.captureWarnings(False)
+                    if self.dependency_tracker is not None or self.result_cache is not None:
+                        self.invalidate_results()
+        if outermost:
+            self.plugin_load_seconds += time.time() - start
+
     def load_plugins(self):
-        """Load all the directories"""
-        for path in self.plugin_dirs:
-            self.load_plugins_from(path)
+        """
+        Load the directories not loaded yet - each directory is loaded once,
+        lazily or not as it was added (see reload_plugins for the changes)
+        """
+        with self.bulk_load():
+            for path in self.plugin_dirs:
+                if path not in self._loaded_dirs:
+                    self.load_plugins_from(path)
 
-    def load_plugins_from(self, dirname):
-        """Loads plugins from a directory"""
+    def load_plugins_from(self, dirname, lazy=None):
+        """
+        Loads plugins from a directory.
+        lazy: only index the modules (see manifest) and import them when
+        their contexts are looked up - defaults to lazy_plugins
+        """
+        lazy = self.lazy_plugins if lazy is None else lazy
+        self._loaded_dirs.add(dirname)
         try:
-            if plugins.load(dirname):
+            if lazy:
+                loaded = self.index_plugins(dirname)
+            else:
+                with self.bulk_load():
+                    loaded = plugins.load(dirname)
+                # Imported now - not to be imported again on lookup
+                prefix = os.path.join(dirname, '')
+                self._conditions.discard_pending(path for path in plugins.loaded if path.startswith(prefix))
+            if loaded:
                 log.info(u"Successfully loaded plugins from {}".format(dirname))
         except Exception as e:
             log.exception(u"Failed to load extensions at {}. {}".format(dirname, e.message))
 
+    def index_plugins(self, dirname):
+        """Index the plugin modules of a directory to import them when needed"""
+        if not os.path.isdir(dirname):
+            log.warn("{} does not exist".format(dirname))
+            return False
+
+        # The modules imported already are left out
+        modules = dict(
+            (path, entry) for path, entry in manifest.scan_directory(dirname).iteritems()
+            if path not in plugins.loaded)
+        eager = self._conditions.add_pending(modules)
+        pending = self._conditions.pending
+        log.info(u"Indexed plugins in {} - {} contexts pending".format(dirname, len(pending) if pending else 0))
+        self._load_modules(eager)
+        return True
+
+    def reload_plugins(self):
+        """
+        Pick up the plugin modules that changed on disk - without clearing the registry.
+
+        Each changed module is imported again and what it registered (conditions,
+        handlers, fixtures) swapped for what it registers now; modules that are
+        gone are taken out and new modules of the plugin directories loaded.
+        Readers see the old registry until the new one is published, at once.
+        Modules that import from a changed module keep what they imported.
+
+        Returns the paths of the modules loaded, reloaded or removed.
+        """
+        changed = plugins.changed_modules()
+        new = []
+        for dirname in self.plugin_dirs:
+            for root, dirs, files in os.walk(dirname):
+                for filename in files:
+                    path = os.path.join(root, filename)
+                    if not filename.endswith(".py") or path in plugins.loaded:
+                        continue
+                    if self._conditions.pending is not None and path in self._conditions.pending:
+                        continue
+                    new.append(path)
+        if not changed and not new:
+            return []
+
+        with self.bulk_load():
+            for path in changed:
+                module_name = plugins.loaded.pop(path)['module']
+                log.info(u"Reloading {} ({})".format(path, module_name))
+                orphans = self._conditions.unregister_module(module_name)
+                for name, func in self._fixtures.items():
+                    if func.__module__ == module_name:
+                        del self._fixtures[name]
+                if os.path.exists(path):
+                    plugins.load_module(path)
+                else:
+                    sys.modules.pop(module_name, None)
+                self._conditions.adopt(orphans)
+
+            for path in new:
+                log.info(u"Loading new plugin {}".format(path))
+                plugins.load_module(path)
+
+        return changed + new
+
+    def freeze(self, classes=()):
+        """
+        Get the registry ready to be shared - call it in the master of a
+        pre-fork server, after the plugins are loaded and before forking.
+
+        The pending plugins are imported and the dispatch tables and per
+        class lookups built (see ConditionRegistry.freeze) so the workers
+        do not each redo them, then the garbage is collected and, where
+        the interpreter has gc.freeze, what is left is moved out of the
+        collector's reach so collections in the workers do not write to
+        (and copy) the shared pages.
+        """
+        start = time.time()
+        snapshot = self._conditions.freeze(classes)
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        log.info("Froze the registry - {} conditions in {:.3f}s".format(len(snapshot), time.time() - start))
+        return snapshot
+
+    def _load_modules(self, paths):
+        """Import plugin modules - see index_plugins"""
+        with self.bulk_load():
+            for path in paths:
+                plugins.load_module(path)
+
     def add_module(self, name):
         """Load a module that contains conditions and detectors"""
         log.debug(u"Adding module {}".format(name))
-        plugins.load_module(name)
+        with self.bulk_load():
+            plugins.load_module(name)
 
-    def add_paths(self, paths):
+    def add_paths(self, paths, lazy=None):
         """Appends the plugin path after loading"""
-        for path in paths:
-            if path not in self.plugin_dirs:
-                self.load_plugins_from(path)
-            self.plugin_dirs.append(path)
+        with self.bulk_load():
+            for path in paths:
+                if path not in self.plugin_dirs:
+                    self.load_plugins_from(path, lazy=lazy)
+                    self.plugin_dirs.append(path)
 
     @property
     def condition_list(self):
@@ -113,12 +273,21 @@ class Proctor(object):
     def register(self, cls):
         """Registers both Conditions and ProctorObjects"""
         log.debug("Registering {}".format(cls.__name__))
+        if self._conditions.in_bulk:
+            # Warnings are captured for the whole batch - see bulk_load
+            self._conditions.register(cls)
+            return
         logging.captureWarnings(True)
         self._conditions.register(cls)
         logging.captureWarnings(False)
 
-    def get_registry(self):
-        """Returns the registry (a copy)"""
+    def get_registry(self, load=True):
+        """
+        Returns the registry (an immutable snapshot).
+        load=False: as it is - the lazy plugins not imported yet are left out
+        """
+        if not load:
+            return self._conditions.snapshot()
         return self._conditions.get_registry()
 
     def show_registry(self):
@@ -190,6 +359,74 @@ class Proctor(object):
         log.critical("Clearing condition registry")
         self._conditions.reset()
         self.plugin_dirs = []
+        self._fixtures = {}
+        self.invalidate_results()
+
+    """
+    Methods that deal with fixtures - see fixtures.
+    """
+
+    def register_fixture(self, name, func):
+        if name in self._fixtures and self._fixtures[name].__module__ != func.__module__:
+            log.warn("Fixture {} redefined by {}".format(name, func.__module__))
+        self._fixtures[name] = func
+
+    def fixture_scope(self, context):
+        """Fixtures shared by the checks of the context - for one check pass"""
+        return FixtureScope(context, self._fixtures, tracking=self.dependency_tracker is not None)
+
+    """
+    Methods that deal with caching detection results - see cache.
+    """
+
+    def enable_result_cache(self, max_size=10000, ttl=300, version=None):
+        """
+        Cache detection results of versioned objects.
+
+        version: hook that gives the version of an object (see cache.context_version)
+        """
+        log.info("Caching results max_size={} ttl={}".format(max_size, ttl))
+        self.result_cache = ResultCache(max_size=max_size, ttl=ttl, version=version)
+
+    def disable_result_cache(self):
+        self.result_cache = None
+
+    def invalidate_results(self, context=None):
+        """Forget the cached results (and tracked reads) of the context - or all of them"""
+        for store in (self.result_cache, self.dependency_tracker):
+            if store is not None:
+                if context is None:
+                    store.clear()
+                elif store is self.result_cache:
+                    store.invalidate(context)
+                else:
+                    store.forget(context)
+
+    """
+    Methods that deal with tracking what the checks read - see tracking.
+    """
+
+    def enable_dependency_tracking(self, max_size=10000):
+        """Record the attributes each condition reads on an object"""
+        log.info("Tracking dependencies max_size={}".format(max_size))
+        self.dependency_tracker = DependencyTracker(max_size=max_size)
+
+    def disable_dependency_tracking(self):
+        self.dependency_tracker = None
+
+    """
+    Methods that deal with timing the handlers - see metrics.
+    """
+
+    def enable_metrics(self):
+        """Time and count the detector and rectifier calls - returns the Metrics"""
+        if self.metrics is None:
+            log.info("Recording handler metrics")
+            self.metrics = Metrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
 
 
 class ProctorObjectMeta(type):
@@ -221,6 +458,16 @@ class ProctorObjectMeta(type):
             if hasattr(method, "is_detector"):
                 _cls["_is_detector"] = True
                 _cls["_detector"] = method
+                _cls["_evaluate"] = method.evaluate
+                _cls["_batch_detector"] = None
+                detector = True
+
+            # Has a decorated batch detector? (it brings its own detector)
+            if hasattr(method, "is_batch_detector"):
+                _cls["_is_detector"] = True
+                _cls["_detector"] = method.detector
+                _cls["_evaluate"] = method.detector.evaluate
+                _cls["_batch_detector"] = method
                 detector = True
 
             # Has a decorated filter method?
@@ -230,6 +477,7 @@ class ProctorObjectMeta(type):
             if hasattr(method, "is_filter"):
                 ilog.debug("{} has prefilter".format(name))
                 _cls['_has_filter'] = True
+                _cls['_spec_filter'] = False
                 _cls['_filter'] = method
                 # Make it the hightest priority
                 _cls['_filter_priority'] = sys.maxint
@@ -243,35 +491,6 @@ class ProctorObjectMeta(type):
         # - NOTE: This purposley breaks inheritence of the _filter property.
         if not hasattr(cls.__dict__, "_filter") and "_filter" not in _cls:
 
-            # Declare the filter method that will honor 'applied_to' and 'excludes'.
-            def _filter(self, obj):
-                ilog.debug("Checking {}.filter()".format(cls.__name__))
-
-                for k, v in cls.applies_to.items():
-                    # try to get the value for the key
-                    try:
-                        value = get_property(obj, k)
-                    except Exception:
-                        ilog.exception(u"Cannot get value for {}".format(k))
-                        return False
-                    ilog.debug("Value of {} {}".format(k, value))
-                    if value not in v:
-                        ilog.debug("{} {} not in {}".format(k, value, v))
-                        return False
-
-                for k, v in cls.excludes.items():
-                    # try to get the value for the key
-                    try:
-                        value = get_property(obj, k)
-                    except Exception:
-                        ilog.exception(u"Cannot get value for {}".format(k))
-                        return True
-                    ilog.debug("Value of {} {}".format(k, value))
-                    if value in v:
-                        ilog.debug("{} excluded {}".format(k, v))
-                        return False
-                return True
-
             """
             ProctorObject Priority:
 
@@ -307,7 +526,12 @@ class ProctorObjectMeta(type):
                 ilog.debug("{} priority {}".format(cls.__name__, priority))
 
                 cls._filter_priority = priority
-                cls._filter = _filter
+
+                # Declare the filter method that will honor 'applied_to' and 'excludes'.
+                cls._filter = compile_filter(cls.__name__, cls.applies_to, cls.excludes)
+
+                # Only depends on 'applies_to' and 'excludes' - see dispatch
+                cls._spec_filter = True
             except Exception:
                 warnings.warn("{} NOT REGISTERED: Cannot determine filter priority".format(name), NotRegistered)
                 return
@@ -332,6 +556,11 @@ class ProctorObject(object):
     applies_to = {}
     excludes = {}
 
+    # Related objects the handler reads (dotted paths) - hints for
+    # providers that can fetch them along with the context (e.g. the ORM)
+    select_related = ()
+    prefetch_related = ()
+
     @classmethod
     def context_name(cls):
         return cls.context if isinstance(cls.context, basestring) else cls.context.__name__
@@ -358,28 +587,50 @@ class ConditionMeta(type):
             log.warn("Cannot register {}".format(cls.__name__))
 
 
-class ContextualCondition(Mapping):
+class ContextualCondition(object):
     """
     Represents a condition checker that contains a context.
     Will contain the detector and the rectifier for the object
     being checked.  Pretty much a RegisteredCondition Proxy
     """
 
-    def __init__(self, context, registered_condition):
-        super(ContextualCondition, self).__init__()
+    __slots__ = (
+        '__reg_condition', 'level', 'exposed', 'context', 'name', '_rectifier', '_detector',
+        'detected', 'rectified', 'pid', 'detector_tried', 'rectifier_tried', 'last_message', '_cache_key',
+        'fixtures')
+
+    def __init__(self, context, registered_condition, fixtures=None):
         self.__reg_condition = registered_condition
         self.level = registered_condition.condition.level
         self.exposed = registered_condition.condition.exposed
         self.context = context
         self.name = self.__reg_condition.name
-        self.rectifier = self.__reg_condition.get_rectifier(context)
-        self.detector = self.__reg_condition.get_detector(context)
+
+        # The handlers are looked up when first needed
+        self._rectifier = _UNRESOLVED
+        self._detector = _UNRESOLVED
         self.detected = None
         self.rectified = None
         self.pid = self.__reg_condition.condition.pid
         self.detector_tried = False
         self.rectifier_tried = False
         self.last_message = ""
+        self._cache_key = None
+        self.fixtures = fixtures
+
+    @property
+    def detector(self):
+        """The detector that applies to the context"""
+        if self._detector is _UNRESOLVED:
+            self._detector = self.__reg_condition.get_detector(self.context)
+        return self._detector
+
+    @property
+    def rectifier(self):
+        """The rectifier that applies to the context"""
+        if self._rectifier is _UNRESOLVED:
+            self._rectifier = self.__reg_condition.get_rectifier(self.context)
+        return self._rectifier
 
     @property
     def detectable(self):
@@ -404,25 +655,122 @@ class ContextualCondition(Mapping):
 
     def detect(self):
         """Where the magic happens"""
+        tracker = Proctor().dependency_tracker
+        context = self.context
+        used = None
+        if tracker is not None:
+            # Resolve and run the handlers on a proxy that records the reads -
+            # the detector is picked again so the reads of the filters count
+            context = RecordingProxy(self.context)
+            self._detector = self.__reg_condition.get_detector(context)
+
+        names = ()
+        cached = None
         if self.detectable:
             self.detector_tried = True
-            try:
-                self.detector()._detector(self.context)
-                self.detected = False
-            except Condition as c:
-                # Condition raised means we 100% found the issue
-                self.detected = c
-            except Exception as e:
-                # Any other exception means inconclusive
-                log.exception("unexpected exception in detector")
-                self.detected = None
-                self.last_message = e.message
-
+            cached = self._from_cache()
+            if cached is None:
+                try:
+                    detector = self.detector()
+                    kwargs = {}
+                    names = detector._evaluate.fixtures
+                    if names:
+                        if self.fixtures is None:
+                            self.fixtures = Proctor().fixture_scope(self.context)
+                        kwargs = self.fixtures.arguments(names)
+
+                    # A detection means we 100% found the issue
+                    self.detected = detector._evaluate(context, **kwargs) or False
+                except Exception as e:
+                    # Any other exception means inconclusive
+                    log.exception("unexpected exception in detector")
+                    self.detected = None
+                    self.last_message = e.message
+            elif tracker is None:
+                return self.detected
+
+        if tracker is not None:
+            if self.detected:
+                self.detected.rebind(self.context)
+            used = reads(context)
+            if names and self.fixtures is not None:
+                used |= self.fixtures.reads(names)
+            if cached is not None:
+                # What the check read when the result was cached - None if it was not tracked
+                used = used | cached.reads if cached.reads is not None else None
+            tracker.record(self.pid, self.context, used)
+
+        if self.detectable and cached is None:
+            self._to_cache(used)
         return self.detected
 
+    def _from_cache(self):
+        """Take the detection from the result cache - the CachedResult, None if it was not there"""
+        cache = Proctor().result_cache
+        if cache is None or self.__reg_condition.condition.cache_ttl == 0:
+            return None
+
+        self._cache_key = cache.key(self.pid, self.context)
+        if self._cache_key is None:
+            return None
+        try:
+            cached = cache.get(self._cache_key)
+        except KeyError:
+            return None
+
+        self.detected = False
+        if cached.detected:
+            self.detected = Detection(
+                cached.condition, cached.message, self.context, cached.detector, dict(cached.data))
+        return cached
+
+    def _to_cache(self, reads=None):
+        """Keep a conclusive detection in the result cache - with the attributes the check read"""
+        cache = Proctor().result_cache
+        if cache is None or self._cache_key is None or self.detected is None:
+            return
+        cache.put(self._cache_key, CachedResult(self.detected, reads), ttl=self.__reg_condition.condition.cache_ttl)
+
+    @staticmethod
+    def detect_many(conditions):
+        """
+        Detect a list of contextual conditions.
+        Contexts that share a batch detector are detected with one call
+        (unless dependencies are tracked - each context is then detected alone).
+        """
+        if Proctor().dependency_tracker is not None:
+            for condition in conditions:
+                condition.detect()
+            return conditions
+
+        batches = {}
+        for condition in conditions:
+            if condition.detectable and getattr(condition.detector, "_batch_detector", None):
+                if condition._from_cache() is not None:
+                    condition.detector_tried = True
+                    continue
+                batches.setdefault(condition.detector, []).append(condition)
+            else:
+                condition.detect()
+
+        for detector, _conditions in batches.iteritems():
+            results = batch.run(detector, [c.context for c in _conditions])
+            for condition, (status, message) in zip(_conditions, results):
+                condition.detector_tried = True
+                if status:
+                    # Only the hits get a detection
+                    condition.detected = Detection(detector.condition, message, condition.context, detector)
+                elif status is None:
+                    condition.detected = None
+                    condition.last_message = message
+                else:
+                    condition.detected = False
+                condition._to_cache()
+        return conditions
+
     def dict(self):
         """Serialize the condition"""
-        data = Mapping()
+        data = ConditionResult()
         data['type'] = self.__reg_condition.condition.__name__
         data.check_key = self.__reg_condition.condition.name
         data.level = self.level
@@ -455,6 +803,104 @@ class ContextualCondition(Mapping):
         return data
 
 
+class Detection(object):
+    """
+    A detected condition, recorded without raising it.
+
+    Holds what is needed to report and rectify the condition; the
+    Condition (exception) itself is only built when asked for - for
+    code that still raises and catches conditions.
+    """
+
+    __slots__ = ('condition', 'message', 'context', 'detector', 'data', '_rectifier', '_exception')
+
+    def __init__(self, condition, message, context, detector=None, data=None, exception=None):
+        self.condition = condition
+        self.message = message
+        self.context = context
+        self.detector = detector
+        self.data = data or {}
+        self._exception = exception
+        self._rectifier = exception.rectifier if exception is not None else _UNRESOLVED
+
+    @classmethod
+    def of(cls, condition):
+        """The detection of a raised condition"""
+        return cls(
+            condition.__class__, condition.message, condition.context_instance,
+            condition.detector, condition.data, exception=condition)
+
+    def rebind(self, context):
+        """Attach the detection (and its condition) to another context"""
+        self.context = context
+        if self._exception is not None:
+            self._exception.set_context(context)
+
+    def exception(self):
+        """The condition (exception) for this detection - built once"""
+        if self._exception is None:
+            self._exception = self.condition(self.message, self.context, self.detector, **self.data)
+        return self._exception
+
+    @property
+    def rectifier(self):
+        if self._rectifier is _UNRESOLVED:
+            try:
+                self._rectifier = Proctor().get_rectifier(self.condition, self.context)
+            except Exception:
+                self._rectifier = None
+        return self._rectifier
+
+    @property
+    def rectifiable(self):
+        return not (self.rectifier is None)
+
+    @property
+    def context_id(self):
+        if isinstance(self.context, object) and hasattr(self.context, "id"):
+            return self.context.id
+        elif isinstance(self.context, basestring):
+            return ""
+        return None
+
+    def rectify(self):
+        """Rectify the condition - the rectifier gets the condition (exception)"""
+        if self.rectifiable:
+            return self.rectifier()._rectify(self.context, condition=self.exception())
+        return False
+
+    def dict(self):
+        """Cast to a result record - same as Condition.dict"""
+        data = ConditionResult()
+        data.check_key = self.condition.name
+        data.error_code = 1
+        data.error_code_string = self.condition.context_name()
+        data.msg = self.message
+        data.ctxt_class = self.context.__class__.__name__
+        data.ctxt_id = self.context_id
+
+        data.symptom = self.condition.symptom
+        data.solution = self.condition.solution
+        data.level = self.condition.level
+        data.exposed = self.condition.exposed
+        data.pid = self.condition.pid
+        if self.rectifiable:
+            data.rectifiable = True
+            data.rectifier = self.rectifier.__name__
+        else:
+            data.rectifiable = False
+            data.rectifier = None
+        return data
+
+    def __nonzero__(self):
+        return True
+
+    def __repr__(self):
+        return "{}:{}".format(self.condition.name, self.message)
+
+    __str__ = __repr__
+
+
 class Condition(Exception):
     """
     Represents a condition.
@@ -476,6 +922,9 @@ class Condition(Exception):
     exposed = False
     level = 1
 
+    # Seconds to cache detection results (None - the cache default, 0 - never)
+    cache_ttl = None
+
     # HACK because I cannot figure out code structure to check the type
     _is_condition = True
 
@@ -486,7 +935,7 @@ class Condition(Exception):
         self.detector = detector
         self.data = copy.deepcopy(kwargs)
 
-        super(Condition, self).__init__(message, **kwargs)
+        super(Condition, self).__init__(message)
         self.set_context(context_instance)
 
     def rectify(self):
@@ -515,8 +964,8 @@ class Condition(Exception):
             self.rectifier = None
 
     def dict(self):
-        """Cast to serializable dict"""
-        data = Mapping()
+        """Cast to a result record"""
+        data = ConditionResult()
         data.check_key = self.name
         data.error_code = 1
         data.error_code_string = self.__class__.context_name()
@@ -551,10 +1000,10 @@ class Condition(Exception):
 
     @classmethod
     def class_info(cls):
-        data = Mapping(cls.__dict__)
-        data.context = cls.context_name()
-        data.exposed = cls.exposed
-        data.level = cls.level
+        data = dict(cls.__dict__)
+        data['context'] = cls.context_name()
+        data['exposed'] = cls.exposed
+        data['level'] = cls.level
         return data
 
     def __repr__(self):
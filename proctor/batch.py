@@ -0,0 +1,117 @@
+"""
+Batch detection.
+
+A detector decorated with @batch_detector is handed a list of contexts
+at once - and optionally a columnar view of the attributes it declares -
+and returns a boolean mask (plus optional per-row messages):
+
+    class NoGasProctor(VehicleProctor):
+        condition = NoGas
+
+        @batch_detector(columns=['gas_level'])
+        def check_gas(self, cars, columns):
+            return columns['gas_level'] <= 0
+
+The columns are numpy arrays when numpy is installed, plain lists when it
+is not.  The condition is only created for the rows that hit.
+"""
+import logging
+from .predicates import property_getter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+dlog = logging.getLogger('proctor.detector')
+
+
+def column_view(contexts, names):
+    """
+    Read the named (dotted) attributes of every context as columns.
+
+    Returns (columns, readable) where readable are the indexes of the
+    contexts that had every attribute - only those rows are in the columns.
+    """
+    getters = [property_getter(name) for name in names]
+    rows = []
+    readable = []
+    for i, context in enumerate(contexts):
+        try:
+            rows.append([getter(context) for getter in getters])
+        except Exception:
+            continue
+        readable.append(i)
+
+    columns = {}
+    for j, name in enumerate(names):
+        values = [row[j] for row in rows]
+        columns[name] = numpy.array(values) if numpy is not None else values
+    return columns, readable
+
+
+def hits(mask):
+    """Indexes of the rows where the mask is set"""
+    if numpy is not None and isinstance(mask, numpy.ndarray):
+        return numpy.flatnonzero(mask).tolist()
+    return [i for i, hit in enumerate(mask) if hit]
+
+
+def message_for(messages, i, default):
+    """Per row message - messages may be a sequence or a dict of row: message"""
+    if messages is None:
+        return default
+    try:
+        message = messages[i]
+    except (IndexError, KeyError):
+        return default
+    return message if message else default
+
+
+def run(detector_cls, contexts):
+    """
+    Run the batch detector of the class over the contexts.
+
+    Returns a list with an entry per context:
+        (True, message) - the condition was detected
+        (False, None)   - it was not
+        (None, reason)  - inconclusive (attribute missing, detector blew up)
+    """
+    results = [(None, "")] * len(contexts)
+    batch = detector_cls._batch_detector
+    columns = None
+    rows = range(len(contexts))
+    if batch.columns:
+        columns, rows = column_view(contexts, batch.columns)
+        for i in set(range(len(contexts))) - set(rows):
+            results[i] = (None, "Cannot read {}".format(", ".join(batch.columns)))
+
+    batch_contexts = [contexts[i] for i in rows]
+    metrics = _proctor().metrics
+    started = metrics.start() if metrics is not None and batch_contexts else None
+    try:
+        mask, messages = detector_cls()._batch_detector(batch_contexts, columns)
+    except Exception as e:
+        if started:
+            metrics.stop(started, 'detector', detector_cls, calls=len(batch_contexts), errors=len(batch_contexts))
+        dlog.exception("Batch detector {} cause unhandled exception - cannot trust detection".format(
+            detector_cls.__name__))
+        for i in rows:
+            results[i] = (None, getattr(e, 'message', str(e)))
+        return results
+
+    default = batch.__doc__.strip() if batch.__doc__ else ""
+    for i in rows:
+        results[i] = (False, None)
+    found = hits(mask)
+    if started:
+        metrics.stop(started, 'detector', detector_cls, calls=len(batch_contexts), hits=len(found))
+    for i in found:
+        results[rows[i]] = (True, message_for(messages, i, default))
+    return results
+
+
+def _proctor():
+    # proctor imports this module
+    from . import Proctor
+    return Proctor()
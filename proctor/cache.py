@@ -0,0 +1,134 @@
+"""
+Detection result cache.
+
+Results are keyed on (pid, context class, context id, context version),
+so a result is only reused while the object has not changed.  The version
+comes from a hook - by default a 'proctor_version()' method, or an
+'updated_at' or 'version' attribute of the object.  Objects without a
+version (or an id) are never cached.
+
+Entries expire after a TTL (a Condition can declare its own 'cache_ttl',
+0 meaning never cache it) and the least recently used entries are evicted
+past max_size.  Running a rectifier invalidates every entry of its context.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger("proctor.cache")
+
+
+def context_version(obj):
+    """Default version hook"""
+    version = getattr(obj, "proctor_version", None)
+    if callable(version):
+        return version()
+    for attr in ("updated_at", "version"):
+        version = getattr(obj, attr, None)
+        if version is not None:
+            return version
+    return None
+
+
+class CachedResult(object):
+    """
+    What is kept of a conclusive check - the detection but its context, and
+    the attributes the check read (see tracking) - None if it was not tracked
+    """
+
+    __slots__ = ('detected', 'condition', 'message', 'detector', 'data', 'reads')
+
+    def __init__(self, detection, reads=None):
+        self.detected = bool(detection)
+        self.condition = self.message = self.detector = self.data = None
+        if detection:
+            self.condition = detection.condition
+            self.message = detection.message
+            self.detector = detection.detector
+            self.data = dict(detection.data)
+        self.reads = reads
+
+
+class ResultCache(object):
+    """LRU cache of detection results with per entry expiry"""
+
+    def __init__(self, max_size=10000, ttl=300, version=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = version or context_version
+        self._entries = OrderedDict()
+        self._contexts = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def context_key(context):
+        return (context.__class__, getattr(context, "id", None))
+
+    def key(self, pid, context):
+        """The cache key for a condition on a context - None if it has no version"""
+        try:
+            version = self.version(context)
+        except Exception:
+            log.exception("Cannot get the version of {}".format(context))
+            return None
+        if version is None or getattr(context, "id", None) is None:
+            return None
+        return (pid,) + self.context_key(context) + (version,)
+
+    def get(self, key):
+        """Get a cached result or raise KeyError"""
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            if expires < time.time():
+                self._forget(key)
+                self.misses += 1
+                raise KeyError(key)
+
+            # Most recently used goes last
+            self._entries[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if not ttl:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            self._contexts.setdefault(key[1:3], set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                del self._entries[oldest]
+                self._forget(oldest)
+
+    def _forget(self, key):
+        keys = self._contexts.get(key[1:3])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._contexts[key[1:3]]
+
+    def invalidate(self, context):
+        """Drop every result of the context - all conditions, all versions"""
+        with self._lock:
+            for key in self._contexts.pop(self.context_key(context), ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._contexts.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
@@ -1,36 +1,55 @@
 import logging
 from functools import wraps
-from . import Condition
+from . import Proctor, Condition, Detection
+from .batch import column_view, hits, message_for
+from .fixtures import fixture_names
 ilog = logging.getLogger('proctor.meta')
 rlog = logging.getLogger('proctor.rectifier')
 dlog = logging.getLogger('proctor.detector')
 
 
 def detector(func):
-    """Marks a function as a detector for a condition"""
+    """
+    Marks a function as a detector for a condition.
+    Parameters after the context are fixtures - see fixtures - unless
+    they have a default value: def check(self, obj, strict=False) asks
+    for no fixture and is called with strict=False.
+    """
+    fixtures = fixture_names(func)
 
     @wraps(func)
-    def wrapper(*args, **kwargs):
+    def evaluate(*args, **kwargs):
         """
-        Call the detect function.
+        Call the detect function - without raising the condition.
         Handle the detecctor output to:
-           - raise the bound condition if True
-           - raise the bound condition with a helpful message if tuple and True
-           - re-raise the condition if a condition was thrown
-           - remain silent in all other cases
+           - give back a Detection of the bound condition if True
+           - give back a Detection with a helpful message if tuple and True
+           - give back a Detection of the condition if a condition was thrown
+           - give back None in all other cases
         """
         context = args[1]
         detector = args[0]
+        missing = [name for name in fixtures if name not in kwargs]
+        if missing:
+            # Not part of a check pass - the fixtures are computed for this call
+            kwargs.update(Proctor().fixture_scope(context).arguments(missing))
+
+        metrics = Proctor().metrics
+        started = metrics.start() if metrics is not None else None
         try:
             ret = func(*args, **kwargs)
         except Condition as c:
+            if started:
+                metrics.stop(started, 'detector', detector, hits=1)
             # Detector could raise another condition - make sure if it did, the detector class is attached
             if not c.detector:
                 c.detector = detector.__class__
-            if not c.context:
+            if c.context_instance is None:
                 c.set_context(context)
-            raise c
+            return Detection.of(c)
         except Exception as e:
+            if started:
+                metrics.stop(started, 'detector', detector, errors=1)
             dlog.exception("Detector {} cause unhandled exception - cannot trust detection".format(func.__name__))
             raise e
 
@@ -49,28 +68,81 @@ def detector(func):
             except Exception:
                 dlog.exception("Problem parsing return")
 
+        if started:
+            metrics.stop(started, 'detector', detector, hits=1 if status else 0)
+
         if status:
-            message = message.strip()
+            # Record the condition specified in the calling object
+            # along with the context - the condition itself is built on demand
+            return Detection(detector.condition, message.strip(), context, detector.__class__, extra)
 
-            # Create the condition specified in the calling object
-            # and add the context to the condition
-            err = args[0].condition(message, context, detector.__class__, **extra)
-            dlog.debug("Done with error - {}".format(detector.__class__, __name__))
-            raise err
+        return None
 
-        dlog.debug("Done clean = {}".format(detector.__class__.__name__))
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        """
+        Call the detect function.
+        Raise the bound condition if it was detected - see evaluate.
+        """
+        detection = evaluate(*args, **kwargs)
+        if detection:
+            raise detection.exception()
 
     # tag the function
     wrapper.is_detector = True
+    wrapper.evaluate = evaluate
+    evaluate.fixtures = fixtures
     return wrapper
 
 
+def batch_detector(columns=None):
+    """
+    Marks a function as a batch detector for a condition (see proctor.batch).
+
+    The function is called with a list of contexts - and the columns view,
+    when columns are declared - and returns a mask or (mask, messages).
+    The class also gets a regular detector that checks a batch of one.
+    """
+    columns = list(columns or [])
+
+    def decorate(func):
+
+        @wraps(func)
+        def wrapper(self, contexts, view=None):
+            ret = func(self, contexts, view) if columns else func(self, contexts)
+            if isinstance(ret, tuple):
+                return ret[0], ret[1] if len(ret) > 1 else None
+            return ret, None
+
+        def single(self, context):
+            view = None
+            if columns:
+                view, readable = column_view([context], columns)
+                if not readable:
+                    raise AttributeError("Cannot read {}".format(", ".join(columns)))
+            mask, messages = wrapper(self, [context], view)
+            if hits(mask):
+                return True, message_for(messages, 0, func.__doc__ or "")
+            return False
+        single.__name__ = func.__name__
+        single.__doc__ = func.__doc__
+
+        # tag the function
+        wrapper.is_batch_detector = True
+        wrapper.columns = columns
+        wrapper.detector = detector(single)
+        return wrapper
+    return decorate
+
+
 def rectifier(func):
     """Ensure good order by fixing the condition"""
 
     @wraps(func)
     def wrapper(*args, **kwargs):
         """ Just tag the function and logs some debug """
+        metrics = Proctor().metrics
+        started = metrics.start() if metrics is not None else None
         try:
             rlog.debug("Rectifying with {}".format(func.__name__))
             val = func(*args, **kwargs)
@@ -78,10 +150,17 @@ def rectifier(func):
                 rlog.debug("Rectify Failed")
             else:
                 rlog.debug("RECTIFIED")
+            if started:
+                metrics.stop(started, 'rectifier', args[0], hits=1 if val else 0)
             return val
         except Exception:
+            if started:
+                metrics.stop(started, 'rectifier', args[0], errors=1)
             rlog.exception("Exception when rectifying")
             return False
+        finally:
+            # The context may have changed - cached results cannot be trusted
+            Proctor().invalidate_results(args[1])
 
     # tag the function
     wrapper.is_rectifier = True
@@ -93,9 +172,15 @@ def prefilter(func):
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        ilog.debug("Checking {}.prefilter()".format(args[0].__class__))
+        ilog.debug("Checking %s.prefilter()", args[0].__class__)
         return func(*args, **kwargs)
 
     # tag the function
     wrapper.is_filter = True
     return wrapper
+
+
+def fixture(func):
+    """Declares a function of the context as a fixture named after it - see fixtures"""
+    Proctor().register_fixture(func.__name__, func)
+    return func
@@ -0,0 +1,158 @@
+"""
+Handler dispatch for registered conditions.
+
+A condition can have several detectors (and rectifiers) bound to it,
+each guarded by a filter.  The handler for an object is the first one,
+in priority order, whose filter passes.
+
+Handlers whose filter is generated from 'applies_to' and 'excludes' (see
+predicates) depend only on the values found at the keys of those
+dictionaries.  A run of such handlers is compiled into one projection of
+the object - the values at every key they filter on - and the handler
+picked for a projection is remembered in a table, so picking a handler
+is one projection plus one dict lookup.  A projection seen for the first
+time (or one with unhashable values) is decided by the generated filters,
+called as plain functions: no handler is built just to be asked.
+
+Handlers with a custom @prefilter cannot be compiled - their filter is
+called, in priority order, on an instance of the handler.
+
+As for the filters, the dispatch is generated as a single function (the
+projections unrolled, keys made of identifiers read inline) so picking a
+handler is one call.
+"""
+from .predicates import property_getter, inline_attribute
+
+# Stands in for a value that could not be read from the object
+MISSING = object()
+
+
+def spec_function(handler):
+    """The generated filter of a handler as a plain function - called with (None, obj)"""
+    _filter = handler._filter
+    return getattr(_filter, '__func__', _filter)
+
+
+class SpecTable(object):
+    """
+    A run of consecutive handlers with 'applies_to'/'excludes' filters:
+    the handler picked for each projection of the filtered keys.
+    """
+
+    # Past this many distinct projections the table is started over
+    MAX_ENTRIES = 4096
+
+    def __init__(self, handlers):
+        self.handlers = []
+        for handler in handlers:
+            self.handlers.append(handler)
+            if not (handler.applies_to or handler.excludes):
+                # Always applies - the handlers after it are never picked
+                break
+        self.filters = [(spec_function(handler), handler) for handler in self.handlers]
+        self.keys = []
+        for handler in self.handlers:
+            for key in list(handler.applies_to) + list(handler.excludes):
+                if key not in self.keys:
+                    self.keys.append(key)
+        self.entries = {}
+
+    def decide(self, obj):
+        """The first handler whose filter passes"""
+        for test, handler in self.filters:
+            if test(None, obj):
+                return handler
+        return None
+
+    def remember(self, obj, values):
+        """Decide for a projection not in the table yet"""
+        handler = self.decide(obj)
+        if len(self.entries) >= self.MAX_ENTRIES:
+            self.entries.clear()
+        self.entries[values] = handler
+        return handler
+
+
+# Source of the stages, formatted with the index of the stage (and of the key)
+_FILTER = """
+    if handler_{s}()._filter(obj):
+        return handler_{s}
+"""
+
+_READ = """
+    try:
+        value_{s}_{i} = {read}
+    except Exception:
+        value_{s}_{i} = MISSING
+"""
+
+_LOOKUP = """
+    values = ({values})
+    try:
+        handler = entries_{s}[values]
+    except KeyError:
+        handler = remember_{s}(obj, values)
+    except TypeError:
+        # Unhashable values cannot be tabled - decide every time
+        handler = decide_{s}(obj)
+    if handler is not None:
+        return handler
+"""
+
+
+def compile_dispatch(handlers):
+    """
+    Generate the function picking the handler of an object - handlers in
+    priority order, the ones without a filter are left out.
+    The tables are kept on the function (.tables) along with its source.
+    """
+    stages = []
+    run = []
+    for handler in handlers:
+        if not hasattr(handler, "_filter"):
+            continue
+        if getattr(handler, "_spec_filter", False):
+            run.append(handler)
+            continue
+        if run:
+            stages.append(SpecTable(run))
+            run = []
+        stages.append(handler)
+    if run:
+        stages.append(SpecTable(run))
+
+    namespace = {'MISSING': MISSING}
+    source = ["def _dispatch(obj):"]
+    tables = []
+    for s, stage in enumerate(stages):
+        if not isinstance(stage, SpecTable):
+            namespace['handler_{}'.format(s)] = stage
+            source.append(_FILTER.format(s=s))
+            continue
+
+        if not stage.keys:
+            # The first handler of the run filters on nothing - it always applies
+            namespace['handler_{}'.format(s)] = stage.handlers[0]
+            source.append("    return handler_{}\n".format(s))
+            break
+
+        tables.append(stage)
+        namespace['entries_{}'.format(s)] = stage.entries
+        namespace['remember_{}'.format(s)] = stage.remember
+        namespace['decide_{}'.format(s)] = stage.decide
+        for i, key in enumerate(stage.keys):
+            namespace['get_{}_{}'.format(s, i)] = property_getter(key)
+            source.append(_READ.format(
+                s=s, i=i, read="obj." + key if inline_attribute(key) else "get_{}_{}(obj)".format(s, i)))
+        source.append(_LOOKUP.format(
+            s=s, values="".join("value_{}_{}, ".format(s, i) for i in range(len(stage.keys)))))
+    else:
+        source.append("    return None\n")
+
+    code = compile("".join(source), "<proctor dispatch>", "exec")
+    exec(code, namespace)
+
+    _dispatch = namespace['_dispatch']
+    _dispatch.source = "".join(source)
+    _dispatch.tables = tables
+    return _dispatch
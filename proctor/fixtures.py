@@ -0,0 +1,82 @@
+"""
+Fixtures - derived data shared by the detectors of one object.
+
+A fixture is a named function of the context, declared with @fixture.
+Detectors ask for fixtures by naming them as parameters after the context
+(parameters with a default value are not fixtures - they keep their default):
+
+    @fixture
+    def service_config(host):
+        return fetch_config(host.address)
+
+    class PortProctor(HostProctor):
+        condition = PortClosed
+
+        @detector
+        def check_port(self, host, service_config):
+            return service_config['port'] not in host.open_ports
+
+During a check pass (utils.check_conditions, check_many...) the fixtures
+of an object are computed once - by the first detector that asks - and
+shared by the detectors of every other condition checked on it.  Outside
+a pass each call computes them.  Batch detectors do not get fixtures.
+"""
+import inspect
+from .tracking import RecordingProxy, reads, unwrap
+
+
+def fixture_names(func):
+    """
+    The fixtures a detector function asks for - the parameters after
+    (self, context) that have no default value
+    """
+    spec = inspect.getargspec(func)
+    required = len(spec.args) - len(spec.defaults or ())
+    return tuple(spec.args[2:required])
+
+
+class FixtureScope(object):
+    """The fixtures of one object for one check pass - see Proctor.fixture_scope"""
+
+    __slots__ = ('context', 'fixtures', 'tracking', '_values', '_reads')
+
+    def __init__(self, context, fixtures, tracking=False):
+        self.context = unwrap(context)
+        self.fixtures = fixtures
+        self.tracking = tracking
+        self._values = {}
+        self._reads = {}
+
+    def get(self, name):
+        """The value of the fixture - computed on first use (a failure is kept too)"""
+        if name not in self._values:
+            try:
+                func = self.fixtures[name]
+            except KeyError:
+                raise LookupError("No fixture {}".format(name))
+
+            context = RecordingProxy(self.context) if self.tracking else self.context
+            try:
+                self._values[name] = (True, func(context))
+            except Exception as e:
+                self._values[name] = (False, e)
+            if self.tracking:
+                self._reads[name] = reads(context)
+
+        ok, value = self._values[name]
+        if not ok:
+            raise value
+        return value
+
+    def arguments(self, names):
+        """Keyword arguments for a detector that asks for the named fixtures"""
+        return dict((name, self.get(name)) for name in names)
+
+    def reads(self, names):
+        """The attributes of the context read to compute the fixtures (when tracked)"""
+        return frozenset().union(*[self._reads.get(name, ()) for name in names])
+
+    def clear(self):
+        """Forget the values - the context changed (e.g. it was rectified)"""
+        self._values.clear()
+        self._reads.clear()
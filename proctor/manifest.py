@@ -0,0 +1,235 @@
+"""
+Plugin manifest - what each plugin module defines, without importing it.
+
+The modules of a plugin directory are parsed (ast) for the conditions and
+ProctorObjects they define and the contexts those apply to.  The result
+is cached in '.proctor-manifest.json' at the top of the directory and a
+module is only parsed again when its mtime or size changed.
+
+With lazy loading (see Proctor.load_plugins_from) the PluginIndex built
+from the manifest lets the registry import the modules of a context the
+first time a lookup touches that context (or one of its conditions).
+Modules the scan cannot understand - classes built at run time, bases
+that are not defined in the plugins - are imported right away.
+"""
+import os
+import ast
+import json
+import hashlib
+import logging
+import threading
+import __builtin__
+
+log = logging.getLogger("proctor.plugins")
+
+MANIFEST = ".proctor-manifest.json"
+
+# Bump when the entries change shape - older manifests are rebuilt
+FORMAT = 1
+
+_ROOTS = {'Condition': 'condition', 'ProctorObject': 'handler'}
+
+
+def _ref(node):
+    """Name a class attribute refers to - 'Vehicle' for Vehicle, models.Vehicle or 'Vehicle'"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Str):
+        return node.s
+    return None
+
+
+def scan_module(path):
+    """The classes a module defines - {'classes': {...}, 'eager': bool}"""
+    with open(path, 'rb') as fin:
+        tree = ast.parse(fin.read(), path)
+
+    classes = {}
+    eager = False
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        info = {'bases': [_ref(base) for base in node.bases]}
+        for stmt in node.body:
+            if not isinstance(stmt, ast.Assign):
+                continue
+            for target in stmt.targets:
+                if isinstance(target, ast.Name) and target.id in ('name', 'context'):
+                    value = _ref(stmt.value)
+                    if target.id == 'name' and not isinstance(stmt.value, ast.Str):
+                        value = None
+                    if value is None:
+                        # Not something a scan can tell
+                        eager = True
+                    info[target.id] = value
+        classes[node.name] = info
+
+    # Classes built at run time cannot be indexed
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef) and node.name not in classes:
+            eager = True
+        elif isinstance(node, ast.Call) and _ref(node.func) == 'type' and len(node.args) == 3:
+            eager = True
+
+    return {'classes': classes, 'eager': eager}
+
+
+def scan_directory(directory):
+    """
+    Manifest of the plugin modules under the directory - {path: entry}.
+    Entries of unchanged modules come from the cached manifest.
+    """
+    manifest_path = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_path) as fin:
+            cached = json.load(fin)
+        if cached.get('format') != FORMAT:
+            cached = {}
+    except (IOError, ValueError):
+        cached = {}
+    cached_modules = cached.get('modules', {})
+
+    modules = {}
+    changed = False
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(root, filename)
+            key = os.path.relpath(path, directory)
+            stat = os.stat(path)
+            entry = cached_modules.get(key)
+            if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                try:
+                    entry = scan_module(path)
+                except SyntaxError:
+                    # Let the import report it
+                    entry = {'classes': {}, 'eager': True}
+                entry['mtime'] = stat.st_mtime
+                entry['size'] = stat.st_size
+                changed = True
+            modules[key] = entry
+
+    if changed or set(modules) != set(cached_modules):
+        try:
+            with open(manifest_path, 'w') as fout:
+                json.dump({'format': FORMAT, 'modules': modules}, fout, indent=1, sort_keys=True)
+        except IOError:
+            log.warn("Cannot write the plugin manifest {}".format(manifest_path))
+
+    return dict((os.path.join(directory, key), entry) for key, entry in modules.iteritems())
+
+
+class PluginIndex(object):
+    """The plugin modules not imported yet - by the contexts and conditions they define"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contexts = {}     # context name -> module paths
+        self._conditions = {}   # condition name and pid -> context name
+        self._defines = set()   # modules that define conditions - imported first
+
+    def add(self, manifest):
+        """Index the modules of a manifest - returns the paths to import right away"""
+        classes = {}
+        for path, entry in manifest.iteritems():
+            for name, info in entry['classes'].iteritems():
+                classes.setdefault(name, []).append((path, info))
+
+        eager = []
+        with self._lock:
+            for path, entry in sorted(manifest.iteritems()):
+                if entry['eager']:
+                    eager.append(path)
+                    continue
+                try:
+                    found = [self._describe(classes, path, name) for name in entry['classes']]
+                except LookupError:
+                    eager.append(path)
+                    continue
+
+                for kind, context, condition in found:
+                    if kind is None or context is None:
+                        continue
+                    self._contexts.setdefault(context, set()).add(path)
+                    if condition is not None:
+                        self._defines.add(path)
+                        self._conditions[condition] = context
+                        self._conditions[hashlib.sha1(condition.encode('utf-8')).hexdigest()[:10].upper()] = context
+        return eager
+
+    def _describe(self, classes, path, name):
+        """(kind, context, condition name) of a class - LookupError if it cannot be told"""
+        kind = None
+        attrs = {}
+        seen = set()
+        todo = [(path, name)]
+        while todo:
+            path, name = todo.pop(0)
+            if name in _ROOTS:
+                kind = kind or _ROOTS[name]
+                continue
+            if name in seen:
+                continue
+            seen.add(name)
+
+            # A base defined in the same module wins over one of the same name elsewhere
+            candidates = dict(classes.get(name, []))
+            if path in candidates:
+                origin = path
+            elif candidates:
+                origin = sorted(candidates)[0]
+            elif name is not None and hasattr(__builtin__, name):
+                continue
+            else:
+                raise LookupError(name)
+
+            info = candidates[origin]
+            for attr in ('name', 'context'):
+                if attr in info and attr not in attrs:
+                    attrs[attr] = info[attr]
+            todo.extend((origin, base) for base in info['bases'])
+
+        condition = attrs.get('name') if kind == 'condition' else None
+        return kind, attrs.get('context'), condition
+
+    def take(self, contexts=None):
+        """The modules of the contexts (all of them when None) - taken out of the index"""
+        with self._lock:
+            if contexts is None:
+                contexts = self._contexts.keys()
+            paths = set()
+            for context in contexts:
+                paths.update(self._contexts.pop(context, ()))
+            # A module is only imported once - whatever other contexts it has
+            self._remove(paths)
+            # Conditions first, so the handlers find them
+            return sorted(paths, key=lambda p: (p not in self._defines, p))
+
+    def discard(self, paths):
+        """Take modules out of the index - imported some other way"""
+        with self._lock:
+            self._remove(set(paths))
+
+    def _remove(self, paths):
+        if not paths:
+            return
+        for context in self._contexts.keys():
+            self._contexts[context] -= paths
+            if not self._contexts[context]:
+                del self._contexts[context]
+
+    def __contains__(self, path):
+        """Is the module waiting to be imported?"""
+        with self._lock:
+            return any(path in paths for paths in self._contexts.itervalues())
+
+    def context_of(self, condition):
+        """Context of a condition (name or pid) not imported yet - None if unknown"""
+        return self._conditions.get(condition)
+
+    def __len__(self):
+        return len(self._contexts)
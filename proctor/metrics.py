@@ -0,0 +1,263 @@
+"""
+Handler metrics - where the time of the checks goes.
+
+When enabled (Proctor.enable_metrics) every detector and rectifier call
+is timed - wall and CPU time - and counted per handler class and pid,
+along with its hits (detected / rectified) and errors:
+
+    metrics = Proctor().enable_metrics()
+    results = list(putils.check_many(vehicles))
+    for stats in metrics.top(0.9):
+        print stats['handler'], stats['wall']['sum']
+
+Wall times go to histograms with fixed, doubling buckets, so recording
+is a bisect and a few additions.  CPU time is the process CPU time
+(time.clock) - it includes other threads running meanwhile.
+
+snapshot() gives everything as plain data; exporters (see Exporter)
+get the snapshots pushed by export().  openmetrics() renders snapshots
+(see handler_families) as OpenMetrics text for scraping.
+"""
+import time
+import bisect
+import logging
+import threading
+
+log = logging.getLogger("proctor.metrics")
+
+
+class Histogram(object):
+    """Counts of values in doubling buckets - 1us to ~67s"""
+
+    BOUNDS = tuple(1e-6 * 2 ** i for i in range(27))
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value, n=1):
+        """Add n values - a batch of n calls is observed as n times its average"""
+        self.counts[bisect.bisect_left(self.BOUNDS, value / n)] += n
+        self.count += n
+        self.sum += value
+
+    def percentile(self, pct):
+        """Upper bound of the bucket the percentile falls in - None when empty"""
+        if not self.count:
+            return None
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else float('inf')
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': [(bound, count) for bound, count in zip(self.BOUNDS + (float('inf'),), self.counts)],
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class HandlerStats(object):
+    """What was recorded for one handler class on one condition"""
+
+    __slots__ = ('kind', 'pid', 'handler', 'calls', 'hits', 'errors', 'cpu', 'wall')
+
+    def __init__(self, kind, pid, handler):
+        self.kind = kind
+        self.pid = pid
+        self.handler = handler
+        self.calls = 0
+        self.hits = 0
+        self.errors = 0
+        self.cpu = 0.0
+        self.wall = Histogram()
+
+    def snapshot(self):
+        return {
+            'kind': self.kind,
+            'pid': self.pid,
+            'handler': self.handler,
+            'calls': self.calls,
+            'hits': self.hits,
+            'errors': self.errors,
+            'hit_rate': float(self.hits) / self.calls if self.calls else None,
+            'cpu': self.cpu,
+            'wall': self.wall.snapshot(),
+        }
+
+
+def handler_key(handler):
+    """(pid, class name) of a handler - class or instance"""
+    cls = handler if isinstance(handler, type) else handler.__class__
+    condition = getattr(cls, 'condition', None)
+    # Detectors are bound to the condition class, rectifiers to the RegisteredCondition
+    pid = getattr(condition, 'pid', None) or getattr(getattr(condition, 'condition', None), 'pid', None)
+    return pid, cls.__name__
+
+
+class Exporter(object):
+    """Receives the metrics snapshots - see Metrics.export"""
+
+    def export(self, snapshot):
+        raise NotImplementedError
+
+
+class LogExporter(Exporter):
+    """Logs the detectors that take most of the time"""
+
+    def __init__(self, share=0.9, logger=None):
+        self.share = share
+        self.log = logger or log
+
+    def export(self, snapshot):
+        for stats in top(snapshot, self.share):
+            self.log.info("{} [{}] {} calls {:.3f}s wall {:.3f}s cpu {} hits {} errors".format(
+                stats['handler'], stats['pid'], stats['calls'], stats['wall']['sum'], stats['cpu'],
+                stats['hits'], stats['errors']))
+
+
+def top(snapshot, share=0.9, kind='detector'):
+    """The handlers, slowest first, that make up the share of the wall time"""
+    handlers = sorted(
+        (stats for stats in snapshot['handlers'] if stats['kind'] == kind),
+        key=lambda stats: stats['wall']['sum'], reverse=True)
+    total = sum(stats['wall']['sum'] for stats in handlers)
+    found = []
+    spent = 0.0
+    for stats in handlers:
+        if total and spent >= share * total:
+            break
+        found.append(stats)
+        spent += stats['wall']['sum']
+    return found
+
+
+def _label_value(value):
+    return unicode(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def openmetrics(families):
+    """
+    OpenMetrics text of metric families - [(name, type, help, samples)]
+    with samples [(suffix, {label: value}, value)], e.g.
+        ('proctor_cache_hits', 'counter', "Cache hits", [('_total', {}, 10)])
+    """
+    lines = []
+    for name, kind, help, samples in families:
+        lines.append(u"# TYPE {} {}".format(name, kind))
+        lines.append(u"# HELP {} {}".format(name, help))
+        for suffix, labels, value in samples:
+            if labels:
+                labels = u"{{{}}}".format(u",".join(
+                    u'{}="{}"'.format(key, _label_value(val)) for key, val in sorted(labels.items())))
+            else:
+                labels = u""
+            lines.append(u"{}{}{} {}".format(name, suffix, labels, _number(value)))
+    lines.append(u"# EOF\n")
+    return u"\n".join(lines)
+
+
+def handler_families(snapshot):
+    """The metric families of a snapshot - see openmetrics"""
+    seconds, cpu, calls, hits, errors = [], [], [], [], []
+    for stats in snapshot['handlers']:
+        labels = {'kind': stats['kind'], 'pid': stats['pid'], 'handler': stats['handler']}
+        wall = stats['wall']
+        count = 0
+        for bound, n in wall['buckets']:
+            count += n
+            seconds.append(('_bucket', dict(labels, le=_number(bound)), count))
+        seconds.append(('_count', labels, wall['count']))
+        seconds.append(('_sum', labels, wall['sum']))
+        cpu.append(('_total', labels, stats['cpu']))
+        calls.append(('_total', labels, stats['calls']))
+        hits.append(('_total', labels, stats['hits']))
+        errors.append(('_total', labels, stats['errors']))
+
+    return [
+        ('proctor_handler_seconds', 'histogram', "Wall time of the handler calls", seconds),
+        ('proctor_handler_cpu_seconds', 'counter', "CPU time of the handler calls", cpu),
+        ('proctor_handler_calls', 'counter', "Handler calls", calls),
+        ('proctor_handler_hits', 'counter', "Detections (rectifications) of the handler", hits),
+        ('proctor_handler_errors', 'counter', "Handler calls that raised", errors),
+    ]
+
+
+class Metrics(object):
+    """The stats of every handler called since enabled (or reset)"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.exporters = []
+
+    @staticmethod
+    def start():
+        """Take before calling the handler - hand it to stop()"""
+        return time.time(), time.clock()
+
+    def stop(self, started, kind, handler, calls=1, hits=0, errors=0):
+        """Record a call (or a batch of calls) of the handler started at started"""
+        wall = time.time() - started[0]
+        cpu = time.clock() - started[1]
+        key = (kind,) + handler_key(handler)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = HandlerStats(*key)
+            stats.calls += calls
+            stats.hits += hits
+            stats.errors += errors
+            stats.cpu += cpu
+            stats.wall.observe(wall, calls)
+
+    def snapshot(self):
+        """Everything recorded - plain data"""
+        with self._lock:
+            handlers = [stats.snapshot() for stats in self._stats.itervalues()]
+        pids = {}
+        for stats in handlers:
+            totals = pids.setdefault(stats['pid'], {'calls': 0, 'hits': 0, 'errors': 0, 'cpu': 0.0, 'wall': 0.0})
+            for name in ('calls', 'hits', 'errors', 'cpu'):
+                totals[name] += stats[name]
+            totals['wall'] += stats['wall']['sum']
+        return {'time': time.time(), 'started': self.started, 'handlers': handlers, 'pids': pids}
+
+    def top(self, share=0.9, kind='detector'):
+        """The handlers, slowest first, that make up the share of the wall time"""
+        return top(self.snapshot(), share, kind)
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def export(self):
+        """Push a snapshot to every exporter"""
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            try:
+                exporter.export(snapshot)
+            except Exception:
+                log.exception("Exporter {} failed".format(exporter))
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.started = time.time()
@@ -7,6 +7,41 @@ import logging
 
 log = logging.getLogger("proctor.plugins")
 
+# Modules imported by load_module - path: {'module', 'mtime', 'size', 'digest'}
+loaded = {}
+
+
+def file_state(code_path):
+    """What tells a changed module - (mtime, size)"""
+    stat = os.stat(code_path)
+    return stat.st_mtime, stat.st_size
+
+
+def file_digest(code_path):
+    with open(code_path, 'rb') as fin:
+        return md5.new(fin.read()).hexdigest()
+
+
+def changed_modules():
+    """
+    The imported modules whose file changed (or is gone) since they were loaded.
+    A file that was only touched - same content - is not changed.
+    """
+    changed = []
+    for code_path, state in loaded.items():
+        try:
+            mtime, size = file_state(code_path)
+        except OSError:
+            changed.append(code_path)
+            continue
+        if (mtime, size) == (state['mtime'], state['size']):
+            continue
+        if file_digest(code_path) == state['digest']:
+            state['mtime'], state['size'] = mtime, size
+            continue
+        changed.append(code_path)
+    return changed
+
 
 def load_module(code_path):
     """Load the module"""
@@ -21,9 +56,12 @@ def load_module(code_path):
             module_id = "{}_{}".format(module_id, os.path.splitext(code_file)[0])
             log.debug("Importing {} as {}".format(code_file, module_id))
             sys.path.insert(0, code_dir)
+            mtime, size = file_state(code_path)
             mod = imp.load_source(module_id, code_path, fin)
             sys.path.pop(sys.path.index(code_dir))
             log.debug(u"Loaded {}".format(mod))
+            loaded[code_path] = {
+                'module': module_id, 'mtime': mtime, 'size': size, 'digest': file_digest(code_path)}
             return mod
         finally:
             try:
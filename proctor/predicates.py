@@ -0,0 +1,137 @@
+"""
+Compiled ProctorObject filters.
+
+A ProctorObject without a @prefilter is filtered by its 'applies_to' and
+'excludes' dictionaries:
+
+    applies_to = {'prop1.prop2': [val1, val2]}   # all keys must match
+    excludes = {'prop3': [val3]}                # no key may match
+
+Instead of walking those dictionaries on every call, the filter is
+generated once when the class is created: dotted keys become attrgetters,
+value lists become frozensets and the checks are unrolled into a plain
+function (keys made of identifiers are read with inline attribute access).
+
+The debug level is checked when the filter is generated: only filters
+compiled while 'proctor.meta' logs at DEBUG (e.g. set before the plugins
+are loaded) carry the logging of rejected keys.
+"""
+import re
+import keyword
+import logging
+from operator import attrgetter
+
+ilog = logging.getLogger('proctor.meta')
+
+
+def property_getter(key):
+    """Getter for a (dotted) property key - 'x.y.z' is split once"""
+    return attrgetter(key)
+
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def inline_attribute(key):
+    """Can the key be read as 'obj.<key>' in generated code?"""
+    return all(_IDENTIFIER.match(name) and not keyword.iskeyword(name) for name in key.split("."))
+
+
+def value_set(values):
+    """
+    Values to test membership against - a frozenset when possible.
+    Returns (frozenset or None, tuple) - the tuple is the fallback
+    for unhashable values.
+    """
+    listed = tuple(values)
+    try:
+        return frozenset(listed), listed
+    except TypeError:
+        return None, listed
+
+
+def contains(hashed, listed, value):
+    """Membership that survives unhashable values"""
+    if hashed is not None:
+        try:
+            return value in hashed
+        except TypeError:
+            pass
+    return value in listed
+
+
+# Source for a single key check, formatted with the index of the key.
+# '{missing}' and '{rejected}' are the return expressions for a value that
+# cannot be read and for a value that fails the check.
+_APPLIES_TO = """
+    try:
+        value = {read}
+    except Exception:
+        return {missing}
+    try:
+        if value not in hashed_{i}:
+            return {rejected}
+    except TypeError:
+        if value not in listed_{i}:
+            return {rejected}
+"""
+
+_EXCLUDES = """
+    try:
+        value = {read}
+    except Exception:
+        return {missing}
+    try:
+        if value in hashed_{i}:
+            return {rejected}
+    except TypeError:
+        if value in listed_{i}:
+            return {rejected}
+"""
+
+
+def compile_filter(name, applies_to, excludes):
+    """
+    Generate the filter method for a ProctorObject class.
+
+    Same rules as the original dictionary walk: a value that cannot be
+    read fails an 'applies_to' key, and passes the filter outright when
+    it is an 'excludes' key.
+    """
+    keys = []
+    namespace = {}
+    source = ["def _filter(self, obj):"]
+    verbose = ilog.isEnabledFor(logging.DEBUG)
+
+    checks = [(k, v, _APPLIES_TO, False) for k, v in applies_to.items()]
+    checks += [(k, v, _EXCLUDES, True) for k, v in excludes.items()]
+    for i, (key, values, template, fail) in enumerate(checks):
+        keys.append(key)
+        hashed, listed = value_set(values)
+        namespace['get_{}'.format(i)] = property_getter(key)
+        namespace['hashed_{}'.format(i)] = hashed if hashed is not None else listed
+        namespace['listed_{}'.format(i)] = listed
+        source.append(template.format(
+            i=i,
+            read="obj." + key if inline_attribute(key) else "get_{}(obj)".format(i),
+            missing="missing({}, {})".format(i, fail) if verbose else fail,
+            rejected="rejected({}, value)".format(i) if verbose else False))
+    source.append("    return True\n")
+
+    def missing(i, result):
+        ilog.debug(u"{}: cannot get value for {}".format(name, keys[i]))
+        return result
+
+    def rejected(i, value):
+        ilog.debug(u"{}: {} rejected on {}".format(name, value, keys[i]))
+        return False
+
+    namespace['missing'] = missing
+    namespace['rejected'] = rejected
+    code = compile("".join(source), "<proctor filter {}>".format(name), "exec")
+    exec(code, namespace)
+
+    _filter = namespace['_filter']
+    _filter.__name__ = "_filter"
+    _filter.source = "".join(source)
+    return _filter
@@ -0,0 +1,174 @@
+"""
+On demand profiling of checks.
+
+Work done inside a Profile runs under cProfile, and the time spent in
+each phase of the engine is added up:
+
+    lookup      searching the conditions of an object (search_conditions)
+    filter      picking the detectors that apply (dispatch)
+    detect      running the detectors - fixtures and cache included
+    rectify     running the rectifiers (when fixing)
+    serialize   building the result records - rectifiers picked included
+
+The engine phases are timed by utils, around its loops - not by the
+engine around each check - so the checks cost no more when no profile is
+active.  (Rectifications are timed one by one - by check_many one group of
+objects at a time: fixing is rare and slow.)
+While profiling, utils picks the detectors before detecting, so the
+filters show apart from the detectors.
+
+Callers can time their own phases (e.g. the webapp's 'fetch' and
+'render') with phase().  The times are exclusive - a phase inside another
+one is not counted twice - and what no phase covers is 'other':
+
+    profile = Profile()
+    with profile:
+        results = putils.check_conditions(car)
+    print profile.breakdown()
+    print profile.stats(limit=20)
+
+A scan profiles only its own work when handed one - see utils.check_many.
+Profiles are per thread.
+"""
+import time
+import pstats
+import cProfile
+import threading
+from StringIO import StringIO
+
+
+class _Local(threading.local):
+    profile = None
+
+_local = _Local()
+
+
+class _NoPhase(object):
+    """Stands in for a phase (or a profile) when nothing is profiled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NOTHING = _NoPhase()
+
+
+class Phase(object):
+    """Times a phase of a profile - exclusive of the phases inside it"""
+
+    __slots__ = ('profile', 'name', 'start', 'inner')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.inner = 0.0
+        self.profile._stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.time() - self.start
+        stack = self.profile._stack
+        stack.pop()
+        if stack:
+            stack[-1].inner += elapsed
+        seconds, calls = self.profile.phases.get(self.name, (0.0, 0))
+        self.profile.phases[self.name] = (seconds + elapsed - self.inner, calls + 1)
+        return False
+
+
+def current():
+    """The profile active in this thread - None when not profiling"""
+    return _local.profile
+
+
+def phase(name):
+    """Time a phase of the active profile (if any): with phase('fetch'): ..."""
+    profile = _local.profile
+    if profile is None:
+        return NOTHING
+    return Phase(profile, name)
+
+
+class Profile(object):
+    """
+    A profile of the work done while it is active (with profile: ...).
+    It can be entered again - the times add up.
+    cprofile=False: only the phases are timed
+    """
+
+    def __init__(self, cprofile=True):
+        self.profiler = cProfile.Profile() if cprofile else None
+        self.phases = {}
+        self.wall = 0.0
+        self._stack = []
+        self._depth = 0
+        self._previous = None
+        self._start = None
+
+    def __enter__(self):
+        if self._depth == 0:
+            self._previous = _local.profile
+            _local.profile = self
+            self._start = time.time()
+            if self.profiler is not None:
+                # One cProfile at a time per thread - the outer one is paused
+                if self._previous is not None and self._previous.profiler is not None:
+                    self._previous.profiler.disable()
+                self.profiler.enable()
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if self.profiler is not None:
+                self.profiler.disable()
+                if self._previous is not None and self._previous.profiler is not None:
+                    self._previous.profiler.enable()
+            self.wall += time.time() - self._start
+            _local.profile = self._previous
+        return False
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def breakdown(self):
+        """{'wall': seconds, 'phases': {name: {'seconds', 'calls', 'share'}}}"""
+        phases = {}
+        covered = 0.0
+        for name, (seconds, calls) in self.phases.iteritems():
+            covered += seconds
+            phases[name] = {'seconds': seconds, 'calls': calls}
+        phases['other'] = {'seconds': max(self.wall - covered, 0.0), 'calls': None}
+        for info in phases.itervalues():
+            info['share'] = info['seconds'] / self.wall if self.wall else None
+        return {'wall': self.wall, 'phases': phases}
+
+    def stats(self, sort='cumulative', limit=40):
+        """The cProfile statistics as text"""
+        if self.profiler is None:
+            return ""
+        out = StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self, path):
+        """Write the cProfile statistics to a file - for pstats, snakeviz..."""
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+
+    def report(self, sort='cumulative', limit=40):
+        """The phases, then the cProfile statistics - as text"""
+        breakdown = self.breakdown()
+        lines = ["{:>12} {:>10} {:>7} {:>8}".format("phase", "ms", "share", "calls")]
+        for name, info in sorted(breakdown['phases'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append("{:>12} {:10.3f} {:6.1f}% {:>8}".format(
+                name, info['seconds'] * 1000, (info['share'] or 0) * 100,
+                info['calls'] if info['calls'] is not None else ""))
+        lines.append("{:>12} {:10.3f}".format("wall", breakdown['wall'] * 1000))
+        return "\n".join(lines) + "\n\n" + self.stats(sort, limit)
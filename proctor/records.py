@@ -0,0 +1,138 @@
+"""
+Compact result records.
+
+Results of checks are kept in great numbers (a fleet scan holds one per
+object per condition), so they are __slots__ records rather than dicts.
+Call to_dict() where the result is serialized.
+"""
+
+
+class _Unset(object):
+    """Value of the fields never set - false, like the None they stand for"""
+
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return False
+
+    def __repr__(self):
+        return "<unset>"
+
+_UNSET = _Unset()
+
+
+class Record(object):
+    """
+    A result with a fixed set of fields.
+
+    Fields that were never set hold _UNSET (false) and are left out of
+    keys() and to_dict() - use get() for a field that may not be set.
+    Item access works on the fields so a record can be used where a result
+    dict was.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for key in self.__slots__:
+            setattr(self, key, _UNSET)
+        for key, value in kwargs.iteritems():
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            value = getattr(self, key)
+            if value is not _UNSET:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        setattr(self, key, _UNSET)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not _UNSET
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    # Mutable - compared by content
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key, default=None):
+        if key in self.__slots__:
+            value = getattr(self, key)
+            if value is not _UNSET:
+                return value
+        return default
+
+    def keys(self):
+        return [key for key in self.__slots__ if getattr(self, key) is not _UNSET]
+
+    def items(self):
+        items = []
+        for key in self.__slots__:
+            value = getattr(self, key)
+            if value is not _UNSET:
+                items.append((key, value))
+        return items
+
+    def update(self, other):
+        for key, value in other.items():
+            self[key] = value
+
+    def to_dict(self):
+        """The record as a plain dict - for serialization"""
+        return dict(self.items())
+
+
+class ConditionResult(Record):
+    """A condition as checked on a context - see ContextualCondition.dict"""
+
+    __slots__ = (
+        'type', 'check_key', 'name', 'pid', 'level', 'exposed',
+        'symptom', 'solution', 'msg', 'error_code', 'error_code_string',
+        'ctxt_class', 'ctxt_id',
+        'detectable', 'detector', 'detector_tried', 'detected',
+        'rectifiable', 'rectifier', 'rectifier_tried', 'rectified',
+    )
+
+
+class ScanResult(Record):
+    """The conditions checked on one object of a scan - see utils.check_many"""
+
+    __slots__ = ('ctxt_klass', 'ctxt_id', 'conditions')
+
+    def to_dict(self):
+        """The record (and its conditions) as a plain dict - for serialization"""
+        data = dict(self.items())
+        if self.conditions:
+            data['conditions'] = [
+                c.to_dict() if isinstance(c, Record) else c for c in self.conditions]
+        return data
@@ -1,8 +1,12 @@
-import copy
 import logging
 import warnings
 import inspect
+import threading
+import collections
+from contextlib import contextmanager
 from mapping import Mapping
+from .dispatch import compile_dispatch
+from .manifest import PluginIndex
 from .exceptions import NotRegistered, BadProctorCondition, DetectorNotRegistered, RectifierNotRegistered
 
 log = logging.getLogger("proctor.registry")
@@ -21,13 +25,39 @@ class RegisteredCondition(Mapping):
         self.rectifiers = []
         self.name = condition_class.name
         self.context = condition_class.context
+        self.detector_dispatch = None
+        self.rectifier_dispatch = None
+
+    def clone(self):
+        """A copy to change - see ConditionRegistry (published conditions are never changed)"""
+        other = RegisteredCondition(self.condition)
+        other.detectors = list(self.detectors)
+        other.rectifiers = list(self.rectifiers)
+        return other
 
     def sort_handlers(self):
         """Sort detectors and rectifiers by filter priority"""
         self.detectors.sort(key=lambda x: x._filter_priority, reverse=True)
         self.rectifiers.sort(key=lambda x: x._filter_priority, reverse=True)
 
-    def add_rectifier(self, rectifier_cls):
+        # The dispatch tables are rebuilt on the next lookup
+        self.detector_dispatch = None
+        self.rectifier_dispatch = None
+
+    def detector_specs(self):
+        """
+        What an object must match for one of the detectors to apply:
+        a list of {'applies_to': {...}, 'excludes': {...}} - any of them.
+        None when a detector is not restricted by those (none, or a prefilter).
+        """
+        specs = []
+        for detector in self.detectors:
+            if not getattr(detector, '_spec_filter', False) or not (detector.applies_to or detector.excludes):
+                return None
+            specs.append({'applies_to': dict(detector.applies_to), 'excludes': dict(detector.excludes)})
+        return specs
+
+    def add_rectifier(self, rectifier_cls, sort=True):
         """Add a rectifier to the registered condition"""
         if not self.condition.context_name() == rectifier_cls.context_name():
             warnings.warn(
@@ -35,9 +65,10 @@ class RegisteredCondition(Mapping):
                     rectifier_cls.context_name(), self.condition.context_name()), NotRegistered)
         else:
             self.rectifiers.append(rectifier_cls)
-        self.sort_handlers()
+        if sort:
+            self.sort_handlers()
 
-    def add_detector(self, detector_cls):
+    def add_detector(self, detector_cls, sort=True):
         """Add a detector to the registered condition"""
         if not detector_cls.context_name() == self.condition.context_name():
             warnings.warn(
@@ -45,28 +76,38 @@ class RegisteredCondition(Mapping):
                     detector_cls.context_name(), self.condition.context_name()), NotRegistered)
         else:
             self.detectors.append(detector_cls)
-        self.sort_handlers()
+        if sort:
+            self.sort_handlers()
+
+    def compile(self):
+        """Build the dispatch tables now rather than on the first lookup"""
+        if self.detector_dispatch is None:
+            self.detector_dispatch = compile_dispatch(self.detectors)
+        if self.rectifier_dispatch is None:
+            self.rectifier_dispatch = compile_dispatch(self.rectifiers)
 
     def get_detector(self, obj):
         """
         Get the applicable detector for this isinstance
         of the context
         """
-        for detector in self.detectors:
-            if hasattr(detector, "_filter"):
-                if detector()._filter(obj):
-                    ilog.debug("Detector is {}".format(detector))
-                    return detector
-        return None
+        dispatch = self.detector_dispatch
+        if dispatch is None:
+            dispatch = self.detector_dispatch = compile_dispatch(self.detectors)
+        detector = dispatch(obj)
+        if ilog.isEnabledFor(logging.DEBUG):
+            ilog.debug("Detector is {}".format(detector))
+        return detector
 
     def get_rectifier(self, obj):
         """Get applicable rectifier checking through the filters"""
-        for rectifier in self.rectifiers:
-            if hasattr(rectifier, "_filter"):
-                if rectifier()._filter(obj):
-                    ilog.debug("Rectifier is {}".format(rectifier))
-                    return rectifier
-        return None
+        dispatch = self.rectifier_dispatch
+        if dispatch is None:
+            dispatch = self.rectifier_dispatch = compile_dispatch(self.rectifiers)
+        rectifier = dispatch(obj)
+        if ilog.isEnabledFor(logging.DEBUG):
+            ilog.debug("Rectifier is {}".format(rectifier))
+        return rectifier
 
 
 class Registry(object):
@@ -74,24 +115,218 @@ class Registry(object):
 
     log = logging.getLogger("proctor.registry")
 
-    def __init__(self):
-        self._registry = {}
-        self._id_registry = {}
-
     def register(self, cls):
         raise NotImplemented
 
 
+class RegistrySnapshot(collections.Mapping):
+    """
+    The registered conditions at one point in time - a read only mapping
+    of condition name to RegisteredCondition.
+
+    A published snapshot is never changed: registering builds the next
+    version (see ConditionRegistry), so readers use it without locking.
+    """
+
+    def __init__(self, version=0, conditions=None, ids=None, contexts=None):
+        self.version = version
+        self._conditions = conditions or {}
+        self._ids = ids or {}
+
+        # context class name -> condition names
+        self._contexts = contexts or {}
+
+        # Resolved conditions per context class (class object -> list)
+        self._context_cache = {}
+
+    def __getitem__(self, name):
+        return self._conditions[name]
+
+    def __iter__(self):
+        return iter(self._conditions)
+
+    def __len__(self):
+        return len(self._conditions)
+
+    def draft(self):
+        """The next version - a copy to register into, sharing the conditions"""
+        return RegistrySnapshot(
+            self.version + 1,
+            dict(self._conditions),
+            dict(self._ids),
+            dict((k, list(v)) for k, v in self._contexts.iteritems()))
+
+    def get_condition(self, condition):
+        """Get a RegisteredCondition by name or class or pid"""
+        return self._conditions.get(condition, self._ids.get(condition, None))
+
+    def add_condition(self, condition_desc):
+        cls = condition_desc.condition
+        self._conditions[cls.name] = condition_desc
+        self._ids[cls.pid] = condition_desc
+        names = self._contexts.setdefault(cls.context_name(), [])
+        if cls.name not in names:
+            names.append(cls.name)
+
+    def remove_condition(self, condition_desc):
+        """Take a condition out - its place in the context is kept for a condition of the same name"""
+        cls = condition_desc.condition
+        self._conditions.pop(cls.name, None)
+        self._ids.pop(cls.pid, None)
+
+    def prune_contexts(self):
+        """Drop the places of the conditions that were removed for good"""
+        for context, names in self._contexts.items():
+            names = [name for name in names if name in self._conditions]
+            if names:
+                self._contexts[context] = names
+            else:
+                del self._contexts[context]
+
+    def replace_condition(self, condition_desc):
+        cls = condition_desc.condition
+        self._conditions[cls.name] = condition_desc
+        self._ids[cls.pid] = condition_desc
+
+    def get_registered_conditions(self, klass):
+        """
+        Get registeredConditions for a context.
+        The MRO walk is done once per class, then served from the cache.
+        """
+        try:
+            return self._context_cache[klass]
+        except KeyError:
+            conditions = [self._conditions[name] for name in self.__find_context(klass) if name in self._conditions]
+            self._context_cache[klass] = conditions
+            return conditions
+
+    def __find_context(self, klass):
+        """
+        Find the context that is lowest in the MRO.
+        Handles finding a condition defined for a subclass of the given object.
+        Will return the conditions for the earliest in the MRO.
+
+        ex: context's Store
+        class structure:
+            class InternalStore(Store):
+                pass
+            class MyStore(Mixin, InternalStore):
+                pass
+
+        If we have conditions defined for both Store and InternalStore,
+        when finding the conditions for an instance of MyStore - it will properly
+        return the conditions for Store but not InternalStore.  If however,
+        MyStore has conditions defined, Store's won't be returned.  This should
+        be changed to give back all in the heirarchy that match.
+        """
+        classes = [x.__name__ for x in inspect.getmro(klass)]
+
+        # keep a tuple of (conditions to return, index of the class in the MRO)
+        conditions = [([], len(classes))]
+
+        for (key, ctxt_conditions) in self._contexts.items():
+            if key in classes:
+                conditions.append((ctxt_conditions, classes.index(key)))
+
+        # Return the first set of conditions that match the class, which is
+        # like saying give me the conditions that are most specific to
+        # this klass
+        return min(conditions, key=lambda i: i[1])[0]
+
+
 class ConditionRegistry(Registry):
     """
     Maintains a list of RegisteredCondition objects hashed by
     name and context.
+
+    Readers get the published RegistrySnapshot.  Registering is copy on
+    write under a lock: changes go to a draft of the next version (the
+    conditions that get handlers are cloned) which is then published
+    with a single assignment.
+
+    Inside bulk() the draft is published - and the handlers sorted - once,
+    when the outermost bulk() ends.
     """
 
     def __init__(self):
         super(ConditionRegistry, self).__init__()
-        self._contexts = {}
+        self._snapshot = RegistrySnapshot()
         self._proctorClasses = {}
+        self._lock = threading.RLock()
+
+        # The next version while registering - and the conditions cloned into it
+        self._draft = None
+        self._owned = set()
+
+        # Nesting of bulk() and the conditions waiting for their handlers sorted
+        self._bulk = 0
+        self._unsorted = {}
+
+        # Plugin modules not imported yet (see manifest.PluginIndex), the
+        # function that imports them and the classes already looked up -
+        # a class is only marked once its modules are imported and published
+        self.pending = None
+        self.loader = None
+        self._touched = set()
+
+    def snapshot(self):
+        """The published registry - never changes, hold on to it for a consistent view"""
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def _edit(self):
+        """The draft registration changes go to"""
+        if self._draft is None:
+            self._draft = self._snapshot.draft()
+            self._owned = set()
+        return self._draft
+
+    def _editable(self, condition):
+        """The draft's own copy of a registered condition - safe to change"""
+        if id(condition) in self._owned:
+            return condition
+        clone = condition.clone()
+        self._edit().replace_condition(clone)
+        self._owned.add(id(clone))
+        return clone
+
+    @property
+    def in_bulk(self):
+        return self._bulk > 0
+
+    @contextmanager
+    def bulk(self):
+        """Register a batch of classes - sorted and published once at the end"""
+        with self._lock:
+            self._bulk += 1
+            try:
+                yield self
+            finally:
+                self._bulk -= 1
+                if not self._bulk:
+                    self._finalise()
+
+    def _add_handler(self, condition, add, cls):
+        """Add a handler - sorting is left for the end of a bulk registration"""
+        add(cls, sort=not self._bulk)
+        if self._bulk:
+            self._unsorted[id(condition)] = condition
+
+    def _finalise(self):
+        ilog.debug("Sorting handlers of {} conditions".format(len(self._unsorted)))
+        for condition in self._unsorted.itervalues():
+            condition.sort_handlers()
+        self._unsorted = {}
+        self._publish()
+
+    def _publish(self):
+        if self._draft is not None:
+            self._snapshot = self._draft
+            self._draft = None
+            self._owned = set()
 
     def register_rectifier(self, cls):
         """Check the rectifier properties before adding it to the registry"""
@@ -112,10 +347,11 @@ class ConditionRegistry(Registry):
 
             # get the registered condition class and bind it to the PO.condition
             # PO.condition may be specified as a string
-            condition = self.get_condition(cls.condition_name())
+            condition = self._edit().get_condition(cls.condition_name())
             if condition:
+                condition = self._editable(condition)
                 cls.condition = condition
-                condition.add_rectifier(cls)
+                self._add_handler(condition, condition.add_rectifier, cls)
             else:
                 warnings.warn("{} [{}] condition not defined".format(name, cls.condition), RectifierNotRegistered)
         else:
@@ -140,10 +376,11 @@ class ConditionRegistry(Registry):
 
             # get the registered condition class and bind it to the PO.condition
             # PO.condition may be specified as a string
-            condition = self.get_condition(cls.condition_name())
+            condition = self._edit().get_condition(cls.condition_name())
             if condition:
+                condition = self._editable(condition)
                 cls.condition = condition.condition
-                condition.add_detector(cls)
+                self._add_handler(condition, condition.add_detector, cls)
             else:
                 warnings.warn("{} {} condition not defined".format(name, cls.condition), DetectorNotRegistered)
         else:
@@ -151,18 +388,15 @@ class ConditionRegistry(Registry):
 
     def register_condition(self, cls):
         """Register the condition"""
-        if not self.get_condition(cls.name):
+        draft = self._edit()
+        if not draft.get_condition(cls.name):
             condition_desc = RegisteredCondition(cls)
             context_key = cls.context_name()
 
-            # Add to the registry by condition.class_name
-            self._registry[cls.name] = condition_desc
-            self._id_registry[cls.pid] = condition_desc
-            if context_key not in self._contexts:
-                self._contexts[context_key] = []
-
-            # Add the condition to the list of conditions for the context (which is a class name string)
-            self._contexts[context_key].append(condition_desc)
+            # Add to the registry by condition.class_name and pid, and to the
+            # list of conditions for the context (which is a class name string)
+            draft.add_condition(condition_desc)
+            self._owned.add(id(condition_desc))
 
             log.debug("Registered {}:[{}] on ({}) PID:{}".format(cls.__name__, cls.name, context_key, cls.pid))
 
@@ -187,29 +421,158 @@ class ConditionRegistry(Registry):
 
     def register(self, cls):
         """Register a ProctorObject or a Condition"""
-        if self.is_proctor_registered(cls):
-            ilog.info("Already registered proctor {}".format(cls))
+        with self._lock:
+            if self.is_proctor_registered(cls):
+                ilog.info("Already registered proctor {}".format(cls))
+                return
+
+            try:
+                if hasattr(cls, "_is_rectifier"):
+                    self.register_rectifier(cls)
+
+                if hasattr(cls, "_is_detector"):
+                    self.register_detector(cls)
+
+                if hasattr(cls, "_is_condition"):
+                    self.register_condition(cls)
+                else:
+                    # track what ProctorsObjects we know about - good or bad
+                    self.register_proctor_class(cls)
+            except Exception:
+                # Nothing of a failed registration is published - unless it
+                # is part of a bulk registration, which keeps what it had
+                if not self._bulk:
+                    self._draft = None
+                raise
+
+            if not self._bulk:
+                self._publish()
+
+    def add_pending(self, manifest):
+        """Index plugin modules to import on lookup - returns the paths to import right away"""
+        with self._lock:
+            index = self.pending or PluginIndex()
+            eager = index.add(manifest)
+            if len(index):
+                # Classes looked up before may have new plugins
+                self._touched = set()
+                self.pending = index
+            return eager
+
+    def _load_pending(self, contexts=None):
+        """
+        Import the plugin modules of the contexts not imported yet - all of them for None.
+        Under the lock: a lookup of the same contexts waits for the import to be published.
+        """
+        if self.pending is None:
             return
+        with self._lock:
+            pending = self.pending
+            if pending is None:
+                return
+            paths = pending.take(contexts)
+            if paths:
+                self.loader(paths)
+            if not len(pending) and self.pending is pending:
+                self.pending = None
+
+    def discard_pending(self, paths):
+        """The plugin modules were imported - not to be imported again on lookup"""
+        with self._lock:
+            pending = self.pending
+            if pending is None:
+                return
+            pending.discard(paths)
+            if not len(pending):
+                self.pending = None
+
+    def unregister_module(self, module_name):
+        """
+        Take out what a module registered - its conditions and handlers (call in bulk()).
+        Returns the handlers of other modules that were attached to its conditions:
+            {condition name: (rectifiers, detectors)} - see adopt
+        """
+        draft = self._edit()
+        orphans = {}
+        for name, condition in draft.items():
+            if condition.condition.__module__ == module_name:
+                draft.remove_condition(condition)
+                rectifiers = [h for h in condition.rectifiers if h.__module__ != module_name]
+                detectors = [h for h in condition.detectors if h.__module__ != module_name]
+                if rectifiers or detectors:
+                    orphans[name] = (rectifiers, detectors)
+            elif any(h.__module__ == module_name for h in condition.detectors + condition.rectifiers):
+                condition = self._editable(condition)
+                condition.detectors = [h for h in condition.detectors if h.__module__ != module_name]
+                condition.rectifiers = [h for h in condition.rectifiers if h.__module__ != module_name]
+                condition.sort_handlers()
+
+        for key, cls in self._proctorClasses.items():
+            if cls.__module__ == module_name:
+                del self._proctorClasses[key]
+        return orphans
+
+    def adopt(self, orphans):
+        """Attach handlers to the conditions (registered again) of the same name - see unregister_module"""
+        draft = self._edit()
+        for name, (rectifiers, detectors) in orphans.iteritems():
+            condition = draft.get_condition(name)
+            if not condition:
+                warnings.warn("{} is gone - dropping {}".format(
+                    name, ", ".join(h.__name__ for h in rectifiers + detectors)), RuntimeWarning)
+                continue
+            condition = self._editable(condition)
+            for cls in rectifiers:
+                cls.condition = condition
+                self._add_handler(condition, condition.add_rectifier, cls)
+            for cls in detectors:
+                cls.condition = condition.condition
+                self._add_handler(condition, condition.add_detector, cls)
+        draft.prune_contexts()
 
-        if hasattr(cls, "_is_rectifier"):
-            self.register_rectifier(cls)
-
-        if hasattr(cls, "_is_detector"):
-            self.register_detector(cls)
-
-        if hasattr(cls, "_is_condition"):
-            self.register_condition(cls)
-        else:
-            # track what ProctorsObjects we know about - good or bad
-            self.register_proctor_class(cls)
+    def freeze(self, classes=()):
+        """
+        Do now what is otherwise done on first use - import the pending
+        plugins, build the dispatch tables and the conditions of the context
+        classes (and their subclasses, and the given classes).
+        Returns the snapshot that was prepared.
+        """
+        self._load_pending()
+        snapshot = self._snapshot
+        todo = list(classes)
+        for condition in snapshot.itervalues():
+            condition.compile()
+            if inspect.isclass(condition.context):
+                todo.append(condition.context)
+
+        seen = set()
+        while todo:
+            klass = todo.pop()
+            if klass in seen:
+                continue
+            seen.add(klass)
+            snapshot.get_registered_conditions(klass)
+            todo.extend(type.__subclasses__(klass))
+        log.debug("Froze {} conditions on {} classes".format(len(snapshot), len(seen)))
+        return snapshot
 
     def get_condition(self, condition):
         """Get a RegisteredCondition by name or class or pid"""
-        return self._registry.get(condition, self._id_registry.get(condition, None))
+        if self.pending is not None:
+            context = self.pending.context_of(condition)
+            if context is not None:
+                self._load_pending([context])
+        return self._snapshot.get_condition(condition)
+
+    def conditions(self):
+        """All the registered conditions"""
+        self._load_pending()
+        return self._snapshot.values()
 
     def show(self):
         """Show the registry (lame!)"""
-        for c, desc in self._registry.items():
+        self._load_pending()
+        for c, desc in self._snapshot.items():
             ctx_name = desc.context if isinstance(desc.context, basestring) else desc.context.__name__
             print("condition: '{}'\n\tcontext: {}\n\tclass: {}".format(c, ctx_name, desc.condition))
             print("\tDetectors:")
@@ -222,50 +585,29 @@ class ConditionRegistry(Registry):
             print
 
     def get_registered_conditions(self, klass):
-        """Get registeredConditions for a context"""
-        return self.__find_context(klass)
-
-    def __find_context(self, klass):
-        """
-        Find the context that is lowest in the MRO.
-        Handles finding a condition defined for a subclass of the given object.
-        Will return the conditions for the earliest in the MRO.
-
-        ex: context's Store
-        class structure:
-            class InternalStore(Store):
-                pass
-            class MyStore(Mixin, InternalStore):
-                pass
-
-        If we have conditions defined for both Store and InternalStore,
-        when finding the conditions for an instance of MyStore - it will properly
-        return the conditions for Store but not InternalStore.  If however,
-        MyStore has conditions defined, Store's won't be returned.  This should
-        be changed to give back all in the heirarchy that match.
-        """
-        classes = [x.__name__ for x in inspect.getmro(klass)]
-
-        # keep a tuple of (conditions to return, index of the class in the MRO)
-        conditions = [([], len(classes))]
-
-        for (key, ctxt_conditions) in self._contexts.items():
-            if key in classes:
-                conditions.append((ctxt_conditions, classes.index(key)))
-
-        # Return the first set of conditions that match the class, which is
-        # like saying give me the conditions that are most specific to
-        # this klass
-        return min(conditions, key=lambda i: i[1])[0]
+        """Get registeredConditions for a context - see RegistrySnapshot"""
+        if self.pending is not None and klass not in self._touched:
+            with self._lock:
+                if self.pending is not None and klass not in self._touched:
+                    self._load_pending([x.__name__ for x in inspect.getmro(klass)])
+                    self._touched.add(klass)
+        return self._snapshot.get_registered_conditions(klass)
 
     def condition_list(self):
-        return self._registry.keys()
+        self._load_pending()
+        return self._snapshot.keys()
 
     def reset(self):
-        self._contexts = {}
-        self._proctorClasses = {}
-        self._registry = {}
+        with self._lock:
+            self._proctorClasses = {}
+            self._draft = None
+            self._owned = set()
+            self._unsorted = {}
+            self.pending = None
+            self._touched = set()
+            self._snapshot = RegistrySnapshot(self._snapshot.version + 1)
 
     def get_registry(self):
-        """Return a deepcopy of the registry"""
-        return copy.deepcopy(self._registry)
+        """Return the registry - the published snapshot, do not change what it holds"""
+        self._load_pending()
+        return self._snapshot
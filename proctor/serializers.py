@@ -1,10 +1,10 @@
 
 def registered_condition(reg):
     data = reg.condition.class_info()
-    data.detectors = len(reg.detectors)
-    data.rectifiers = len(reg.rectifiers)
-    data.detectable = True if data.detectors else False
-    data.rectifiable = True if data.rectifiers else False
+    data['detectors'] = len(reg.detectors)
+    data['rectifiers'] = len(reg.rectifiers)
+    data['detectable'] = True if data['detectors'] else False
+    data['rectifiable'] = True if data['rectifiers'] else False
     return data
 
 
@@ -0,0 +1,143 @@
+"""
+Attribute dependency tracking.
+
+When tracking is enabled (Proctor.enable_dependency_tracking) the handlers
+of a ContextualCondition are resolved and run on a RecordingProxy of the
+context, and the attributes they read are kept per (object, pid).  After
+an object changes, utils.recheck_conditions only detects again the
+conditions that read one of the changed attributes:
+
+    results = putils.check_conditions(car)
+    car.gas_level = 0
+    results = putils.recheck_conditions(car, ['gas_level'], results)
+
+Only the attributes read on the object itself are recorded ('owner.region'
+records 'owner').  Methods and properties of the object run on the proxy,
+so their reads count too.
+"""
+import threading
+from collections import OrderedDict
+
+
+class RecordingProxy(object):
+    """Stands in for an object and records the names of the attributes read"""
+
+    __slots__ = ('_obj', '_reads')
+
+    def __init__(self, obj):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_reads', set())
+
+    def __getattribute__(self, name):
+        obj = object.__getattribute__(self, '_obj')
+        if name == '__class__':
+            return obj.__class__
+        if name.startswith('__') and name.endswith('__'):
+            return getattr(obj, name)
+
+        object.__getattribute__(self, '_reads').add(name)
+        attr = getattr(obj.__class__, name, None)
+        if isinstance(attr, property) and attr.fget is not None:
+            return attr.fget(self)
+
+        value = getattr(obj, name)
+        func = getattr(value, '__func__', None)
+        if func is not None and getattr(value, '__self__', None) is obj:
+            # Run methods on the proxy - what they read is recorded too
+            return func.__get__(self, obj.__class__)
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(object.__getattribute__(self, '_obj'), name, value)
+
+    def __delattr__(self, name):
+        delattr(object.__getattribute__(self, '_obj'), name)
+
+    def __repr__(self):
+        return repr(object.__getattribute__(self, '_obj'))
+
+    def __str__(self):
+        return str(object.__getattribute__(self, '_obj'))
+
+    def __unicode__(self):
+        return unicode(object.__getattribute__(self, '_obj'))
+
+    def __eq__(self, other):
+        return unwrap(self) == unwrap(other)
+
+    def __ne__(self, other):
+        return unwrap(self) != unwrap(other)
+
+    def __hash__(self):
+        return hash(object.__getattribute__(self, '_obj'))
+
+
+def unwrap(obj):
+    """The object behind a proxy (or the object itself)"""
+    if type(obj) is RecordingProxy:
+        return object.__getattribute__(obj, '_obj')
+    return obj
+
+
+def reads(proxy):
+    """Names of the attributes read through the proxy"""
+    return frozenset(object.__getattribute__(proxy, '_reads'))
+
+
+def attribute_names(names):
+    """Top level attribute names of (dotted) keys - what a proxy records"""
+    return set(name.split(".", 1)[0] for name in names)
+
+
+class DependencyTracker(object):
+    """The attributes read by the last check of each condition on an object"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._reads = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def context_key(context):
+        """Objects without an id cannot be told apart - None"""
+        _id = getattr(context, "id", None)
+        return None if _id is None else (context.__class__, _id)
+
+    def record(self, pid, context, names):
+        """Keep the attributes a check read - None when they are not known"""
+        key = self.context_key(context)
+        if key is None:
+            return
+        with self._lock:
+            pids = self._reads.pop(key, None) or {}
+            if names is None:
+                # Not known - the condition is affected by any change
+                pids.pop(pid, None)
+            else:
+                pids[pid] = frozenset(names)
+            self._reads[key] = pids
+            while len(self._reads) > self.max_size:
+                del self._reads[next(iter(self._reads))]
+
+    def reads(self, pid, context):
+        """The attributes read - None if the condition was not tracked on the object"""
+        key = self.context_key(context)
+        with self._lock:
+            return self._reads.get(key, {}).get(pid)
+
+    def affected(self, pid, context, changed):
+        """Must the condition be checked again after the changed attributes were modified?"""
+        names = self.reads(pid, context)
+        return names is None or not names.isdisjoint(attribute_names(changed))
+
+    def forget(self, context):
+        key = self.context_key(context)
+        with self._lock:
+            self._reads.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._reads.clear()
+
+    def __len__(self):
+        return len(self._reads)
@@ -5,12 +5,16 @@ or conditions.
 The utility functions here could conceivably be wrapped
 and exposed via a web endpoint.
 
-All output from these utils should be json format.
+All output from these utils should be json format - results of checks
+are compact records (see records), call to_dict() to serialize them.
 """
 
 import logging
+import itertools
 import serializers
+from records import ScanResult
 from filter_set import FilterSet
+from profiling import phase, current, NOTHING
 from . import Proctor, ContextualCondition
 
 log = logging.getLogger("proctor.utils")
@@ -19,7 +23,7 @@ log = logging.getLogger("proctor.utils")
 def list_conditions():
     """List all the conditions"""
     _proctor = Proctor()
-    return map(serializers.registered_condition, _proctor._conditions._registry.values())
+    return map(serializers.registered_condition, _proctor._conditions.conditions())
 
 
 def search_conditions(filters, klass=None):
@@ -30,16 +34,30 @@ def search_conditions(filters, klass=None):
     klass: Class to prefilter results - will observe inheritence
     """
     _proctor = Proctor()
-    condition_list = []
-    filter_set = FilterSet(filters)
-    # Get a dict of conditions
-    if klass:
-        conditions = _proctor._conditions.get_registered_conditions(klass)
-    else:
-        conditions = _proctor._conditions._registry.values()
+    with phase('lookup'):
+        condition_list = []
+        filter_set = FilterSet(filters)
+        # Get a dict of conditions
+        if klass:
+            conditions = _proctor._conditions.get_registered_conditions(klass)
+        else:
+            conditions = _proctor._conditions.conditions()
 
-    condition_list = map(serializers.registered_condition, conditions)
-    return filter(filter_set.filter, condition_list)
+        condition_list = map(serializers.registered_condition, conditions)
+        return filter(filter_set.filter, condition_list)
+
+
+def _pick_detectors(conditions):
+    """
+    When profiling, pick the detectors of the conditions before detecting
+    them - so the filters are timed as a phase of their own.  Otherwise (and
+    when dependencies are tracked - see ContextualCondition.detect) they are
+    picked by the detection.
+    """
+    if current() is not None and Proctor().dependency_tracker is None:
+        with phase('filter'):
+            for cond in conditions:
+                cond.detector
 
 
 def get_context_condition(condition_id, obj):
@@ -48,7 +66,10 @@ def get_context_condition(condition_id, obj):
     condition = _proctor._conditions.get_condition(condition_id)
     if not condition:
         raise Exception("Conditions does not exist {}".format(condition_id))
-    return serializers.context_condition(ContextualCondition(obj, condition))
+    cond = ContextualCondition(obj, condition)
+    _pick_detectors([cond])
+    with phase('serialize'):
+        return serializers.context_condition(cond)
 
 
 def check_condition(condition_id, obj):
@@ -58,8 +79,11 @@ def check_condition(condition_id, obj):
     if not condition:
         raise Exception("Conditions does not exist {}".format(condition_id))
     cond = ContextualCondition(obj, condition)
-    cond.detect()
-    return serializers.context_condition(cond)
+    _pick_detectors([cond])
+    with phase('detect'):
+        cond.detect()
+    with phase('serialize'):
+        return serializers.context_condition(cond)
 
 
 def fix_condition(condition_id, obj):
@@ -69,10 +93,14 @@ def fix_condition(condition_id, obj):
     if not condition:
         raise Exception("Conditions does not exist {}".format(condition_id))
     cond = ContextualCondition(obj, condition)
-    cond.detect()
+    _pick_detectors([cond])
+    with phase('detect'):
+        cond.detect()
     if cond.detected:
-        cond.rectify()
-    return serializers.context_condition(cond)
+        with phase('rectify'):
+            cond.rectify()
+    with phase('serialize'):
+        return serializers.context_condition(cond)
 
 
 def get_context_conditions(obj, condition_filters=None):
@@ -85,11 +113,13 @@ def get_context_conditions(obj, condition_filters=None):
 
     # Get the contextual conditions
     conditions = map(
-        lambda x: ContextualCondition(obj, _proctor._conditions.get_condition(x.pid)),
+        lambda x: ContextualCondition(obj, _proctor._conditions.get_condition(x['pid'])),
         search_conditions(_filters, obj.__class__)
     )
+    _pick_detectors(conditions)
     # serialize it
-    return map(serializers.context_condition, conditions)
+    with phase('serialize'):
+        return map(serializers.context_condition, conditions)
 
 
 def check_conditions(obj, condition_filters=None):
@@ -102,18 +132,54 @@ def check_conditions(obj, condition_filters=None):
     _proctor = Proctor()
     _filters = condition_filters or {}
 
-    # Get the contextual conditions
+    # Get the contextual conditions - sharing the fixtures of the object
+    fixtures = _proctor.fixture_scope(obj)
     conditions = map(
-        lambda x: ContextualCondition(obj, _proctor._conditions.get_condition(x.pid)),
+        lambda x: ContextualCondition(obj, _proctor._conditions.get_condition(x['pid']), fixtures),
         search_conditions(_filters, obj.__class__)
     )
 
     # Now go run the detector on all the conditions
-    for cond in conditions:
-        cond.detect()
+    _pick_detectors(conditions)
+    with phase('detect'):
+        for cond in conditions:
+            cond.detect()
 
     # serialize it
-    return map(serializers.context_condition, conditions)
+    with phase('serialize'):
+        return map(serializers.context_condition, conditions)
+
+
+def recheck_conditions(obj, changed, previous, condition_filters=None):
+    """
+    Get the results of checking an object again after some attributes changed
+
+    changed: names of the modified attributes
+    previous: the results of the last check of the object (check_conditions)
+
+    With dependency tracking enabled, only the conditions that read one of
+    the changed attributes are detected again - the others keep their
+    previous result.  Without it every condition is detected again.
+    """
+    _proctor = Proctor()
+    _filters = condition_filters or {}
+    tracker = _proctor.dependency_tracker
+    last = dict((x['pid'], x) for x in previous or [])
+    fixtures = _proctor.fixture_scope(obj)
+
+    results = []
+    for registered in search_conditions(_filters, obj.__class__):
+        pid = registered['pid']
+        if tracker is not None and pid in last and not tracker.affected(pid, obj, changed):
+            results.append(last[pid])
+            continue
+        cond = ContextualCondition(obj, _proctor._conditions.get_condition(pid), fixtures)
+        _pick_detectors([cond])
+        with phase('detect'):
+            cond.detect()
+        with phase('serialize'):
+            results.append(serializers.context_condition(cond))
+    return results
 
 
 def fix_conditions(obj, condition_filters=None):
@@ -126,17 +192,153 @@ def fix_conditions(obj, condition_filters=None):
     _proctor = Proctor()
     _filters = condition_filters or {}
 
-    # Get the contextual conditions
+    # Get the contextual conditions - sharing the fixtures of the object
+    fixtures = _proctor.fixture_scope(obj)
     conditions = map(
-        lambda x: ContextualCondition(obj, _proctor._conditions.get_condition(x.pid)),
+        lambda x: ContextualCondition(obj, _proctor._conditions.get_condition(x['pid']), fixtures),
         search_conditions(_filters, obj.__class__)
     )
 
     # Now go run the detector on all the conditions
-    for cond in conditions:
-        cond.detect()
-        if cond.detected:
-            cond.rectify()
+    _pick_detectors(conditions)
+    with phase('detect'):
+        for cond in conditions:
+            cond.detect()
+            if cond.detected:
+                with phase('rectify'):
+                    cond.rectify()
+                fixtures.clear()
 
     # serialize it
-    return map(serializers.context_condition, conditions)
+    with phase('serialize'):
+        return map(serializers.context_condition, conditions)
+
+
+def query_specs(condition_ids):
+    """
+    What an object must match for any of the conditions to be detected on it
+    - the union of the detector specs (see RegisteredCondition.detector_specs).
+
+    A list of {'applies_to': {...}, 'excludes': {...}} for providers to query
+    with, or None when any object could match.
+    """
+    specs = []
+    seen = set()
+    for condition_id in condition_ids:
+        condition_specs = _get_condition(condition_id).detector_specs()
+        if condition_specs is None:
+            return None
+        for spec in condition_specs:
+            key = tuple(
+                tuple(sorted((k, repr(v)) for k, v in spec[part].iteritems()))
+                for part in ('applies_to', 'excludes'))
+            if key not in seen:
+                seen.add(key)
+                specs.append(spec)
+    return specs
+
+
+def query_related(condition_ids):
+    """
+    Related objects the detectors of the conditions read - their
+    select_related/prefetch_related declarations and the objects of
+    dotted applies_to/excludes keys ('owner.region' reads 'owner').
+
+    {'select_related': set of paths, 'prefetch_related': set of paths}
+    """
+    related = {'select_related': set(), 'prefetch_related': set()}
+    for condition_id in condition_ids:
+        for detector in _get_condition(condition_id).detectors:
+            related['select_related'].update(detector.select_related)
+            related['prefetch_related'].update(detector.prefetch_related)
+            for key in itertools.chain(detector.applies_to, detector.excludes):
+                if "." in key:
+                    related['select_related'].add(key.rsplit(".", 1)[0])
+    return related
+
+
+def _get_condition(condition_id):
+    condition = Proctor()._conditions.get_condition(condition_id)
+    if not condition:
+        raise Exception("Conditions does not exist {}".format(condition_id))
+    return condition
+
+
+def check_many(objects, condition_filters=None, fix=False, chunk_size=500, condition_ids=None, profile=None):
+    """
+    Check (and optionally fix) the conditions on many objects.
+
+    A generator of records.ScanResult, one per object (in order - an
+    object found twice in the iterable is checked and yielded twice):
+        ScanResult(ctxt_klass=<class name>, ctxt_id=<id>, conditions=[...])
+
+    Objects are consumed in chunks of chunk_size, and the conditions that
+    match the condition_filters are searched once per class of object - not
+    once per object - so any iterable (e.g. a whole provider) can be streamed
+    in bounded memory.  See search_conditions.
+
+    condition_ids: check these conditions, in this order, instead of
+    searching them - each on the objects of the classes it is registered
+    for.  An unknown id fails before any object is checked.
+
+    profile: a profiling.Profile - active while the scan works (not while
+    the caller handles the results)
+    """
+    _proctor = Proctor()
+    _filters = condition_filters or {}
+    class_conditions = {}
+    if condition_ids is not None:
+        requested = map(_get_condition, condition_ids)
+
+    objects = iter(objects)
+    while True:
+        chunk = list(itertools.islice(objects, chunk_size))
+        if not chunk:
+            break
+
+        # Group the chunk by class - the conditions are resolved once per group.
+        # The objects are known by their position in the chunk (the same one can come twice)
+        groups = {}
+        for position, obj in enumerate(chunk):
+            groups.setdefault(obj.__class__, []).append(position)
+
+        results = [[] for _ in chunk]
+        fixtures = [None] * len(chunk)
+        with profile or NOTHING:
+            for klass, group in groups.iteritems():
+                if klass not in class_conditions:
+                    if condition_ids is not None:
+                        registered = set(
+                            x.condition.pid for x in _proctor._conditions.get_registered_conditions(klass))
+                        class_conditions[klass] = [x for x in requested if x.condition.pid in registered]
+                    else:
+                        class_conditions[klass] = [
+                            _proctor._conditions.get_condition(x['pid']) for x in search_conditions(_filters, klass)]
+
+                for position in group:
+                    fixtures[position] = _proctor.fixture_scope(chunk[position])
+
+                # Detect each condition over the whole group - batch detectors
+                # get the group in one call (the conditions come back in order)
+                for registered in class_conditions[klass]:
+                    conditions = [
+                        ContextualCondition(chunk[position], registered, fixtures[position]) for position in group]
+                    _pick_detectors(conditions)
+                    with phase('detect'):
+                        ContextualCondition.detect_many(conditions)
+                    if fix:
+                        with phase('rectify'):
+                            for position, cond in itertools.izip(group, conditions):
+                                if cond.detected:
+                                    cond.rectify()
+                                    fixtures[position].clear()
+                    with phase('serialize'):
+                        for position, cond in itertools.izip(group, conditions):
+                            results[position].append(serializers.context_condition(cond))
+
+        # Hand back the results in the order the objects came in
+        for obj, conditions in itertools.izip(chunk, results):
+            yield ScanResult(
+                ctxt_klass=obj.__class__.__name__,
+                ctxt_id=obj.id,
+                conditions=conditions)
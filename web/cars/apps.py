@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 import os
 import logging
 from django.apps import AppConfig
+from django.conf import settings
 from proctor_lib import Proctor
 
 log = logging.getLogger('cars')
@@ -16,7 +17,9 @@ class CarsConfig(AppConfig):
         module_path = os.path.dirname(os.path.abspath(__file__))
         log.critical('Cars is ready {}'.format(module_path))
         proctor = Proctor()
-        proctor.add_paths([os.path.join(module_path, "proctor_plugins")])
+        proctor.add_paths(
+            [os.path.join(module_path, "proctor_plugins")],
+            lazy=getattr(settings, 'PROCTOR_LAZY_PLUGINS', False))
         from cars.models import vehicles
         for v in vehicles.values():
             log.info("{}".format(v))
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 # Create your models here.
 from proctor.utils.model import ObjectProvider, ProctorMixin
+from proctor_lib.predicates import compile_filter
 import logging
 
 log = logging.getLogger(__name__)
@@ -17,6 +18,11 @@ class VehicleProvider(ObjectProvider):
         log.info('Getting on {}'.format(self.model_class))
         return vehicles[id]
 
+    def get_many(self, ids):
+        global vehicles
+        log.info('Getting {} on {}'.format(len(ids), self.model_class))
+        return [vehicles[_id] for _id in ids if _id in vehicles]
+
     def all(self):
         global vehicles
         for val in vehicles.itervalues():
@@ -33,6 +39,13 @@ class VehicleProvider(ObjectProvider):
         for val in vehicles.itervalues():
             yield val
 
+    def select(self, applies_to=None, excludes=None):
+        global vehicles
+        match = compile_filter("VehicleProvider", applies_to or {}, excludes or {})
+        for val in vehicles.itervalues():
+            if match(None, val):
+                yield val
+
 
 class Vehicle(ProctorMixin):
 
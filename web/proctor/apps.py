@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.conf import settings
 from proctor_lib import Proctor
 
 
@@ -10,4 +11,21 @@ class ProctorConfig(AppConfig):
 
     def ready(self):
         p = Proctor()
-        p.load_plugins()
\ No newline at end of file
+        p.load_plugins()
+
+        # e.g. PROCTOR_RESULT_CACHE = {'max_size': 10000, 'ttl': 300}
+        cache = getattr(settings, 'PROCTOR_RESULT_CACHE', None)
+        if cache:
+            from .utils.model import provider_version
+            options = dict(cache) if isinstance(cache, dict) else {}
+            options.setdefault('version', provider_version)
+            p.enable_result_cache(**options)
+
+        # Time the detectors and rectifiers - see /proctor/metrics
+        if getattr(settings, 'PROCTOR_METRICS', False):
+            p.enable_metrics()
+
+        # Pre-fork servers (e.g. gunicorn --preload): get the registry ready
+        # in the master so the workers share it
+        if getattr(settings, 'PROCTOR_FREEZE_REGISTRY', False):
+            p.freeze()
@@ -1,6 +1,1061 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import os
+import sys
+import json
+import pickle
+import logging
+import time
+import shutil
+import threading
+import tempfile
+import textwrap
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from proctor_lib import Proctor, ContextualCondition, plugin_support
+from proctor_lib import utils as putils
+from proctor_lib import batch
+from proctor_lib.fixtures import FixtureScope, fixture_names
+from proctor_lib.dispatch import MISSING
+from proctor_lib.predicates import compile_filter
+from proctor_lib.profiling import Profile
+from proctor_lib.records import ConditionResult, ScanResult
+from .utils import metrics
+from .utils.model import ObjectProvider, QuerySetProvider, spec_query
+
+# The plugins below name their context - the classes are defined here
+WIDGET_PLUGIN = """
+    from proctor_lib import Condition, ProctorObject
+    from proctor_lib.decorators import detector, rectifier
+
+
+    class WidgetBroken(Condition):
+        name = "Widget is broken"
+        context = "Widget"
+        symptom = "Does not turn"
+        solution = "Oil it"
+        level = 1
+
+
+    class WidgetProctor(ProctorObject):
+        context = "Widget"
+        condition = WidgetBroken
+
+        @detector
+        def check_widget(self, widget):
+            return widget.broken
+
+        @rectifier
+        def fix_widget(self, widget, condition=None):
+            widget.broken = False
+            return True
+"""
+
+WIDGET_SPARE_PLUGIN = """
+    from proctor_lib import ProctorObject
+    from proctor_lib.decorators import detector
+
+
+    class SpareWidgetProctor(ProctorObject):
+        context = "Widget"
+        condition = "Widget is broken"
+        applies_to = {'spare': [True]}
+
+        @detector
+        def check_spare(self, widget):
+            return False
+"""
+
+GADGET_PLUGIN = """
+    from proctor_lib import Condition, ProctorObject
+    from proctor_lib.decorators import detector
+
+
+    class GadgetLoose(Condition):
+        name = "Gadget is loose"
+        context = "Gadget"
+        level = 1
+
+
+    class GadgetProctor(ProctorObject):
+        context = "Gadget"
+        condition = GadgetLoose
+
+        @detector
+        def check_gadget(self, gadget):
+            return gadget.loose
+"""
+
+WORN_WIDGET_PLUGIN = """
+    from proctor_lib import Condition, ProctorObject
+    from proctor_lib.decorators import batch_detector
+
+
+    class WidgetWorn(Condition):
+        name = "Widget is worn"
+        context = "Widget"
+        level = 1
+
+
+    class WornWidgetProctor(ProctorObject):
+        context = "Widget"
+        condition = WidgetWorn
+
+        @batch_detector(columns=['wear'])
+        def check_wear(self, widgets, columns):
+            \"\"\"Worn out\"\"\"
+            for widget in widgets:
+                widget.batch = (len(widgets), type(columns['wear']).__name__)
+                if widget.wear < 0:
+                    raise ValueError("Negative wear")
+            return [wear > 5 for wear in columns['wear']], {0: "First one is worn"}
+"""
+
+GAUGE_PLUGIN = """
+    from proctor_lib import Condition, ProctorObject
+    from proctor_lib.decorators import detector, rectifier, fixture
+
+    # The ids of the widgets the gauge was read on
+    calls = []
+
+
+    @fixture
+    def gauge(widget):
+        calls.append(widget.id)
+        if widget.pressure is None:
+            raise ValueError("No gauge")
+        return widget.pressure
+
+
+    class WidgetLeaking(Condition):
+        name = "Widget is leaking"
+        context = "Widget"
+        level = 1
+
+
+    class WidgetOverloaded(Condition):
+        name = "Widget is overloaded"
+        context = "Widget"
+        level = 1
+
+
+    class LeakingWidgetProctor(ProctorObject):
+        context = "Widget"
+        condition = WidgetLeaking
+
+        @detector
+        def check_leak(self, widget, gauge, limit=10):
+            return gauge < limit
+
+        @rectifier
+        def fix_leak(self, widget, condition=None):
+            widget.pressure = 60
+            return True
+
+
+    class OverloadedWidgetProctor(ProctorObject):
+        context = "Widget"
+        condition = WidgetOverloaded
+
+        @detector
+        def check_load(self, widget, gauge):
+            return gauge > 50
+"""
+
+JAMMED_WIDGET_PLUGIN = """
+    from proctor_lib import Condition, ProctorObject
+    from proctor_lib.decorators import detector
+
+
+    class WidgetJammed(Condition):
+        name = "Widget is jammed"
+        context = "Widget"
+        level = 1
+
+
+    class JammedWidgetProctor(ProctorObject):
+        context = "Widget"
+        condition = WidgetJammed
+
+        @detector
+        def check_jam(self, widget):
+            if widget.spare:
+                raise WidgetJammed("Spare is jammed", parts=['spare'])
+            return widget.broken, "Jammed", {'parts': ['gear']}
+"""
+
+
+class Widget(object):
+
+    def __init__(self, id, broken=False, spare=False):
+        self.id = id
+        self.broken = broken
+        self.spare = spare
+        self.version = 1
+
+
+class Gadget(object):
+
+    def __init__(self, id, loose=False):
+        self.id = id
+        self.loose = loose
+
+
+class Owner(models.Model):
+    name = models.CharField(max_length=20)
+    region = models.CharField(max_length=20)
+
+    class Meta:
+        app_label = 'proctor'
+        managed = False
+
+    @property
+    def display_name(self):
+        return self.name.title()
+
+
+class Car(models.Model):
+    color = models.CharField(max_length=20)
+    owner = models.ForeignKey(Owner, null=True, on_delete=models.CASCADE)
+    drivers = models.ManyToManyField(Owner, related_name='driven')
+
+    class Meta:
+        app_label = 'proctor'
+        managed = False
+
+    @property
+    def painted(self):
+        return bool(self.color)
+
+
+class PluginTestCase(SimpleTestCase):
+    """
+    Plugins written to a temporary directory - what they registered is
+    taken out of the registry after the test.
+    """
+
+    def setUp(self):
+        self.proctor = Proctor()
+        self.registry = self.proctor._conditions
+        self.directory = tempfile.mkdtemp(prefix="proctor-test-")
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(self.unload)
+
+    def write_plugin(self, name, source):
+        path = os.path.join(self.directory, name + ".py")
+        with open(path, 'w') as fout:
+            fout.write(textwrap.dedent(source))
+        return path
+
+    def load_plugin(self, name, source):
+        path = self.write_plugin(name, source)
+        with self.proctor.bulk_load():
+            plugin_support.load_module(path)
+        return path
+
+    def unload(self):
+        if self.directory in self.proctor.plugin_dirs:
+            self.proctor.plugin_dirs.remove(self.directory)
+        self.proctor._loaded_dirs.discard(self.directory)
+        with self.proctor.bulk_load():
+            for path, info in plugin_support.loaded.items():
+                if path.startswith(self.directory):
+                    del plugin_support.loaded[path]
+                    self.registry.unregister_module(info['module'])
+                    for name, func in self.proctor._fixtures.items():
+                        if func.__module__ == info['module']:
+                            del self.proctor._fixtures[name]
+                    sys.modules.pop(info['module'], None)
+
+
+class RegistrySnapshotTest(PluginTestCase):
+
+    def test_bulk_registration_is_published_at_the_end(self):
+        before = self.registry.snapshot()
+        path = self.write_plugin("widgets", WIDGET_PLUGIN)
+        with self.proctor.bulk_load():
+            plugin_support.load_module(path)
+            # Readers keep the published registry until the batch is done
+            self.assertIs(self.registry.snapshot(), before)
+            self.assertIsNone(self.registry.snapshot().get_condition("Widget is broken"))
+
+        after = self.registry.snapshot()
+        self.assertGreater(after.version, before.version)
+        self.assertIsNone(before.get_condition("Widget is broken"))
+        self.assertEqual(after.get_condition("Widget is broken").name, "Widget is broken")
+
+    def test_published_conditions_are_not_changed(self):
+        self.load_plugin("widgets", WIDGET_PLUGIN)
+        before = self.registry.snapshot()
+        detectors = list(before.get_condition("Widget is broken").detectors)
+
+        self.load_plugin("spare_widgets", WIDGET_SPARE_PLUGIN)
+        after = self.registry.snapshot()
+        self.assertEqual(before.get_condition("Widget is broken").detectors, detectors)
+        self.assertEqual(
+            sorted(d.__name__ for d in after.get_condition("Widget is broken").detectors),
+            ["SpareWidgetProctor", "WidgetProctor"])
+        self.assertEqual(
+            [c.name for c in after.get_registered_conditions(Widget)], ["Widget is broken"])
+
+
+class LazyRegistrySnapshotTest(PluginTestCase):
+
+    def setUp(self):
+        super(LazyRegistrySnapshotTest, self).setUp()
+        self.write_plugin("widgets", WIDGET_PLUGIN)
+        self.write_plugin("spare_widgets", WIDGET_SPARE_PLUGIN)
+        self.proctor.index_plugins(self.directory)
+        self.addCleanup(self.registry.get_registered_conditions, Widget)
+
+        # The import takes a while - other lookups come in meanwhile
+        self.importing = threading.Event()
+        loader = self.registry.loader
+        self.addCleanup(setattr, self.registry, 'loader', loader)
+
+        def slow_loader(paths):
+            self.importing.set()
+            time.sleep(0.05)
+            loader(paths)
+        self.registry.loader = slow_loader
+
+    def concurrently(self, lookup):
+        """Runs the lookup while another thread imports the modules of Widget"""
+        found = {}
+        thread = threading.Thread(target=lambda: found.update(first=self.registry.get_registered_conditions(Widget)))
+        thread.start()
+        self.assertTrue(self.importing.wait(5))
+        result = lookup()
+        thread.join()
+        self.assertEqual([c.name for c in found['first']], ["Widget is broken"])
+        return result
+
+    def test_lookups_wait_for_the_import(self):
+        conditions = self.concurrently(lambda: self.registry.get_registered_conditions(Widget))
+        self.assertEqual([c.name for c in conditions], ["Widget is broken"])
+        self.assertEqual(
+            sorted(d.__name__ for d in conditions[0].detectors), ["SpareWidgetProctor", "WidgetProctor"])
+
+    def test_condition_lookups_wait_for_the_import(self):
+        condition = self.concurrently(lambda: self.registry.get_condition("Widget is broken"))
+        self.assertEqual(len(condition.detectors), 2)
+
+
+class ReloadPluginsTest(PluginTestCase):
+
+    def setUp(self):
+        super(ReloadPluginsTest, self).setUp()
+        self.path = self.write_plugin("widgets", WIDGET_PLUGIN)
+        self.proctor.add_paths([self.directory])
+
+    def change_detector(self):
+        """The detector of the widgets plugin now finds the widgets that are fine"""
+        self.write_plugin("widgets", WIDGET_PLUGIN.replace("return widget.broken", "return not widget.broken"))
+
+    def test_changed_handler_is_swapped(self):
+        widget = Widget(1, broken=True)
+        self.assertTrue(putils.check_conditions(widget)[0]['detected'])
+        before = self.registry.get_condition("Widget is broken").detectors[0]
+
+        self.change_detector()
+        self.assertEqual(self.proctor.reload_plugins(), [self.path])
+
+        detectors = self.registry.get_condition("Widget is broken").detectors
+        self.assertEqual([d.__name__ for d in detectors], ["WidgetProctor"])
+        self.assertIsNot(detectors[0], before)
+        self.assertFalse(putils.check_conditions(widget)[0]['detected'])
+
+    def test_handlers_of_other_modules_are_kept(self):
+        self.write_plugin("spare_widgets", WIDGET_SPARE_PLUGIN)
+        self.assertEqual(self.proctor.reload_plugins(), [os.path.join(self.directory, "spare_widgets.py")])
+
+        self.change_detector()
+        self.proctor.reload_plugins()
+        self.assertEqual(
+            sorted(d.__name__ for d in self.registry.get_condition("Widget is broken").detectors),
+            ["SpareWidgetProctor", "WidgetProctor"])
+        self.assertEqual(self.proctor.reload_plugins(), [])
+
+
+class ResultCacheTest(PluginTestCase):
+
+    def setUp(self):
+        super(ResultCacheTest, self).setUp()
+        self.load_plugin("widgets", WIDGET_PLUGIN)
+        self.addCleanup(setattr, self.proctor, 'result_cache', self.proctor.result_cache)
+        self.proctor.enable_result_cache()
+
+    def detected(self, widget):
+        return putils.check_conditions(widget)[0]['detected']
+
+    def test_results_are_kept_while_the_version_holds(self):
+        widget = Widget(1, broken=True)
+        self.assertTrue(self.detected(widget))
+
+        widget.broken = False
+        self.assertTrue(self.detected(widget))
+        self.assertEqual(self.proctor.result_cache.stats()['hits'], 1)
+
+        widget.version += 1
+        self.assertFalse(self.detected(widget))
+
+    def test_rectifier_invalidates_the_results(self):
+        widget = Widget(1, broken=True)
+        self.assertTrue(self.detected(widget))
+
+        self.assertTrue(putils.fix_conditions(widget)[0]['rectified'])
+        # Same version - only the invalidation tells the cached result is stale
+        self.assertEqual(widget.version, 1)
+        self.assertFalse(self.detected(widget))
+
+    def test_cached_data_is_not_shared(self):
+        self.load_plugin("jammed_widgets", JAMMED_WIDGET_PLUGIN)
+        registered = self.registry.get_condition("Widget is jammed")
+        widget = Widget(1, broken=True)
+        first = ContextualCondition(widget, registered)
+        first.detect()
+        first.detected.data['parts'] = ['axle']
+
+        second = ContextualCondition(widget, registered)
+        second.detect()
+        self.assertEqual(self.proctor.result_cache.stats()['hits'], 1)
+        self.assertEqual(second.detected.data, {'parts': ['gear']})
+        second.detected.data.clear()
+        third = ContextualCondition(widget, registered)
+        self.assertEqual(third.detect().data, {'parts': ['gear']})
+
+
+class DetectorTest(PluginTestCase):
+
+    def setUp(self):
+        super(DetectorTest, self).setUp()
+        self.load_plugin("jammed_widgets", JAMMED_WIDGET_PLUGIN)
+        self.detector = self.registry.get_condition("Widget is jammed").detectors[0]
+
+    def test_detection(self):
+        widget = Widget(1, broken=True)
+        detection = self.detector()._evaluate(widget)
+        self.assertEqual(detection.message, "Jammed")
+        self.assertEqual(detection.data, {'parts': ['gear']})
+        self.assertIs(detection.context, widget)
+        self.assertIs(detection.detector, self.detector)
+        self.assertIsNone(self.detector()._evaluate(Widget(2)))
+
+    def test_raised_condition_gets_the_context(self):
+        widget = Widget(1, spare=True)
+        detection = self.detector()._evaluate(widget)
+        self.assertEqual(detection.message, "Spare is jammed")
+        self.assertEqual(detection.data, {'parts': ['spare']})
+        self.assertIs(detection.context, widget)
+        self.assertIs(detection.exception().context_instance, widget)
+        self.assertEqual(detection.exception().context_id, 1)
+
+
+class RecheckConditionsTest(PluginTestCase):
+
+    def setUp(self):
+        super(RecheckConditionsTest, self).setUp()
+        self.load_plugin("widgets", WIDGET_PLUGIN)
+        self.load_plugin("spare_widgets", WIDGET_SPARE_PLUGIN)
+        self.pid = self.registry.get_condition("Widget is broken").condition.pid
+        self.addCleanup(setattr, self.proctor, 'dependency_tracker', self.proctor.dependency_tracker)
+        self.addCleanup(setattr, self.proctor, 'result_cache', self.proctor.result_cache)
+        self.proctor.enable_dependency_tracking()
+        self.tracker = self.proctor.dependency_tracker
+
+    def test_only_affected_conditions_are_checked_again(self):
+        widget = Widget(1, broken=True)
+        results = putils.check_conditions(widget)
+        self.assertTrue(results[0]['detected'])
+
+        # Not read by the check - the previous result is kept
+        widget.broken = False
+        rechecked = putils.recheck_conditions(widget, ['version'], results)
+        self.assertIs(rechecked[0], results[0])
+
+        rechecked = putils.recheck_conditions(widget, ['broken'], results)
+        self.assertFalse(rechecked[0]['detected'])
+
+    def test_filter_reads_are_tracked(self):
+        widget = Widget(1, broken=True)
+        condition = ContextualCondition(widget, self.registry.get_condition(self.pid))
+        # Picked before the detection
+        self.assertEqual(condition.detector.__name__, "WidgetProctor")
+        self.assertTrue(condition.detect())
+        self.assertEqual(self.tracker.reads(self.pid, widget), frozenset(['spare', 'broken']))
+
+        results = putils.check_conditions(widget)
+        widget.spare = True
+        rechecked = putils.recheck_conditions(widget, ['spare'], results)
+        self.assertEqual(rechecked[0]['detector'], "SpareWidgetProctor")
+        self.assertFalse(rechecked[0]['detected'])
+
+    def test_cached_results_record_their_reads(self):
+        self.proctor.enable_result_cache()
+        widget = Widget(1, broken=True)
+        results = putils.check_conditions(widget)
+        self.tracker.clear()
+
+        self.assertEqual(putils.check_conditions(widget), results)
+        self.assertEqual(self.proctor.result_cache.stats()['hits'], 1)
+        self.assertEqual(self.tracker.reads(self.pid, widget), frozenset(['spare', 'broken']))
+        self.assertIs(putils.recheck_conditions(widget, ['version'], results)[0], results[0])
+
+    def test_results_cached_without_tracking_are_always_affected(self):
+        self.proctor.enable_result_cache()
+        self.proctor.disable_dependency_tracking()
+        widget = Widget(1, broken=True)
+        results = putils.check_conditions(widget)
+
+        self.proctor.enable_dependency_tracking()
+        self.assertEqual(putils.check_conditions(widget), results)
+        self.assertIsNone(self.proctor.dependency_tracker.reads(self.pid, widget))
+        self.assertIsNot(putils.recheck_conditions(widget, ['version'], results)[0], results[0])
+
+
+class CheckManyTest(PluginTestCase):
+
+    def setUp(self):
+        super(CheckManyTest, self).setUp()
+        self.load_plugin("widgets", WIDGET_PLUGIN)
+        self.load_plugin("gadgets", GADGET_PLUGIN)
+        self.widget_pid = self.registry.get_condition("Widget is broken").condition.pid
+        self.gadget_pid = self.registry.get_condition("Gadget is loose").condition.pid
+
+    def scan(self, objects, **kwargs):
+        return [
+            (x.ctxt_klass, x.ctxt_id, [(c['name'], c['detected']) for c in x.conditions])
+            for x in putils.check_many(objects, **kwargs)]
+
+    def test_results_follow_the_objects(self):
+        widget = Widget(1, broken=True)
+        objects = [widget, Gadget(1), Widget(2), Gadget(2, loose=True), widget]
+        expected = [
+            ('Widget', 1, [("Widget is broken", True)]),
+            ('Gadget', 1, [("Gadget is loose", False)]),
+            ('Widget', 2, [("Widget is broken", False)]),
+            ('Gadget', 2, [("Gadget is loose", True)]),
+            ('Widget', 1, [("Widget is broken", True)]),
+        ]
+        for chunk_size in (1, 2, 500):
+            self.assertEqual(self.scan(iter(objects), chunk_size=chunk_size), expected)
+
+    def test_condition_ids_apply_to_their_classes(self):
+        objects = [Widget(1, broken=True), Gadget(1, loose=True)]
+        self.assertEqual(self.scan(objects, condition_ids=[self.gadget_pid, self.widget_pid]), [
+            ('Widget', 1, [("Widget is broken", True)]),
+            ('Gadget', 1, [("Gadget is loose", True)]),
+        ])
+        self.assertEqual(self.scan(objects, condition_ids=[self.gadget_pid]), [
+            ('Widget', 1, []),
+            ('Gadget', 1, [("Gadget is loose", True)]),
+        ])
+
+    def test_unknown_condition_ids_fail_first(self):
+        with self.assertRaises(Exception):
+            next(putils.check_many([Widget(1)], condition_ids=[self.widget_pid, "nope"]))
+
+    def test_fix(self):
+        widgets = [Widget(1, broken=True), Widget(2), Widget(3, broken=True)]
+        profile = Profile()
+        results = list(putils.check_many(widgets, fix=True, profile=profile))
+        self.assertEqual([w.broken for w in widgets], [False, False, False])
+        self.assertEqual([x.conditions[0]['rectified'] for x in results], [True, None, True])
+        # One rectify phase for the group - outside of serializing it
+        self.assertEqual(profile.phases['rectify'][1], 1)
+        self.assertEqual(profile.phases['serialize'][1], 1)
+
+    def test_scan_result(self):
+        result, = putils.check_many([Widget(1, broken=True)])
+        self.assertIsInstance(result, ScanResult)
+        self.assertIsInstance(result.conditions[0], ConditionResult)
+        data = result.to_dict()
+        self.assertEqual((data['ctxt_klass'], data['ctxt_id']), ('Widget', 1))
+        self.assertIs(type(data['conditions'][0]), dict)
+        self.assertEqual(data['conditions'][0]['pid'], self.widget_pid)
+        self.assertEqual(json.loads(json.dumps(data)), data)
+
+
+class BatchDetectorTest(PluginTestCase):
+
+    def setUp(self):
+        super(BatchDetectorTest, self).setUp()
+        self.load_plugin("worn_widgets", WORN_WIDGET_PLUGIN)
+        self.registered = self.registry.get_condition("Widget is worn")
+        self.detector = self.registered.detectors[0]
+        # Detectors blowing up are logged with their traceback
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def widget(self, id, wear=None):
+        widget = Widget(id)
+        if wear is not None:
+            widget.wear = wear
+        return widget
+
+    def test_run(self):
+        widgets = [self.widget(1, 7), self.widget(2, 1), self.widget(3), self.widget(4, 9)]
+        self.assertEqual(batch.run(self.detector, widgets), [
+            (True, "First one is worn"),
+            (False, None),
+            (None, "Cannot read wear"),
+            (True, "Worn out"),
+        ])
+        # The unreadable row is left out of the batch
+        self.assertEqual(widgets[0].batch, (3, 'ndarray'))
+        self.assertFalse(hasattr(widgets[2], 'batch'))
+
+    def test_run_errors(self):
+        widgets = [self.widget(1, 7), self.widget(2, -1)]
+        self.assertEqual(batch.run(self.detector, widgets), [(None, "Negative wear")] * 2)
+
+    def test_without_numpy(self):
+        self.addCleanup(setattr, batch, 'numpy', batch.numpy)
+        batch.numpy = None
+        widgets = [self.widget(1, 1), self.widget(2, 7)]
+        self.assertEqual(batch.run(self.detector, widgets), [(False, None), (True, "Worn out")])
+        self.assertEqual(widgets[0].batch, (2, 'list'))
+
+    def test_detect_many(self):
+        widgets = [self.widget(1, 7), self.widget(2, 1), self.widget(3), self.widget(4, 9)]
+        conditions = [ContextualCondition(w, self.registered) for w in widgets]
+        ContextualCondition.detect_many(conditions)
+
+        self.assertEqual([bool(c.detected) for c in conditions[:2]], [True, False])
+        self.assertIs(conditions[1].detected, False)
+        self.assertIsNone(conditions[2].detected)
+        self.assertEqual(conditions[2].last_message, "Cannot read wear")
+        self.assertEqual(conditions[3].detected.message, "Worn out")
+        self.assertTrue(all(c.detector_tried for c in conditions))
+        self.assertEqual(widgets[0].batch, (3, 'ndarray'))
+
+    def test_single(self):
+        # Outside of a batch, the detector checks a batch of one
+        worn = ContextualCondition(self.widget(1, 7), self.registered)
+        self.assertTrue(worn.detect())
+        self.assertEqual(worn.detected.message, "First one is worn")
+        self.assertEqual(worn.context.batch, (1, 'ndarray'))
+
+        self.assertIs(ContextualCondition(self.widget(2, 1), self.registered).detect(), False)
+
+        unreadable = ContextualCondition(self.widget(3), self.registered)
+        self.assertIsNone(unreadable.detect())
+        self.assertEqual(unreadable.last_message, "Cannot read wear")
+
+
+class FixturesTest(PluginTestCase):
+
+    def setUp(self):
+        super(FixturesTest, self).setUp()
+        self.path = self.load_plugin("gauges", GAUGE_PLUGIN)
+        self.calls = sys.modules[plugin_support.loaded[self.path]['module']].calls
+
+    def widget(self, id, pressure):
+        widget = Widget(id)
+        widget.pressure = pressure
+        return widget
+
+    def detected(self, results):
+        return dict((x['name'], x['detected']) for x in results)
+
+    def test_fixture_names(self):
+        def check(self, widget, gauge, valve, strict=False):
+            pass
+
+        def plain(self, widget, strict=False):
+            pass
+
+        self.assertEqual(fixture_names(check), ('gauge', 'valve'))
+        self.assertEqual(fixture_names(plain), ())
+
+    def test_scope(self):
+        scope = self.proctor.fixture_scope(self.widget(1, 5))
+        self.assertIsInstance(scope, FixtureScope)
+        self.assertEqual(scope.get('gauge'), 5)
+        self.assertEqual(scope.arguments(['gauge']), {'gauge': 5})
+        self.assertEqual(self.calls, [1])
+        with self.assertRaises(LookupError):
+            scope.get('valve')
+
+        # A failure is kept too
+        scope = self.proctor.fixture_scope(self.widget(2, None))
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                scope.get('gauge')
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_shared_by_a_check_pass(self):
+        widget = self.widget(1, 5)
+        expected = {"Widget is leaking": True, "Widget is overloaded": False}
+        self.assertEqual(self.detected(putils.check_conditions(widget)), expected)
+        self.assertEqual(self.calls, [1])
+        # Each pass has its scope
+        self.assertEqual(self.detected(list(putils.check_many([widget]))[0].conditions), expected)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_computed_for_each_call_outside_a_pass(self):
+        widget = self.widget(1, 5)
+        for _ in range(2):
+            self.assertTrue(ContextualCondition(widget, self.registry.get_condition("Widget is leaking")).detect())
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_failing_fixture_is_inconclusive(self):
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        results = self.detected(putils.check_conditions(self.widget(1, None)))
+        self.assertEqual(results, {"Widget is leaking": None, "Widget is overloaded": None})
+        self.assertEqual(self.calls, [1])
+
+    def test_cleared_when_rectified(self):
+        # Fixing the leak changes the pressure - the next condition reads the gauge again
+        widget = self.widget(1, 5)
+        results = self.detected(putils.fix_conditions(widget))
+        self.assertEqual(results, {"Widget is leaking": True, "Widget is overloaded": True})
+        self.assertEqual(self.calls, [1, 1])
+
+        scope = self.proctor.fixture_scope(widget)
+        scope.get('gauge')
+        scope.clear()
+        scope.get('gauge')
+        self.assertEqual(self.calls, [1, 1, 1, 1])
+
+    def test_reads_are_tracked(self):
+        self.addCleanup(setattr, self.proctor, 'dependency_tracker', self.proctor.dependency_tracker)
+        self.proctor.enable_dependency_tracking()
+        widget = self.widget(1, 5)
+        scope = self.proctor.fixture_scope(widget)
+        scope.get('gauge')
+        self.assertEqual(scope.reads(['gauge']), frozenset(['id', 'pressure']))
+
+        putils.check_conditions(widget)
+        pid = self.registry.get_condition("Widget is overloaded").condition.pid
+        self.assertEqual(self.proctor.dependency_tracker.reads(pid, widget), frozenset(['id', 'pressure']))
+
+    def test_reloaded_with_the_plugin(self):
+        self.proctor.add_paths([self.directory])
+        self.write_plugin("gauges", GAUGE_PLUGIN.replace("return widget.pressure", "return widget.pressure * 10"))
+        self.assertEqual(self.proctor.reload_plugins(), [self.path])
+        self.assertEqual(self.proctor.fixture_scope(self.widget(1, 5)).get('gauge'), 50)
+
+
+class LazyPluginsTest(PluginTestCase):
+
+    def setUp(self):
+        super(LazyPluginsTest, self).setUp()
+        self.path = self.write_plugin("widgets", WIDGET_PLUGIN)
+        self.assertTrue(self.proctor.index_plugins(self.directory))
+        # Whatever was not looked up is imported, to be taken out with the rest
+        self.addCleanup(self.registry.get_registered_conditions, Widget)
+
+    def test_modules_are_imported_on_first_lookup(self):
+        class Gadget(object):
+            pass
+
+        self.assertNotIn(self.path, plugin_support.loaded)
+        self.assertEqual(self.registry.get_registered_conditions(Gadget), [])
+        self.assertNotIn(self.path, plugin_support.loaded)
+
+        conditions = self.registry.get_registered_conditions(Widget)
+        self.assertEqual([c.name for c in conditions], ["Widget is broken"])
+        module = sys.modules[plugin_support.loaded[self.path]['module']]
+
+        self.registry.get_registered_conditions(Widget)
+        self.assertIs(sys.modules[plugin_support.loaded[self.path]['module']], module)
+        self.assertIsNone(self.registry.pending)
+
+    def test_condition_lookup_imports_its_module(self):
+        self.assertNotIn(self.path, plugin_support.loaded)
+        self.assertEqual(self.registry.get_condition("Widget is broken").name, "Widget is broken")
+        self.assertIn(self.path, plugin_support.loaded)
+
+    def test_subclass_lookup_imports_the_modules_of_its_bases(self):
+        class SpareWidget(Widget):
+            pass
+
+        self.assertEqual(
+            [c.name for c in self.registry.get_registered_conditions(SpareWidget)], ["Widget is broken"])
+
+
+class PluginStartupTest(PluginTestCase):
+    """Plugin directories added as cars.apps does, then the startup of the proctor app"""
+
+    def setUp(self):
+        super(PluginStartupTest, self).setUp()
+        self.path = self.write_plugin("widgets", WIDGET_PLUGIN)
+        self.addCleanup(self.registry.get_registered_conditions, Widget)
+
+    @override_settings(PROCTOR_LAZY_PLUGINS=True)
+    def test_lazy_plugins_are_imported_once(self):
+        self.proctor.add_paths([self.directory], lazy=settings.PROCTOR_LAZY_PLUGINS)
+        apps.get_app_config('proctor').ready()
+        self.assertNotIn(self.path, plugin_support.loaded)
+
+        version = self.registry.version
+        self.assertEqual(
+            [c.name for c in self.registry.get_registered_conditions(Widget)], ["Widget is broken"])
+        self.assertEqual(self.registry.version, version + 1)
+        self.assertIsNone(self.registry.pending)
+
+    def test_eager_loading_takes_the_modules_out_of_the_index(self):
+        self.proctor.index_plugins(self.directory)
+        self.proctor.load_plugins_from(self.directory, lazy=False)
+        self.assertIn(self.path, plugin_support.loaded)
+        self.assertIsNone(self.registry.pending)
+
+        version = self.registry.version
+        self.registry.get_registered_conditions(Widget)
+        self.assertEqual(self.registry.version, version)
+
+
+class CheckAllTest(SimpleTestCase):
+
+    def test_disconnecting_stops_the_scan(self):
+        stats = metrics.check_all_stats
+        requests = stats.requests
+        response = self.client.post(
+            '/proctor/Vehicle/check_all', json.dumps({'pids': []}), content_type='application/json')
+        content = iter(response.streaming_content)
+        self.assertEqual(next(content), "Starting to crunch\n")
+        self.assertEqual(next(content), "Ready for results\n")
+        self.assertEqual(stats.requests, requests + 1)
+
+        # The client goes away before the first result
+        response.close()
+        self.assertEqual(stats.requests, requests)
+
+
+def spec(applies_to=None, excludes=None):
+    return {'applies_to': applies_to or {}, 'excludes': excludes or {}}
+
+
+def lookups(query):
+    """A Q object as (connector, negated, children) - None for None"""
+    if query is None:
+        return None
+    return (query.connector, query.negated, [lookups(c) if isinstance(c, Q) else c for c in query.children])
+
+
+class SpecQueryTest(SimpleTestCase):
+
+    def query(self, *specs):
+        return lookups(spec_query(Car, list(specs)))
+
+    def test_fields_are_queried(self):
+        self.assertEqual(self.query(spec({'color': ['red']})), ('AND', False, [('color__in', ['red'])]))
+
+    def test_dotted_relations_are_queried(self):
+        self.assertEqual(
+            self.query(spec({'owner.region': ['north']})), ('AND', False, [('owner__region__in', ['north'])]))
+
+    def test_keys_that_are_not_fields_are_left_to_the_filters(self):
+        for key in ('painted', 'owner.display_name', 'drivers.name', 'color.upper', 'owner._state'):
+            self.assertIsNone(self.query(spec({key: [True]})), key)
+        self.assertEqual(
+            self.query(spec({'color': ['red'], 'owner.display_name': ['Bob']})),
+            ('AND', False, [('color__in', ['red'])]))
+
+    def test_excludes_are_negated(self):
+        self.assertEqual(
+            self.query(spec(excludes={'owner.region': ['south']})),
+            ('AND', False, [('AND', True, [('owner__region__in', ['south'])])]))
+
+    def test_specs_are_combined(self):
+        self.assertEqual(
+            self.query(spec({'color': ['red']}), spec({'owner.region': ['north']})),
+            ('OR', False, [('color__in', ['red']), ('owner__region__in', ['north'])]))
+        # Any object may match the second spec
+        self.assertIsNone(self.query(spec({'color': ['red']}), spec({'painted': [True]})))
+        self.assertEqual(self.query(), ('AND', False, [('pk__in', [])]))
+        self.assertIsNone(spec_query(Car, None))
+
+
+class QuerySetProviderTest(TestCase):
+
+    # Models not managed by the migrations - their tables are made here
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            editor.create_model(Owner)
+            editor.create_model(Car)
+        super(QuerySetProviderTest, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(QuerySetProviderTest, cls).tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(Car)
+            editor.delete_model(Owner)
+
+    @classmethod
+    def setUpTestData(cls):
+        north = Owner.objects.create(name="ann", region="north")
+        south = Owner.objects.create(name="bob", region="south")
+        cls.cars = {}
+        for color, owner in (('red', north), ('red', south), ('blue', north), ('green', None)):
+            car = Car.objects.create(color=color, owner=owner)
+            cls.cars["{}-{}".format(color, owner.region if owner else None)] = car.pk
+
+    def setUp(self):
+        self.provider = QuerySetProvider(Car)
+
+    def matching(self, specs, chunk_size=500):
+        chunks = list(self.provider.iter_matching(specs, chunk_size))
+        names = dict((pk, name) for name, pk in self.cars.iteritems())
+        return [sorted(names[car.pk] for car in chunk) for chunk in chunks]
+
+    def test_fields_and_relations(self):
+        self.assertEqual(
+            self.matching([spec({'color': ['red'], 'owner.region': ['north']})]), [['red-north']])
+
+    def test_excludes(self):
+        self.assertEqual(
+            self.matching([spec({'color': ['red']}, {'owner.region': ['north']})]), [['red-south']])
+
+    def test_keys_that_are_not_fields_match_every_object(self):
+        self.assertEqual(
+            self.matching([spec({'owner.display_name': ['Ann']})]),
+            [['blue-north', 'green-None', 'red-north', 'red-south']])
+
+    def test_objects_matching_several_specs_come_once(self):
+        self.assertEqual(
+            self.matching([spec({'color': ['red']}), spec({'owner.region': ['north']})], chunk_size=2),
+            [['red-north', 'red-south'], ['blue-north']])
+
+    def test_filter_takes_django_lookups(self):
+        self.assertEqual(
+            sorted(car.pk for car in self.provider.filter(owner__name="ann")),
+            sorted([self.cars['red-north'], self.cars['blue-north']]))
+
+
+class ListProvider(ObjectProvider):
+    """Provider of the objects of a list - see ObjectProvider.select"""
+
+    def __init__(self, objects):
+        super(ListProvider, self).__init__(Widget)
+        self.objects = objects
+
+    def ids(self):
+        return range(len(self.objects))
+
+    def get(self, id):
+        return self.objects[id]
+
+    def select(self, applies_to=None, excludes=None):
+        match = compile_filter("ListProvider", applies_to or {}, excludes or {})
+        return (obj for obj in self.objects if match(None, obj))
+
+
+class ObjectProviderTest(SimpleTestCase):
+
+    def setUp(self):
+        self.widgets = [Widget(1, broken=True), Widget(2, spare=True), Widget(3, broken=True, spare=True), Widget(4)]
+
+    def test_objects_matching_several_specs_come_once(self):
+        provider = ListProvider(self.widgets)
+        chunks = provider.iter_matching([spec({'broken': [True]}), spec({'spare': [True]}, {'id': [3]})], 2)
+        self.assertEqual([[w.id for w in chunk] for chunk in chunks], [[1, 3], [2]])
+
+    def test_providers_that_cannot_select_give_every_object(self):
+        class FilterProvider(ListProvider):
+            select = ObjectProvider.select
+
+            def filter(self, **kwargs):
+                return iter(self.objects)
+
+        provider = FilterProvider(self.widgets)
+        self.assertFalse(provider.can_select)
+        chunks = provider.iter_matching([spec({'broken': [True]})], 3)
+        self.assertEqual([[w.id for w in chunk] for chunk in chunks], [[1, 2, 3], [4]])
+
+
+class RecordTest(SimpleTestCase):
+
+    def test_unset_fields_are_left_out(self):
+        record = ConditionResult(name="Widget is broken", level=1)
+        self.assertEqual(record.keys(), ['name', 'level'])
+        self.assertEqual(record.to_dict(), {'name': "Widget is broken", 'level': 1})
+        self.assertNotIn('pid', record)
+        self.assertIsNone(record.get('pid'))
+        self.assertFalse(record.pid)
+        with self.assertRaises(KeyError):
+            record['pid']
+
+        record.pid = None
+        self.assertEqual(record['pid'], None)
+        del record['pid']
+        self.assertNotIn('pid', record)
+
+    def test_update(self):
+        record = ConditionResult(name="Widget is broken")
+        record.update({'level': 1})
+        record.update(ConditionResult(msg="Does not turn"))
+        self.assertEqual(record, {'name': "Widget is broken", 'level': 1, 'msg': "Does not turn"})
+        with self.assertRaises(KeyError):
+            record.update({'unknown': 1})
+
+    def test_records_are_not_hashable(self):
+        with self.assertRaises(TypeError):
+            hash(ConditionResult())
+
+    def test_pickle(self):
+        record = ScanResult(ctxt_id=1, conditions=[ConditionResult(name="Widget is broken")])
+        copy = pickle.loads(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.to_dict(), record.to_dict())
+        self.assertNotIn('ctxt_klass', copy)
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class DispatchTest(PluginTestCase):
+
+    def setUp(self):
+        super(DispatchTest, self).setUp()
+        self.load_plugin("widgets", WIDGET_PLUGIN)
+        self.load_plugin("spare_widgets", WIDGET_SPARE_PLUGIN)
+        self.condition = self.registry.get_condition("Widget is broken")
+
+    def picked(self, obj):
+        return self.condition.get_detector(obj).__name__
+
+    def test_handler_picked_per_projection(self):
+        no_spare = Widget(3)
+        del no_spare.spare
+        self.assertEqual(self.picked(Widget(1, spare=True)), "SpareWidgetProctor")
+        self.assertEqual(self.picked(Widget(2)), "WidgetProctor")
+        self.assertEqual(self.picked(no_spare), "WidgetProctor")
+        self.assertEqual(self.picked(Widget(4, spare=True)), "SpareWidgetProctor")
+
+        table, = self.condition.detector_dispatch.tables
+        self.assertEqual(table.keys, ['spare'])
+        self.assertEqual(table.entries, {(True,): table.handlers[0], (False,): table.handlers[1], (MISSING,): table.handlers[1]})
+
+    def test_unhashable_values_are_not_tabled(self):
+        self.assertEqual(self.picked(Widget(1, spare=[True])), "WidgetProctor")
+        self.assertEqual(self.condition.detector_dispatch.tables[0].entries, {})
+
+    def test_picks_are_logged_once_debug_is_on(self):
+        self.picked(Widget(1))
+        handler = ListHandler()
+        ilog = logging.getLogger('proctor.internal')
+        ilog.addHandler(handler)
+        self.addCleanup(ilog.removeHandler, handler)
+        self.addCleanup(ilog.setLevel, ilog.level)
+        ilog.setLevel(logging.DEBUG)
+
+        self.picked(Widget(2, spare=True))
+        self.assertIn("Detector is {}".format(self.condition.detectors[0]), handler.messages)
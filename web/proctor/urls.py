@@ -7,6 +7,7 @@ urlpatterns = [
     url(r'^check/(?P<pid>\w+)', views.CheckItem.as_view(), {'fix': False}),
     url(r'^fix/(?P<pid>\w+)', views.CheckItem.as_view(), {'fix': True}),
     url(r'^list', views.APIConditionList.as_view()),
+    url(r'^metrics$', views.Metrics.as_view()),
 
 
     # Proctor web pages
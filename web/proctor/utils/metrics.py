@@ -0,0 +1,99 @@
+import threading
+from proctor_lib import plugin_support
+from proctor_lib.metrics import openmetrics, handler_families
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+class CheckAllStats(object):
+    """What the CheckAll views have going on - across requests (and threads)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0           # in flight
+        self.requests_total = 0
+        self.workers = 0            # pool capacity of the requests in flight
+        self.busy = 0               # workers checking a chunk
+        self.items = 0              # items of the chunks being checked
+        self.checked = 0
+
+    def started(self, pool_size):
+        with self._lock:
+            self.requests += 1
+            self.requests_total += 1
+            self.workers += pool_size
+
+    def finished(self, pool_size):
+        with self._lock:
+            self.requests -= 1
+            self.workers -= pool_size
+
+    def chunk_started(self, count):
+        with self._lock:
+            self.busy += 1
+            self.items += count
+
+    def chunk_done(self, count):
+        with self._lock:
+            self.busy -= 1
+            self.items -= count
+            self.checked += count
+
+    def families(self):
+        with self._lock:
+            return [
+                ('proctor_check_all_requests', 'counter', "Check all requests",
+                    [('_total', {}, self.requests_total)]),
+                ('proctor_check_all_in_flight_requests', 'gauge', "Check all requests running",
+                    [('', {}, self.requests)]),
+                ('proctor_check_all_in_flight_items', 'gauge', "Items being checked",
+                    [('', {}, self.items)]),
+                ('proctor_check_all_items', 'counter', "Items checked",
+                    [('_total', {}, self.checked)]),
+                ('proctor_check_all_pool_workers', 'gauge', "Workers of the running requests' pools",
+                    [('', {}, self.workers)]),
+                ('proctor_check_all_pool_busy_workers', 'gauge', "Workers checking a chunk",
+                    [('', {}, self.busy)]),
+                ('proctor_check_all_pool_utilisation', 'gauge', "Busy workers over the pools' workers",
+                    [('', {}, float(self.busy) / self.workers if self.workers else 0.0)]),
+            ]
+
+check_all_stats = CheckAllStats()
+
+
+def engine_families(proctor):
+    """Metric families of the registry, the plugins, the result cache and the handlers"""
+    # Scraping must not import the lazy plugins
+    snapshot = proctor.get_registry(load=False)
+    families = [
+        ('proctor_condition', 'info', "Registered conditions",
+            [('_info', {'pid': c.condition.pid, 'name': c.name}, 1) for c in snapshot.values()]),
+        ('proctor_registry_version', 'gauge', "Version of the published registry",
+            [('', {}, snapshot.version)]),
+        ('proctor_plugin_modules', 'gauge', "Plugin modules imported",
+            [('', {}, len(plugin_support.loaded))]),
+        ('proctor_plugin_load_seconds', 'counter', "Time spent loading plugins",
+            [('_total', {}, proctor.plugin_load_seconds)]),
+    ]
+
+    cache = proctor.result_cache
+    if cache is not None:
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        families.extend([
+            ('proctor_result_cache_hits', 'counter', "Results found in the cache", [('_total', {}, stats['hits'])]),
+            ('proctor_result_cache_misses', 'counter', "Results not in the cache", [('_total', {}, stats['misses'])]),
+            ('proctor_result_cache_hit_ratio', 'gauge', "Hits over lookups",
+                [('', {}, float(stats['hits']) / lookups if lookups else 0.0)]),
+            ('proctor_result_cache_entries', 'gauge', "Results cached", [('', {}, stats['size'])]),
+            ('proctor_result_cache_max_entries', 'gauge', "Results kept at most", [('', {}, stats['max_size'])]),
+        ])
+
+    if proctor.metrics is not None:
+        families.extend(handler_families(proctor.metrics.snapshot()))
+    return families
+
+
+def render(proctor):
+    """The metrics page - OpenMetrics text"""
+    return openmetrics(engine_families(proctor) + check_all_stats.families())
@@ -1,4 +1,9 @@
 import logging
+import itertools
+from django.db.models import Q
+from django.core.exceptions import FieldDoesNotExist
+from proctor_lib.cache import context_version
+from proctor_lib.predicates import compile_filter
 
 log = logging.getLogger('proctor.util')
 
@@ -17,9 +22,258 @@ class ObjectProvider(object):
     def filter(self, **kwargs):
         raise NotImplementedError()
 
+    def select(self, applies_to=None, excludes=None):
+        """
+        The objects that match a spec - every key of applies_to and none of excludes
+        (the rules of ProctorObject filters).  Optional - see iter_matching.
+        """
+        raise NotImplementedError()
+
+    @property
+    def can_select(self):
+        return self.__class__.select.im_func is not ObjectProvider.select.im_func
+
     def ids(self, **kwargs):
         raise NotImplementedError()
 
+    def get_many(self, ids):
+        """
+        The objects with the given ids - one round trip where the backend allows it.
+        Ids that cannot be fetched are left out.  Falls back to get() per id.
+        """
+        objects = []
+        for _id in ids:
+            try:
+                objects.append(self.get(_id))
+            except Exception:
+                log.exception("Cannot get {} {}".format(self.model_class.__name__, _id))
+        return objects
+
+    def iter_chunks(self, chunk_size=500, related=None):
+        """
+        All the objects - in lists of up to chunk_size fetched with get_many().
+        related: the related objects to fetch along (see proctor_lib.utils.query_related)
+        - providers that cannot use the hint ignore it.
+        """
+        ids = iter(self.ids())
+        while True:
+            chunk = list(itertools.islice(ids, chunk_size))
+            if not chunk:
+                return
+            objects = self.get_many(chunk)
+            if objects:
+                yield objects
+
+    def iter_matching(self, specs, chunk_size=500, related=None):
+        """
+        The objects that match any of the specs (see proctor_lib.utils.query_specs)
+        in lists of up to chunk_size.  With no specs (None) or a provider
+        that cannot select, every object.
+        """
+        if specs is None or not self.can_select:
+            for objects in self.iter_chunks(chunk_size, related=related):
+                yield objects
+            return
+
+        objects = self._matching(specs)
+        while True:
+            chunk = list(itertools.islice(objects, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _matching(self, specs):
+        """
+        Objects matching any spec - an object matching several comes once,
+        with the first of them: the earlier specs are tested on the object
+        rather than the objects seen kept for the whole scan.
+        """
+        earlier = []
+        for spec in specs:
+            applies_to, excludes = spec.get('applies_to', {}), spec.get('excludes', {})
+            for obj in self.select(applies_to, excludes):
+                if not any(match(None, obj) for match in earlier):
+                    yield obj
+            earlier.append(compile_filter(self.model_class.__name__, applies_to, excludes))
+
+    def version(self, obj):
+        """Version of the object for the result cache - None if it cannot tell"""
+        return context_version(obj)
+
+
+class QuerySetProvider(ObjectProvider):
+    """
+    Provider for Django models.
+
+    Scans with keyset pagination on the primary key - one query per chunk,
+    with the related objects the detectors read joined (select_related) or
+    fetched once per chunk (prefetch_related).
+    """
+
+    def queryset(self, related=None):
+        queryset = self.model_class._default_manager.all()
+        if related:
+            select, prefetch = self.related_lookups(related)
+            if select:
+                queryset = queryset.select_related(*select)
+            if prefetch:
+                queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def related_lookups(self, related):
+        """
+        Django lookups for the related paths - (select_related, prefetch_related).
+        Paths through a to-many relation are prefetched, paths that are not
+        relations of the model are dropped.
+        """
+        select = set()
+        prefetch = set(path.replace(".", "__") for path in related.get('prefetch_related', ()))
+        for path in related.get('select_related', ()):
+            kind = self._relation(path)
+            if kind == 'single':
+                select.add(path.replace(".", "__"))
+            elif kind == 'many':
+                prefetch.add(path.replace(".", "__"))
+        return sorted(select), sorted(prefetch)
+
+    def _relation(self, path):
+        """'single' for a path of to-one relations, 'many' if one is to-many, None if not a relation"""
+        model = self.model_class
+        kind = 'single'
+        for name in path.split("."):
+            if name.startswith("_"):
+                return None
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.is_relation or field.related_model is None:
+                return None
+            if field.many_to_many or field.one_to_many:
+                kind = 'many'
+            model = field.related_model
+        return kind
+
+    def get(self, id, **kwargs):
+        return self.queryset().get(pk=id)
+
+    def get_many(self, ids):
+        objects = self.queryset().in_bulk(ids)
+        return [objects[_id] for _id in ids if _id in objects]
+
+    def all(self):
+        return self.queryset().iterator()
+
+    def ids(self, **kwargs):
+        return self.queryset().order_by('pk').values_list('pk', flat=True).iterator()
+
+    def filter(self, **kwargs):
+        return self.queryset().filter(**kwargs).iterator()
+
+    def select(self, applies_to=None, excludes=None):
+        query = spec_query(self.model_class, [{'applies_to': applies_to or {}, 'excludes': excludes or {}}])
+        queryset = self.queryset()
+        return (queryset.filter(query) if query is not None else queryset).iterator()
+
+    def iter_chunks(self, chunk_size=500, related=None, query=None):
+        queryset = self.queryset(related).order_by('pk')
+        if query is not None:
+            queryset = queryset.filter(query).distinct()
+
+        last = None
+        while True:
+            page = queryset if last is None else queryset.filter(pk__gt=last)
+            chunk = list(page[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last = chunk[-1].pk
+
+    def iter_matching(self, specs, chunk_size=500, related=None):
+        """One query per chunk for all the specs - see spec_query"""
+        query = spec_query(self.model_class, specs)
+        return self.iter_chunks(chunk_size, related=related, query=query)
+
+
+_providers = {}
+
+
+def provider_for(model):
+    """
+    The provider of a model class - its own 'provider', or a QuerySetProvider
+    for Django models.  None if the objects of the model cannot be fetched.
+    """
+    provider = getattr(model, 'provider', None)
+    if isinstance(provider, ObjectProvider):
+        return provider
+    if hasattr(model, '_default_manager'):
+        if model not in _providers:
+            _providers[model] = QuerySetProvider(model)
+        return _providers[model]
+    return None
+
+
+def spec_query(model, specs):
+    """
+    Django Q object for the specs (see ObjectProvider.iter_matching) - None
+    when it would not narrow anything.
+
+    Only keys that are fields of the model, or of the models its to-one
+    relations lead to, are queried ('owner.region' becomes 'owner__region__in');
+    the others (properties, methods, to-many relations) are left to the
+    ProctorObject filters - the query may match more objects, never less.
+    """
+    if specs is None:
+        return None
+
+    query = None
+    for spec in specs:
+        q = Q()
+        for key, values in spec.get('applies_to', {}).iteritems():
+            lookup = _field_lookup(model, key)
+            if lookup:
+                q &= Q(**{lookup + '__in': list(values)})
+        for key, values in spec.get('excludes', {}).iteritems():
+            lookup = _field_lookup(model, key)
+            if lookup:
+                q &= ~Q(**{lookup + '__in': list(values)})
+        if not q:
+            # Nothing to query on - any object may match this spec
+            return None
+        query = q if query is None else query | q
+    return query if query is not None else Q(pk__in=[])
+
+
+def _field_lookup(model, key):
+    """Django lookup path for a dotted key - None unless every part is a field (see spec_query)"""
+    parts = key.split(".")
+    for name in parts:
+        if model is None or name.startswith("_"):
+            return None
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if field.many_to_many or field.one_to_many:
+            # The filters read a manager there - nothing a query can match
+            return None
+        if field.is_relation:
+            model = field.related_model
+            if model is None:
+                # e.g. a generic foreign key
+                return None
+        else:
+            model = None
+    return "__".join(parts)
+
+
+def provider_version(obj):
+    """Result cache version hook - asks the provider of the object's model"""
+    provider = getattr(obj, "provider", None)
+    if isinstance(provider, ObjectProvider):
+        return provider.version(obj)
+    return context_version(obj)
+
 
 class ProctorProviderMeta(type):
     def __init__(cls, name, bases, attrs):
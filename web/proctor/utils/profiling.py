@@ -0,0 +1,81 @@
+import os
+import re
+import json
+import time
+import logging
+from django import http
+from django.conf import settings
+from proctor_lib.profiling import Profile
+
+log = logging.getLogger('proctor.profile')
+
+# ?profile=<mode> or an 'X-Proctor-Profile: <mode>' header
+HEADER = 'HTTP_X_PROCTOR_PROFILE'
+
+
+def requested(request):
+    """
+    The profiling mode the request asks for - None when it does not (or is not staff):
+        text    the response is replaced by the phases and the cProfile statistics
+        other   the phases are sent along in a Server-Timing header
+    """
+    mode = request.GET.get('profile') or request.META.get(HEADER)
+    if not mode:
+        return None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        log.warn("Profiling {} refused - not staff".format(request.path))
+        return None
+    return mode
+
+
+def server_timing(profile):
+    """The phases as a Server-Timing header"""
+    breakdown = profile.breakdown()
+    timings = ["{};dur={:.3f}".format(name, info['seconds'] * 1000)
+               for name, info in sorted(breakdown['phases'].items())]
+    timings.append("total;dur={:.3f}".format(breakdown['wall'] * 1000))
+    return ", ".join(timings)
+
+
+def store(profile, request):
+    """Keep the profile in PROCTOR_PROFILE_DIR (if set) - <name>.prof and <name>.json; returns the name"""
+    directory = getattr(settings, 'PROCTOR_PROFILE_DIR', None)
+    if not directory:
+        return None
+    name = "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), re.sub(r'[^\w]+', '_', request.path).strip('_'))
+    try:
+        profile.dump(os.path.join(directory, name + ".prof"))
+        with open(os.path.join(directory, name + ".json"), 'w') as fout:
+            json.dump({
+                'path': request.get_full_path(),
+                'user': request.user.get_username(),
+                'breakdown': profile.breakdown(),
+            }, fout, indent=2)
+    except (IOError, OSError):
+        log.exception("Cannot store the profile of {}".format(request.path))
+        return None
+    return name
+
+
+class ProfiledMixin(object):
+    """A view staff can profile per request - see requested"""
+
+    def dispatch(self, request, *args, **kwargs):
+        mode = requested(request)
+        if mode is None:
+            return super(ProfiledMixin, self).dispatch(request, *args, **kwargs)
+
+        profile = Profile()
+        with profile:
+            response = super(ProfiledMixin, self).dispatch(request, *args, **kwargs)
+        name = store(profile, request)
+        log.info("Profiled {} in {:.3f}s".format(request.get_full_path(), profile.wall))
+
+        if mode == 'text':
+            response = http.HttpResponse(profile.report(), content_type='text/plain')
+        else:
+            response['Server-Timing'] = server_timing(profile)
+        if name:
+            response['X-Proctor-Profile'] = name
+        return response
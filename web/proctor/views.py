@@ -5,7 +5,7 @@ from __future__ import unicode_literals
 import json
 import logging
 import gevent.pool
-import gevent.event
+import gevent.queue
 from django import http
 from django.conf import settings
 from django.views.generic import View
@@ -15,6 +15,10 @@ from django.shortcuts import render_to_response, render
 
 from proctor_lib import Proctor
 import proctor_lib.utils as putils
+from .utils.model import provider_for
+from .utils import metrics
+from .utils.profiling import ProfiledMixin
+from proctor_lib.profiling import phase
 from django.apps import apps
 
 log = logging.getLogger('proctor.web')
@@ -72,14 +76,13 @@ def get_model_class(class_name):
 
 def get_model_instance(model, id):
     """Get a single instance of a model given an id"""
-    if hasattr(model, "objects"):
-        return model.objects.get(id=id)
-    if hasattr(model, "provider"):
-        return model.provider.get(id)
-    raise Exception("No model instance")
+    provider = provider_for(model)
+    if provider is None:
+        raise Exception("No model instance")
+    return provider.get(id)
 
 
-class ItemView(View):
+class ItemView(ProfiledMixin, View):
     """Display the instance with the list of conditions that can be checked"""
 
     template_name = 'proctor/single_context.html'
@@ -88,10 +91,12 @@ class ItemView(View):
         log.info("{} id {}".format(kwargs.get('model_name'), kwargs.get('model_id')))
 
         context = {}
-        context_class = get_model_class(kwargs.get('model_name'))
-        instance = get_model_instance(context_class, kwargs.get('model_id'))
+        with phase('model'):
+            context_class = get_model_class(kwargs.get('model_name'))
+        with phase('fetch'):
+            instance = get_model_instance(context_class, kwargs.get('model_id'))
 
-        context['conditions'] = putils.get_context_conditions(instance)
+        context['conditions'] = [c.to_dict() for c in putils.get_context_conditions(instance)]
         context['conditions'] = sorted(context['conditions'], key=lambda x: x['level'])
         context['ctxt_klass'] = kwargs.get('model_name')
         context['ctxt_id'] = kwargs.get('model_id')
@@ -101,7 +106,8 @@ class ItemView(View):
         ctxt = {}
         ctxt.update(self.get_context_data(model_name=model_name, model_id=model_id))
         map(prep_condition, ctxt['conditions'])
-        return render(request, self.template_name, ctxt)
+        with phase('render'):
+            return render(request, self.template_name, ctxt)
 
 
 class APIConditionList(View):
@@ -122,7 +128,7 @@ class APIConditionList(View):
         else:
             # Give back contextual conditions based on what actually applies to the instance
             instance = get_model_instance(get_model_class(model_name), model_id)
-            ctxt['conditions'] = putils.get_context_conditions(instance)
+            ctxt['conditions'] = [c.to_dict() for c in putils.get_context_conditions(instance)]
             ctxt['conditions'] = sorted(ctxt['conditions'], key=lambda x: x['level'])
             ctxt['ctxt_klass'] = model_name
             ctxt['ctxt_id'] = model_id
@@ -141,7 +147,7 @@ class ConditionList(View):
         return render(request, 'proctor/no_context.html', ctxt)
 
 
-class CheckItem(View):
+class CheckItem(ProfiledMixin, View):
     """Check a specific condition given a context"""
 
     def get(self, request, pid, fix=False):
@@ -149,49 +155,53 @@ class CheckItem(View):
         context_id = request.GET.get('model_id')
         log.info("Checking condition {} on {} {}".format(pid, context_class, context_id))
 
-        context_class = get_model_class(context_class)
-        instance = get_model_instance(context_class, context_id)
+        with phase('model'):
+            context_class = get_model_class(context_class)
+        with phase('fetch'):
+            instance = get_model_instance(context_class, context_id)
 
         ctxt = {}
         if fix:
             # The fix_condition method here will internally check if the condition exists
             # before running any fixes.
-            ctxt['condition'] = prep_condition(putils.fix_condition(pid, instance))
+            ctxt['condition'] = prep_condition(putils.fix_condition(pid, instance).to_dict())
             log.info("{} attempted fix {}:[{}] on {} {}".format(
                 request.user.id,
                 pid,
-                ctxt['condition'].name,
+                ctxt['condition']['name'],
                 request.GET.get('model'),
                 context_id))
 
             # Get a fresh instance and check it again for re-presenting to the user.
             # Ideally this would show that the condition is no longer detected.
-            instance = get_model_instance(context_class, context_id)
+            with phase('fetch'):
+                instance = get_model_instance(context_class, context_id)
 
             # TODO: don't lose the "ran the rectifier" flag from fixing it.
             # Right now, that flag does not get reflected to the user.
-            checked_condition = prep_condition(putils.check_condition(pid, instance))
+            checked_condition = prep_condition(putils.check_condition(pid, instance).to_dict())
             checked_condition['rectified'] = ctxt['condition']['rectified']
             checked_condition['rectifier_tried'] = ctxt['condition']['rectifier_tried']
             ctxt['condition'] = checked_condition
 
         else:
-            ctxt['condition'] = prep_condition(putils.check_condition(pid, instance))
+            ctxt['condition'] = prep_condition(putils.check_condition(pid, instance).to_dict())
             if ctxt['condition']['detected']:
                 log.info("{} detected {}:[{}] on {} {}".format(
                     request.user.id,
                     pid,
-                    ctxt['condition'].name,
+                    ctxt['condition']['name'],
                     request.GET.get('model'),
                     context_id))
 
         # We can return the JSON data or serve up rendered context conditions
         log.info("Sending data as {}".format(request.META['HTTP_ACCEPT']))
-        if 'application/fragment' in request.META['HTTP_ACCEPT']:
-            ctxt['context_obj'] = instance
-            return render(request, 'proctor/fragments/condition_ctxt.html', ctxt)
-        else:
-            return http.HttpResponse(json.dumps(ctxt['condition']), content_type='application/json')
+        with phase('render'):
+            if 'application/fragment' in request.META['HTTP_ACCEPT']:
+                ctxt['context_obj'] = instance
+                return render(request, 'proctor/fragments/condition_ctxt.html', ctxt)
+            else:
+                return http.HttpResponse(json.dumps(ctxt['condition']), content_type='application/json')
 
 
 class CheckAll(View):
@@ -199,115 +209,100 @@ class CheckAll(View):
 
     def post(self, request, model_name):
         context_class = get_model_class(model_name)
+        provider = provider_for(context_class)
 
         options = json.loads(request.body)
         log.info("check {} on {}".format(model_name, options))
 
-        collect_results = gevent.event.Event()  # a signal to begin waiting for async results
-
-        def check_conditions(item, pids):
-            """Greenlet: Runs the conditions on the item"""
+        # Workers checking items and results waiting to be sent are both bounded:
+        # producers block when the client reads slower than the checks complete
+        pool_size = getattr(settings, 'PROCTOR_CHECK_ALL_POOL_SIZE', 10)
+        queue_size = getattr(settings, 'PROCTOR_CHECK_ALL_QUEUE_SIZE', 2 * pool_size)
+        keepalive = getattr(settings, 'PROCTOR_CHECK_ALL_KEEPALIVE', 4)
+        chunk_size = getattr(settings, 'PROCTOR_CHECK_ALL_CHUNK_SIZE', 50)
+        completed = gevent.queue.Queue(maxsize=queue_size)
+        done = object()  # put on the queue when every item was checked
+
+        def check_conditions(items, pids):
+            """Greenlet: Runs the conditions on a chunk of items and queues the results"""
+            metrics.check_all_stats.chunk_started(len(items))
             try:
-                ctxt = {}
-                ctxt['ctxt_klass'] = item.__class__.__name__
-                ctxt['ctxt_id'] = item.id
-                ctxt['conditions'] = []
-                for pid in options['pids']:
-                    condition = putils.check_condition(pid, item)
-                    ctxt['conditions'].append(condition)
-                return ctxt
+                for result in putils.check_many(items, chunk_size=len(items), condition_ids=pids):
+                    completed.put(result.to_dict())
             except gevent.GreenletExit:
                 log.error("GreenletExit in check condition")
-                raise Exception("Pre-empted")
+                raise
+            except Exception:
+                # Continue checking items
+                log.exception("unexpected exception checking {} items".format(len(items)))
+            finally:
+                metrics.check_all_stats.chunk_done(len(items))
 
-        def data_generator(model_class, pids, results):
+        def data_generator(pids):
             """
             Greenlet: Launches and manages a pool of workers that check
-            conditions on all the items.
+            conditions on all the items - fetched a chunk at a time.
             """
+            pool = gevent.pool.Pool(pool_size)
             try:
-                pool = gevent.pool.Pool(10)
-
-                collect_results.set()  # Tell the generator to start waiting on results
-
-                # Get the list of id's only first
-                # TODO: Checking across all instances is only supported on LDAP models
-                #ids = model_class.objects.all().values_list('id', flat=True)
-                ids = model_class.provider.ids()
-
-                for dev_id in ids:
-                    try:
-                        #item = model_class.objects.get(id=dev_id)
-                        item = model_class.provider.get(dev_id)
-                    except (model_class.DoesNotExist, Exception):
-                        continue
-
-                    async = gevent.event.AsyncResult()
-                    pool.spawn(check_conditions, item, pids).link(async)
-                    results.append(async)
+                # Only fetch the objects the conditions could be detected on
+                # - along with the related objects their detectors read
+                specs = putils.query_specs(pids)
+                related = putils.query_related(pids)
+                for items in provider.iter_matching(specs, chunk_size, related=related):
+                    # Blocks while the pool is full
+                    pool.spawn(check_conditions, items, pids)
 
                 pool.join()
             except gevent.GreenletExit:
+                # The socket being written to went away, so cleanup
                 log.info("GreenletExit - clean up pool")
-            except:
+                pool.kill()
+                raise
+            except Exception:
                 log.exception("unexpected death")
-            finally:
-                log.error("Killing pools")
-                pool.kill()  # The socket being written to may go away, so cleanup
+                pool.kill()
+            completed.put(done)
 
         def generator():
             yield "Starting to crunch\n"
-            results = []  # Hold asynchronous results from the workers launched by the generator
-            manager = gevent.spawn(data_generator, context_class, options['pids'], results)
-
-            collect_results.wait()
-            done = False
-            yield "Ready for results\n"
-            while not done:
-
-                # Wait some results to be ready from the check_conditions workers
-                ready_results = gevent.wait(results, timeout=4)
-                try:
-                    yield "."  # Periodically send some bits so the connections stays open
-                    for res in ready_results:
-                        results.remove(res)
-                        try:
-                            # Provide html fragments to the generator
-                            ctxt = res.get()
-                            ctxt['conditions'] = map(prep_condition, ctxt['conditions'])
-                            html = render_to_string('proctor/fragments/context_frag.html', ctxt)
-                            log.info('yielding for {}'.format(ctxt['ctxt_id']))
-                            yield "+++{}---".format(html)
-
-                        except GeneratorExit:
-                            raise
-                        except:
-                            # Continue checking items
-                            log.exception("unexpected exception from greenlet")
-
-                except GeneratorExit:
-                    # No one is listening for data - kill the threads and exit clean
-                    log.info("Proctor Generator pre-empted - killing pools (outside loop)")
-                    manager.kill()
-                    log.info("Sent the kill command to manager")
-
-                try:
-                    # Die when the pool is done AND the results are empty
-                    manager.get(block=False)
-                    if not results:
+            manager = gevent.spawn(data_generator, options['pids'])
+            try:
+                metrics.check_all_stats.started(pool_size)
+                yield "Ready for results\n"
+                while True:
+                    try:
+                        ctxt = completed.get(timeout=keepalive)
+                    except gevent.queue.Empty:
+                        yield "."  # Periodically send some bits so the connections stays open
+                        continue
+                    if ctxt is done:
                         log.info("Exiting")
-                        done = True
-                except gevent.Timeout:
-                    pass  # The manager is still working - wait for more results
-                gevent.sleep(2)
+                        break
 
-        if context_class:
+                    try:
+                        # Provide html fragments to the generator
+                        ctxt['conditions'] = map(prep_condition, ctxt['conditions'])
+                        html = render_to_string('proctor/fragments/context_frag.html', ctxt)
+                    except Exception:
+                        log.exception("unexpected exception rendering {}".format(ctxt['ctxt_id']))
+                        continue
+                    log.info('yielding for {}'.format(ctxt['ctxt_id']))
+                    yield "+++{}---".format(html)
+            finally:
+                # No one is listening for data (or all is done) - kill the workers and exit clean
+                manager.kill()
+                metrics.check_all_stats.finished(pool_size)
+
+        if provider is not None:
             try:
                 # TODO: stream json based on same params as individual checks
-                response = http.HttpResponse(generator())
+                # Sent as it is generated - results go out as soon as they are checked
+                response = http.StreamingHttpResponse(generator())
                 response['X-Accel-Buffering'] = "no"
-            except:
+            except Exception:
                 log.exception("unexpected exception")
+                response = http.HttpResponse("Unable to check all {}s".format(model_name), status=500)
         else:
             response = http.HttpResponse(
                 "Unable to check all {}s - You must perform checks for each {}".format(
@@ -315,3 +310,10 @@ class CheckAll(View):
                     model_name),
                 status=400)
         return response
+
+
+class Metrics(View):
+    """Engine metrics for scraping - OpenMetrics text"""
+
+    def get(self, request):
+        return http.HttpResponse(metrics.render(p), content_type=metrics.CONTENT_TYPE)
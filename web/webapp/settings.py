@@ -120,6 +120,27 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Only import the plugin modules of a model when it is first checked
+PROCTOR_LAZY_PLUGINS = os.environ.get('PROCTOR_LAZY_PLUGINS', '') == '1'
+
+# Time the handlers - served with the other engine metrics at /proctor/metrics
+PROCTOR_METRICS = os.environ.get('PROCTOR_METRICS', '') == '1'
+
+# Staff can profile a check (?profile=1 or an X-Proctor-Profile header) - the
+# profiles are kept in this directory when set
+PROCTOR_PROFILE_DIR = os.environ.get('PROCTOR_PROFILE_DIR')
+
+# Prepare the registry before the workers are forked - see Proctor.freeze
+PROCTOR_FREEZE_REGISTRY = os.environ.get('PROCTOR_FREEZE_REGISTRY', '') == '1'
+
+# Checking all the objects of a model (CheckAll): workers checking chunks
+# of items, items fetched per chunk, results waiting to be streamed and
+# seconds between keepalive bits
+PROCTOR_CHECK_ALL_POOL_SIZE = int(os.environ.get('PROCTOR_CHECK_ALL_POOL_SIZE', 10))
+PROCTOR_CHECK_ALL_CHUNK_SIZE = int(os.environ.get('PROCTOR_CHECK_ALL_CHUNK_SIZE', 50))
+PROCTOR_CHECK_ALL_QUEUE_SIZE = int(os.environ.get('PROCTOR_CHECK_ALL_QUEUE_SIZE', 20))
+PROCTOR_CHECK_ALL_KEEPALIVE = float(os.environ.get('PROCTOR_CHECK_ALL_KEEPALIVE', 4))
+
 __LOG_FORMAT = os.environ.get('LOG_FORMAT', '%(asctime)s.%(msecs).03d[%(levelname)0.3s] %(name)s:%(funcName)s.%(lineno)d %(message)s')
 __DATE_FORMAT = os.environ.get('LOG_DATE_FORMAT', '%m-%d %H:%M:%S')
 